@@ -66,6 +66,16 @@ def create_app(config_name="dev"):
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     config[config_name].init_app(app)
 
+    # the address of the client, behind the reverse proxies (see the rate limits)
+    if app.config.get("TRUSTED_PROXIES"):
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["TRUSTED_PROXIES"])
+
+    # encoding of the responses (see app/api/json_encoder.py)
+    from app.api.json_encoder import AdeleJSONEncoder, make_json_dumps
+    app.json_encoder = AdeleJSONEncoder
+    app.json_dumps = make_json_dumps(app.config.get("JSON_ENCODER", "auto"), app.config.get("JSON_INDENT"))
+
     def with_url_prefix(url):
         from flask import request
         return "".join((request.host_url[:-1],  url))
@@ -84,6 +94,8 @@ def create_app(config_name="dev"):
     """
 
     from app import models
+    # keeps the document access index up to date on flush
+    from app import document_access
 
     """
        ========================================================
@@ -98,7 +110,7 @@ def create_app(config_name="dev"):
     # should be added to the access token.
     @app.jwt.user_claims_loader
     def add_claims_to_access_token(user):
-        return user["roles"]
+        return {"user_id": user["user_id"], "roles": user["roles"], "ver": user["ver"]}
 
     # Create a function that will be called whenever create_access_token
     # is used. It will take whatever object is passed into the
@@ -113,10 +125,28 @@ def create_app(config_name="dev"):
         Import utils
     ========================================================
     """
-    from app.utils import get_user_from_username, get_current_user
+    from app.utils import get_user_from_username, get_current_user, forget_current_user
 
     app.get_current_user = get_current_user
     app.get_user_from_username = get_user_from_username
+    # the current user is loaded once per request
+    app.before_request(forget_current_user)
+    app.teardown_request(forget_current_user)
+
+    from app.rate_limits import check_rate_limits
+    app.before_request(check_rate_limits)
+
+    from app.passwords import PasswordHasherBusy
+    from app.utils import make_503
+
+    @app.errorhandler(PasswordHasherBusy)
+    def password_hasher_busy(e):
+        return make_503(str(e), retry_after=e.retry_after)
+
+    if app.config.get("MAIL_OUTBOX_SENDER") == 'thread':
+        # sends the mails left in the outbox by the previous run
+        from app.mail_outbox import wake_mail_sender
+        app.before_first_request(wake_mail_sender)
 
     """
     ========================================================
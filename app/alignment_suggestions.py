@@ -0,0 +1,250 @@
+import math
+import re
+
+from app.locator import TagAwareLocator
+
+"""
+========================================================
+    Transcription/translation alignment suggestions
+========================================================
+
+The plain texts of the transcription and of the translation are cut into segments
+(sentences and clauses ended by strong punctuation, paragraphs). The segments are then
+paired with a length-based dynamic programming alignment (Gale & Church), restricted to
+a band around the diagonal:
+    - when both texts have the same number of paragraphs, the paragraphs are aligned
+      one to one and each pair is aligned separately
+    - the segments ending with the same punctuation or holding the same numbers are
+      favoured (anchors)
+The spans of the aligned segments are mapped back to the HTML contents with the offset map
+of the plain texts, giving (ptr_transcription_start, ptr_transcription_end,
+ptr_translation_start, ptr_translation_end) quadruples.
+"""
+
+SEGMENT_END_REGEX = re.compile(r'[.!?;]+["»”’)\]]*(?=\s|$)|(?=¶)|\n')
+NUMBER_REGEX = re.compile(r'\d+')
+
+# (nb of transcription segments, nb of translation segments): -log(prior)
+BEADS = {
+    (1, 1): -math.log(0.89),
+    (1, 0): -math.log(0.0099 / 2),
+    (0, 1): -math.log(0.0099 / 2),
+    (2, 1): -math.log(0.089 / 2),
+    (1, 2): -math.log(0.089 / 2),
+    (2, 2): -math.log(0.011),
+}
+VARIANCE = 6.8
+ANCHOR_BONUS = 1.0
+NUMBER_PENALTY = 2.0
+MIN_BAND = 10
+SQRT_2 = math.sqrt(2)
+
+
+class Segment(object):
+    __slots__ = ('start', 'end', 'length', 'numbers', 'punctuation', 'paragraph')
+
+    def __init__(self, text, start, end, paragraph):
+        self.start = start
+        self.end = end
+        self.length = end - start
+        self.numbers = frozenset(NUMBER_REGEX.findall(text, start, end))
+        self.punctuation = text[end - 1] if text[end - 1] in '.!?;' else None
+        self.paragraph = paragraph
+
+
+def split_segments(text):
+    """ cut a plain text into segments
+
+    :return: list of Segment, whitespace excluded
+    """
+    segments = []
+    paragraph = 0
+    pos = 0
+    for m in SEGMENT_END_REGEX.finditer(text):
+        _add_segment(segments, text, pos, m.end() if m.group(0) != "\n" else m.start(), paragraph)
+        if m.group(0) == "\n":
+            if segments and segments[-1].paragraph == paragraph:
+                paragraph += 1
+        pos = m.end()
+    _add_segment(segments, text, pos, len(text), paragraph)
+    return segments
+
+
+def _add_segment(segments, text, start, end, paragraph):
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    if start < end:
+        segments.append(Segment(text, start, end, paragraph))
+
+
+def _bead_cost(src, tgt, src_lengths, tgt_lengths, i, j, di, dj, ratio):
+    """ cost of pairing the transcription segments src[i - di:i] with the translation segments tgt[j - dj:j]
+
+    :param src_lengths: prefix sums of the lengths of the transcription segments
+    :param tgt_lengths: prefix sums of the lengths of the translation segments
+    """
+    src_len = src_lengths[i] - src_lengths[i - di]
+    tgt_len = tgt_lengths[j] - tgt_lengths[j - dj]
+    cost = BEADS[(di, dj)]
+    if not di or not dj:
+        return cost + 2 * math.log(1 + src_len + tgt_len)
+
+    mean = (src_len + tgt_len / ratio) / 2
+    delta = (tgt_len - src_len * ratio) / math.sqrt(mean * VARIANCE)
+    cost -= math.log(max(math.erfc(abs(delta) / SQRT_2), 1e-300))
+
+    src_numbers = src[i - 1].numbers if di == 1 else src[i - 1].numbers | src[i - 2].numbers
+    tgt_numbers = tgt[j - 1].numbers if dj == 1 else tgt[j - 1].numbers | tgt[j - 2].numbers
+    if src_numbers or tgt_numbers:
+        cost += NUMBER_PENALTY * len(src_numbers ^ tgt_numbers)
+        if src_numbers == tgt_numbers:
+            cost -= ANCHOR_BONUS
+    if src[i - 1].punctuation is not None and src[i - 1].punctuation == tgt[j - 1].punctuation:
+        cost -= ANCHOR_BONUS
+    return cost
+
+
+def _prefix_lengths(segments):
+    lengths = [0]
+    for segment in segments:
+        lengths.append(lengths[-1] + segment.length)
+    return lengths
+
+
+def align_segments(src, tgt, ratio):
+    """ pair two lists of segments
+
+    The dynamic programming only explores the cells within a band around the diagonal.
+
+    :return: list of beads ((src_start, src_end), (tgt_start, tgt_end)) of segment indices
+    """
+    n, m = len(src), len(tgt)
+    if n == 0 or m == 0:
+        return [((0, n), (0, m))] if n or m else []
+
+    src_lengths = _prefix_lengths(src)
+    tgt_lengths = _prefix_lengths(tgt)
+    band = max(MIN_BAND, abs(n - m) + 2, max(n, m) // 10)
+
+    # row i holds the cells [lows[i], lows[i] + len(costs[i])) of the band
+    lows = []
+    costs = []
+    back = []
+    for i in range(n + 1):
+        center = i * m // n
+        lo, hi = max(0, center - band), min(m, center + band)
+        lows.append(lo)
+        costs.append([math.inf] * (hi - lo + 1))
+        back.append([None] * (hi - lo + 1))
+    costs[0][0] = 0.0
+
+    for i in range(n + 1):
+        lo = lows[i]
+        row = costs[i]
+        for j in range(lo, lo + len(row)):
+            if i == 0 and j == 0:
+                continue
+            best = math.inf
+            best_bead = None
+            for (di, dj) in BEADS:
+                if di > i or dj > j:
+                    continue
+                previous_lo = lows[i - di]
+                previous_row = costs[i - di]
+                if not previous_lo <= j - dj < previous_lo + len(previous_row):
+                    continue
+                previous = previous_row[j - dj - previous_lo]
+                if previous == math.inf:
+                    continue
+                cost = previous + _bead_cost(src, tgt, src_lengths, tgt_lengths, i, j, di, dj, ratio)
+                if cost < best:
+                    best = cost
+                    best_bead = (di, dj)
+            row[j - lo] = best
+            back[i][j - lo] = best_bead
+
+    beads = []
+    i, j = n, m
+    while i > 0 or j > 0:
+        di, dj = back[i][j - lows[i]]
+        beads.append(((i - di, i), (j - dj, j)))
+        i, j = i - di, j - dj
+    beads.reverse()
+    return beads
+
+
+def _merge_empty_beads(beads):
+    """ attach the segments left alone (1-0 and 0-1 beads) to the previous bead, or to the next one """
+    merged = []
+    pending = None
+    for (src_start, src_end), (tgt_start, tgt_end) in beads:
+        if pending is not None:
+            src_start, tgt_start = min(src_start, pending[0]), min(tgt_start, pending[1])
+            pending = None
+        if src_start == src_end or tgt_start == tgt_end:
+            if merged:
+                (p_src_start, _), (p_tgt_start, _) = merged[-1]
+                merged[-1] = ((p_src_start, src_end), (p_tgt_start, tgt_end))
+            else:
+                pending = (src_start, tgt_start)
+            continue
+        merged.append(((src_start, src_end), (tgt_start, tgt_end)))
+    if pending is not None and merged:
+        (_, src_end), (_, tgt_end) = merged[0]
+        merged[0] = ((pending[0], src_end), (pending[1], tgt_end))
+    return merged
+
+
+def _paragraphs(segments):
+    paragraphs = []
+    for segment in segments:
+        if not paragraphs or paragraphs[-1][-1].paragraph != segment.paragraph:
+            paragraphs.append([])
+        paragraphs[-1].append(segment)
+    return paragraphs
+
+
+def suggest_alignments(src_text, src_runs, tgt_text, tgt_runs):
+    """ propose alignments between two plain texts
+
+    :param src_text: plain text of the transcription
+    :param src_runs: offset map of the transcription (see app.plain_text)
+    :param tgt_text: plain text of the translation
+    :param tgt_runs: offset map of the translation
+    :return: list of (ptr_transcription_start, ptr_transcription_end, ptr_translation_start, ptr_translation_end)
+    """
+    src = split_segments(src_text)
+    tgt = split_segments(tgt_text)
+    if not src or not tgt:
+        return []
+    ratio = sum(s.length for s in tgt) / sum(s.length for s in src)
+
+    src_paragraphs = _paragraphs(src)
+    tgt_paragraphs = _paragraphs(tgt)
+    if len(src_paragraphs) == len(tgt_paragraphs):
+        pairs = zip(src_paragraphs, tgt_paragraphs)
+    else:
+        pairs = [(src, tgt)]
+
+    src_locator = TagAwareLocator(src_text, src_runs)
+    tgt_locator = TagAwareLocator(tgt_text, tgt_runs)
+    ptrs = []
+    for src_segments, tgt_segments in pairs:
+        for (src_start, src_end), (tgt_start, tgt_end) in _merge_empty_beads(
+                align_segments(src_segments, tgt_segments, ratio)):
+            ptrs.append((
+                src_locator.to_html(src_segments[src_start].start),
+                src_locator.to_html(src_segments[src_end - 1].end, end=True),
+                tgt_locator.to_html(tgt_segments[tgt_start].start),
+                tgt_locator.to_html(tgt_segments[tgt_end - 1].end, end=True),
+            ))
+    return ptrs
+
+
+def suggest_translation_alignments(transcription, translation):
+    """ propose alignments between a transcription and a translation """
+    src = TagAwareLocator.from_container(transcription)
+    tgt = TagAwareLocator.from_container(translation)
+    return suggest_alignments(src.text, src.runs, tgt.text, tgt.runs)
@@ -0,0 +1,181 @@
+from flask import current_app, request
+from flask_jwt_extended import jwt_required
+from sqlalchemy import and_, bindparam, select
+from sqlalchemy.orm import joinedload
+
+from app import db, api_bp
+from app.api.speech_parts.speech_part_stats import refresh_speech_part_stats
+from app.api.transcriptions.routes import get_reference_transcription
+from app.models import AlignmentDiscours, SpeechPartType
+from app.utils import forbid_if_nor_teacher_nor_admin_and_wants_user_data, make_404, make_200, make_400, \
+    make_403, forbid_if_not_in_whitelist, is_closed, get_doc
+
+"""
+========================================================
+    Speech part alignments
+========================================================
+
+The speech parts aligned by a user on the reference transcription are identified by their range.
+A batch of changes is applied in a single transaction:
+    - a change on a range without segment inserts it
+    - a change on the range of a segment updates its type and its note
+    - a change without type deletes the segment of its range
+with one executemany statement per kind of write.
+"""
+
+
+class SpeechPartChangeError(ValueError):
+    pass
+
+
+def parse_speech_part_changes(changes, content_length, known_types):
+    """ check a batch of changes against the transcription
+
+    :param changes: list of [ptr_start, ptr_end, speech_part_type_id, note] or of the same as dicts
+    :param content_length: length of the transcription content
+    :param known_types: ids of the speech part types
+    :return: dict {(ptr_start, ptr_end): (speech_part_type_id, note)}, the last change of a range wins
+    """
+    if not isinstance(changes, list):
+        raise SpeechPartChangeError("a list of changes is expected")
+    parsed = {}
+    for idx, change in enumerate(changes):
+        if isinstance(change, dict):
+            change = (change.get("ptr_start"), change.get("ptr_end"),
+                      change.get("speech_part_type_id"), change.get("note"))
+        if not isinstance(change, (list, tuple)) or len(change) not in (3, 4):
+            raise SpeechPartChangeError("change %s: (ptr_start, ptr_end, speech_part_type_id, note) expected" % idx)
+        ptr_start, ptr_end, type_id = change[:3]
+        note = change[3] if len(change) == 4 else None
+        try:
+            ptr_start, ptr_end = int(ptr_start), int(ptr_end)
+            type_id = int(type_id) if type_id is not None else None
+        except (TypeError, ValueError):
+            raise SpeechPartChangeError("change %s: the pointers and the type must be integers" % idx)
+        if not 0 <= ptr_start < ptr_end <= content_length:
+            raise SpeechPartChangeError("change %s: range (%s, %s) out of the transcription (length %s)"
+                                        % (idx, ptr_start, ptr_end, content_length))
+        if type_id is not None and type_id not in known_types:
+            raise SpeechPartChangeError("change %s: unknown speech part type %s" % (idx, type_id))
+        parsed[(ptr_start, ptr_end)] = (type_id, note)
+    return parsed
+
+
+def apply_speech_part_changes(transcription_id, user_id, changes):
+    """ insert, update and delete the speech parts of a user on a transcription.
+    The caller is responsible for committing the session.
+
+    :param changes: dict {(ptr_start, ptr_end): (speech_part_type_id, note)}
+    :return: {"inserted": n, "updated": n, "deleted": n}
+    """
+    table = AlignmentDiscours.__table__
+    db.session.flush()
+    existing = {}
+    for row in db.session.execute(select(table.c.id, table.c.ptr_start, table.c.ptr_end).where(and_(
+            table.c.transcription_id == transcription_id, table.c.user_id == user_id))):
+        existing.setdefault((row.ptr_start, row.ptr_end), []).append(row.id)
+
+    inserted, updated, deleted = [], [], []
+    for (ptr_start, ptr_end), (type_id, note) in changes.items():
+        ids = existing.get((ptr_start, ptr_end), [])
+        if type_id is None:
+            deleted.extend(ids)
+        elif ids:
+            # duplicated ranges left by former versions are merged into the first segment
+            updated.append({"_id": ids[0], "_type_id": type_id, "_note": note})
+            deleted.extend(ids[1:])
+        else:
+            inserted.append({"transcription_id": transcription_id, "user_id": user_id,
+                             "speech_part_type_id": type_id, "ptr_start": ptr_start, "ptr_end": ptr_end,
+                             "note": note})
+
+    if deleted:
+        db.session.execute(table.delete().where(table.c.id.in_(deleted)))
+    if updated:
+        db.session.execute(table.update().where(table.c.id == bindparam("_id")).values(
+            speech_part_type_id=bindparam("_type_id"), note=bindparam("_note")), updated)
+    if inserted:
+        db.session.execute(table.insert(), inserted)
+    if deleted or updated:
+        for instance in list(db.session.identity_map.values()):
+            if isinstance(instance, AlignmentDiscours):
+                db.session.expire(instance)
+    return {"inserted": len(inserted), "updated": len(updated), "deleted": len(deleted)}
+
+
+def get_speech_part_alignments(transcription_id, user_id):
+    """ the speech parts of a user, loaded with their type in a single query """
+    return AlignmentDiscours.query.options(
+        joinedload(AlignmentDiscours.speech_part_type).joinedload(SpeechPartType.language)
+    ).filter(
+        AlignmentDiscours.transcription_id == transcription_id,
+        AlignmentDiscours.user_id == user_id
+    ).order_by(AlignmentDiscours.ptr_start, AlignmentDiscours.ptr_end).all()
+
+
+@api_bp.route('/api/<api_version>/documents/<doc_id>/transcriptions/speech-parts/from-user/<user_id>')
+@jwt_required
+def api_get_speech_part_alignments(api_version, doc_id, user_id):
+    forbid = forbid_if_nor_teacher_nor_admin_and_wants_user_data(current_app, user_id)
+    if forbid:
+        return forbid
+
+    transcription = get_reference_transcription(doc_id)
+    if transcription is None:
+        return make_404(details="No transcription available")
+
+    return make_200(data=[al.serialize() for al in get_speech_part_alignments(transcription.id, user_id)])
+
+
+@api_bp.route('/api/<api_version>/documents/<doc_id>/transcriptions/speech-parts/from-user/<user_id>',
+              methods=['PATCH'])
+@jwt_required
+def api_patch_speech_part_alignments(api_version, doc_id, user_id):
+    """
+    {
+        "data": [
+            [ptr_start, ptr_end, speech_part_type_id, note],
+            [ptr_start, ptr_end, null]
+        ]
+    }
+    NB: a change without speech part type deletes the segment of its range
+    """
+    forbid = forbid_if_nor_teacher_nor_admin_and_wants_user_data(current_app, user_id)
+    if forbid:
+        return forbid
+
+    doc = get_doc(doc_id)
+    if doc is None:
+        return make_404()
+    is_not_allowed = forbid_if_not_in_whitelist(current_app, doc)
+    if is_not_allowed:
+        return is_not_allowed
+    if not current_app.get_current_user().is_teacher and doc.is_speechparts_validated:
+        return make_403()
+    forbid = is_closed(doc_id)
+    if forbid:
+        return forbid
+
+    transcription = get_reference_transcription(doc_id)
+    if transcription is None:
+        return make_404(details="Transcription not found")
+
+    data = request.get_json() or {}
+    known_types = set(row[0] for row in db.session.execute(select(SpeechPartType.id)))
+    try:
+        changes = parse_speech_part_changes(data.get("data"), len(transcription.content or ""), known_types)
+    except SpeechPartChangeError as e:
+        return make_400(str(e))
+
+    try:
+        report = apply_speech_part_changes(transcription.id, int(user_id), changes)
+        refresh_speech_part_stats(doc_id, user_id)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(str(e))
+        return make_400(str(e))
+
+    return make_200(data=dict(report, speech_parts=[
+        al.serialize() for al in get_speech_part_alignments(transcription.id, user_id)
+    ]))
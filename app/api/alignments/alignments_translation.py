@@ -1,63 +1,135 @@
-from itertools import zip_longest
+import datetime
+import heapq
+import json
 import re
+from bisect import bisect_right
+from html import unescape
+from itertools import zip_longest
 
-from flask import current_app, request
+from flask import current_app, request, Response
 from flask_jwt_extended import jwt_required
 from markupsafe import Markup
-from bs4 import BeautifulSoup
+from sqlalchemy import and_
 
 from app import auth, db, api_bp
+from app.alignment_suggestions import suggest_translation_alignments
 from app.api.transcriptions.routes import get_reference_transcription, add_notes_refs_to_text, ETAG, BTAG
 from app.api.translations.routes import get_reference_translation
-from app.models import AlignmentTranslation, Transcription, Document, Translation
+from app.models import AlignmentTranslation, Transcription, Document, Translation, AlignmentViewCache
 from app.utils import forbid_if_nor_teacher_nor_admin_and_wants_user_data, make_404, make_200, make_400, \
-    forbid_if_not_in_whitelist
+    forbid_if_not_in_whitelist, content_hash
 
 
 SEGMENT_REGEX = re.compile('<\W*adele-segment\W*>\W*<\/\W*adele-segment\W*>')
 
+# tags and comments of the contents, read in a single pass by split_segments()
+TAG_REGEX = re.compile(r'<!--.*?-->|<(/?)([a-zA-Z][^\t\n\r\f />\x00]*)((?:[^>"\']|"[^"]*"|\'[^\']*\')*)>', re.S)
+ATTR_REGEX = re.compile(r'([^\s/>=]+)(?:\s*=\s*("[^"]*"|\'[^\']*\'|[^\s>]*))?')
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source',
+                 'track', 'wbr'}
 
-def _build_segment(str_segment, tags_to_reopen, tags_to_close):
-    segment_parts = []
-    for tag in tags_to_reopen:
-        segment_parts.append(f"<{tag['name']}")
-        for name, value in tag["attr"].items():
-            segment_parts.append(f' {name}="{value}"')
-        segment_parts.append(">")
-    segment_parts.append(str_segment)
-    for tag in tags_to_close:
-        segment_parts.append(f"</{tag['name']}>")
-    return "".join(segment_parts)
+
+def _open_tag(name, attrs):
+    """ markup reopening a tag in a segment """
+    attributes = {}
+    for m in ATTR_REGEX.finditer(attrs):
+        value = m.group(2) or ""
+        if value[:1] in ('"', "\'"):
+            value = value[1:-1]
+        # the last occurrence of an attribute wins
+        attributes[m.group(1).lower()] = unescape(value)
+    return "<%s%s>" % (name, "".join(' %s="%s"' % (k, v) for k, v in attributes.items()))
 
 
 def split_segments(html):
-    dom = BeautifulSoup(html, "html.parser")
-    raw_segments = SEGMENT_REGEX.split(html)
+    """ split a content on its <adele-segment></adele-segment> markers
+
+    The tags open at a marker are closed at the end of the segment and reopened at the
+    beginning of the next one, so that each segment is balanced.
+    The content is read once, keeping the stack of the open tags.
+
+    :param html: the content
+    :return: the list of the segments
+    """
     segments = []
-    tags_to_reopen = []
-    for idx, segment in enumerate(dom.find_all("adele-segment")):
-        encountered_tags = []
-        for tag in segment.parents:
-            if not tag or type(tag) == BeautifulSoup:
+    stack = []
+    tags_to_reopen = ""
+    segment_start = 0
+    pos = 0
+    while True:
+        m = TAG_REGEX.search(html, pos)
+        if m is None:
+            break
+        pos = m.end()
+        if m.group(2) is None:
+            # comment
+            continue
+        closing, name, attrs = m.group(1), m.group(2).lower(), m.group(3)
+
+        if closing:
+            for idx in range(len(stack) - 1, -1, -1):
+                if stack[idx][0] == name:
+                    del stack[idx:]
+                    break
+            continue
+
+        if name == "adele-segment":
+            marker = SEGMENT_REGEX.match(html, m.start())
+            if marker is not None:
+                segments.append("".join((
+                    tags_to_reopen,
+                    html[segment_start:m.start()],
+                    "".join("</%s>" % tag_name for tag_name, _ in reversed(stack))
+                )))
+                tags_to_reopen = "".join(_open_tag(tag_name, tag_attrs) for tag_name, tag_attrs in stack)
+                segment_start = pos = marker.end()
                 continue
-            encountered_tags.append(
-                {
-                    "name": tag.name,
-                    "attr": tag.attrs,
-                }
-            )
-        segments.append(
-            # we use ::-1 to reverse the list, because what we first close will be last opened
-            _build_segment(raw_segments[idx], tags_to_reopen[::-1], encountered_tags)
-        )
-        tags_to_reopen = encountered_tags
-    segments.append(
-        # we use ::-1 to reverse the list, because what we first close will be last opened
-        _build_segment(raw_segments[-1], tags_to_reopen[::-1], [])
-    )
+
+        if name not in VOID_ELEMENTS and not attrs.rstrip().endswith("/"):
+            stack.append((name, attrs))
+
+    segments.append(tags_to_reopen + html[segment_start:])
     return segments
 
 
+def delete_translation_alignments(transcription_id, translation_id):
+    """ delete the alignments of a transcription and a translation in a single statement """
+    table = AlignmentTranslation.__table__
+    return db.session.execute(table.delete().where(and_(
+        table.c.transcription_id == transcription_id,
+        table.c.translation_id == translation_id
+    ))).rowcount
+
+
+def replace_translation_alignments(transcription_id, translation_id, ptrs):
+    """ replace the alignments of a transcription and a translation (TRUNCATE AND REPLACE)
+    with one DELETE and one executemany INSERT
+
+    :param ptrs: list of (ptr_transcription_start, ptr_transcription_end,
+                          ptr_translation_start, ptr_translation_end)
+    :return: the inserted pointers
+    """
+    rows = []
+    inserted = []
+    for (ptr_transcription_start, ptr_transcription_end,
+         ptr_translation_start, ptr_translation_end) in ptrs:
+        rows.append({
+            "transcription_id": transcription_id,
+            "translation_id": translation_id,
+            "ptr_transcription_start": ptr_transcription_start,
+            "ptr_transcription_end": ptr_transcription_end,
+            "ptr_translation_start": ptr_translation_start,
+            "ptr_translation_end": ptr_translation_end
+        })
+        inserted.append((ptr_transcription_start, ptr_transcription_end,
+                         ptr_translation_start, ptr_translation_end))
+
+    delete_translation_alignments(transcription_id, translation_id)
+    if rows:
+        db.session.execute(AlignmentTranslation.__table__.insert(), rows)
+    return inserted
+
+
 @api_bp.route('/api/<api_version>/documents/<doc_id>/transcriptions/alignments/from-user/<user_id>')
 @jwt_required
 def api_get_alignment_translation_from_user(api_version, doc_id, user_id):
@@ -88,6 +160,31 @@ def api_get_alignment_translation_from_user(api_version, doc_id, user_id):
     return make_200(data=ptrs)
 
 
+@api_bp.route('/api/<api_version>/documents/<doc_id>/transcriptions/alignments/suggestions/from-user/<user_id>')
+@jwt_required
+def api_get_alignment_translation_suggestions(api_version, doc_id, user_id):
+    """
+        Alignments proposed between the reference transcription and the user's translation.
+        Nothing is saved: the alignments are posted back once reviewed.
+    """
+    from app.api.transcriptions.routes import get_reference_transcription
+    from app.api.translations.routes import get_translation
+
+    forbid = forbid_if_nor_teacher_nor_admin_and_wants_user_data(current_app, user_id)
+    if forbid:
+        return forbid
+
+    transcription = get_reference_transcription(doc_id)
+    if transcription is None:
+        return make_404(details="No transcription available")
+
+    translation = get_translation(doc_id=doc_id, user_id=user_id)
+    if translation is None:
+        return make_404(details="No translation available")
+
+    return make_200(data=suggest_translation_alignments(transcription, translation))
+
+
 @api_bp.route('/api/<api_version>/documents/<doc_id>/transcriptions/alignments')
 def api_get_alignment_translation(api_version, doc_id):
     from app.api.transcriptions.routes import get_reference_transcription
@@ -136,30 +233,8 @@ def api_post_translation_alignments(api_version, doc_id, user_id):
 
     data = request.get_json()
     data = data.get("data", [])
-    ptrs = []
     try:
-        # TRUNCATE
-        for old_al in AlignmentTranslation.query.filter(
-                AlignmentTranslation.transcription_id == transcription.id,
-                AlignmentTranslation.translation_id == translation.id
-        ).all():
-            db.session.delete(old_al)
-
-        # INSERT
-        for (ptr_transcription_start, ptr_transcription_end,
-             ptr_translation_start, ptr_translation_end) in data:
-            new_al = AlignmentTranslation(
-                transcription_id=transcription.id,
-                translation_id=translation.id,
-                ptr_transcription_start=ptr_transcription_start,
-                ptr_transcription_end=ptr_transcription_end,
-                ptr_translation_start=ptr_translation_start,
-                ptr_translation_end=ptr_translation_end
-            )
-            db.session.add(new_al)
-            ptrs.append((new_al.ptr_transcription_start, new_al.ptr_transcription_end,
-                         new_al.ptr_translation_start, new_al.ptr_translation_end))
-
+        ptrs = replace_translation_alignments(transcription.id, translation.id, data)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
@@ -188,12 +263,7 @@ def api_delete_translation_alignments(api_version, doc_id, user_id):
         return make_404(details="Translation not found")
 
     try:
-        # TRUNCATE
-        for old_al in AlignmentTranslation.query.filter(
-                AlignmentTranslation.transcription_id == transcription.id,
-                AlignmentTranslation.translation_id == translation.id
-        ).all():
-            db.session.delete(old_al)
+        delete_translation_alignments(transcription.id, translation.id)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
@@ -203,6 +273,81 @@ def api_delete_translation_alignments(api_version, doc_id, user_id):
     return make_200(data=[])
 
 
+def _classify_notes(note_ptrs, al_ptr_start, al_ptr_end):
+    """ place the notes relatively to an alignment, by looking at every note
+
+    :return: (overlapping note idx, first before note idx, nb before, nb between, nb after)
+    """
+    overlapping = None
+    first_before = None
+    nb_before = nb_between = nb_after = 0
+    for idx, (ptr_start, ptr_end) in enumerate(note_ptrs):
+        if ptr_start < al_ptr_start and ptr_end > al_ptr_end:
+            overlapping = idx  # note englobant au moins une ligne en totalité
+        elif (al_ptr_start <= ptr_start <= al_ptr_end) and (al_ptr_start <= ptr_end <= al_ptr_end):
+            nb_between += 1  # note présente au sein d'un alignement
+        elif ptr_start <= al_ptr_end <= ptr_end:
+            nb_after += 1  # note finissant sur la ligne suivante
+        elif ptr_start <= al_ptr_start <= ptr_end:
+            nb_before += 1  # note commencant sur la ligne précédente
+            if first_before is None:
+                first_before = idx
+    return overlapping, first_before, nb_before, nb_between, nb_after
+
+
+def place_notes_in_alignments(note_ptrs, al_ptrs):
+    """ place the notes relatively to each alignment (see _classify_notes)
+
+    The alignments are swept by increasing start, keeping the notes which span
+    the start of the current alignment in a heap ordered by their end: each
+    alignment only looks at the notes it intersects.
+
+    :param note_ptrs: list of (ptr_start, ptr_end), in the order of the notes
+    :param al_ptrs: list of (ptr_start, ptr_end), in the order of the alignments
+    :return: one placement per alignment, in the order of the alignments
+    """
+    if any(ptr_start > ptr_end for ptr_start, ptr_end in note_ptrs) or \
+            any(ptr_start > ptr_end for ptr_start, ptr_end in al_ptrs):
+        return [_classify_notes(note_ptrs, al_ptr_start, al_ptr_end) for al_ptr_start, al_ptr_end in al_ptrs]
+
+    notes_order = sorted(range(len(note_ptrs)), key=lambda idx: note_ptrs[idx][0])
+    starts = [note_ptrs[idx][0] for idx in notes_order]
+    placements = [None] * len(al_ptrs)
+    spanning = []
+    next_note = 0
+    for num_al in sorted(range(len(al_ptrs)), key=lambda num: al_ptrs[num][0]):
+        al_ptr_start, al_ptr_end = al_ptrs[num_al]
+        while next_note < len(starts) and starts[next_note] < al_ptr_start:
+            idx = notes_order[next_note]
+            heapq.heappush(spanning, (note_ptrs[idx][1], idx))
+            next_note += 1
+        while spanning and spanning[0][0] < al_ptr_start:
+            heapq.heappop(spanning)
+
+        overlapping = None
+        first_before = None
+        nb_before = nb_between = nb_after = 0
+        # notes starting before the alignment
+        for ptr_end, idx in spanning:
+            if ptr_end > al_ptr_end:
+                if overlapping is None or idx > overlapping:
+                    overlapping = idx
+            elif ptr_end == al_ptr_end:
+                nb_after += 1
+            else:
+                nb_before += 1
+                if first_before is None or idx < first_before:
+                    first_before = idx
+        # notes starting within the alignment
+        for pos in range(next_note, bisect_right(starts, al_ptr_end, next_note)):
+            if note_ptrs[notes_order[pos]][1] <= al_ptr_end:
+                nb_between += 1
+            else:
+                nb_after += 1
+        placements[num_al] = (overlapping, first_before, nb_before, nb_between, nb_after)
+    return placements
+
+
 def add_notes_refs(tr, tl):
     all_al = AlignmentTranslation.query.filter(AlignmentTranslation.transcription_id == tr["id"],
                                                AlignmentTranslation.translation_id == tl["id"]).all()
@@ -213,44 +358,30 @@ def add_notes_refs(tr, tl):
     def insert_notes_into_al(content, notes, get_al_start_ptr, get_al_end_ptr):
         offset = 0
         content_w_notes = []
+        len_btag = len(BTAG.format(1))
 
-        for num_al, al in enumerate(all_al):
-
-            after_notes = []
-            before_notes = []
-            between_notes = []
-            overlapping_note = None
-            al_ptr_start = get_al_start_ptr(al)
-            al_ptr_end = get_al_end_ptr(al)
-
-            for note in notes:
-                if int(note["ptr_start"]) < al_ptr_start and \
-                        int(note["ptr_end"]) > al_ptr_end:
-                    overlapping_note = note  # note englobant au moins une ligne en totalité
-                elif (al_ptr_start <= int(note["ptr_start"]) <= al_ptr_end) and \
-                        (al_ptr_start <= int(note["ptr_end"]) <= al_ptr_end):
-                    between_notes.append(note) # note présente au sein d'un alignement
-                elif int(note["ptr_start"]) <= al_ptr_end <= int(note["ptr_end"]):
-                    after_notes.append(note)  # note finissant sur la ligne suivante
-                elif int(note["ptr_start"]) <= al_ptr_start <= int(note["ptr_end"]):
-                    before_notes.append(note)  # note commencant sur la ligne précédente
+        al_ptrs = [(get_al_start_ptr(al), get_al_end_ptr(al)) for al in all_al]
+        note_ptrs = [(int(note["ptr_start"]), int(note["ptr_end"])) for note in notes]
+        placements = place_notes_in_alignments(note_ptrs, al_ptrs)
+
+        for (al_ptr_start, al_ptr_end), placement in zip(al_ptrs, placements):
+            overlapping, first_before, nb_before, nb_between, nb_after = placement
 
             # transcription al
             ptr_start = al_ptr_start + offset
-            offset += len(ETAG) * len(before_notes)
-            offset += (len(BTAG.format(1)) + len(ETAG)) * len(between_notes)
-            offset += len(BTAG.format(1)) * len(after_notes)
+            offset += len(ETAG) * nb_before
+            offset += (len_btag + len(ETAG)) * nb_between
+            offset += len_btag * nb_after
             ptr_end = al_ptr_end + offset
 
             text = content[ptr_start:ptr_end]
 
-            if overlapping_note:
-                text = "{BTAG}{al}{ETAG}".format(BTAG=BTAG.format(overlapping_note["id"]), ETAG=ETAG, al=text)
-            elif len(before_notes) > 0:
-                current_note_id = before_notes[0]["id"]
-                text = "{BTAG}{al}".format(BTAG=BTAG.format(current_note_id), al=text)
-            elif len(after_notes) > 0:
-                text = "{al}{ETAG}".format(ETAG=ETAG, al=text)
+            if overlapping is not None:
+                text = "".join((BTAG.format(notes[overlapping]["id"]), text, ETAG))
+            elif first_before is not None:
+                text = "".join((BTAG.format(notes[first_before]["id"]), text))
+            elif nb_after > 0:
+                text = "".join((text, ETAG))
 
             content_w_notes.append(Markup(text))
         return content_w_notes
@@ -270,24 +401,106 @@ def add_notes_refs(tr, tl):
 
     return tr_w_notes, tl_w_notes, notes, len(all_al)
 
+
+def reference_content_hashes(doc_id):
+    """ ids and content hashes of the reference transcription and translation, read without the contents
+
+    :return: (transcription_id, transcription_hash, translation_id, translation_hash) or None
+    """
+    return db.session.query(
+        Transcription.id, Transcription.content_hash, Translation.id, Translation.content_hash
+    ).select_from(Document).join(
+        Transcription, and_(Transcription.doc_id == Document.id, Transcription.user_id == Document.user_id)
+    ).join(
+        Translation, and_(Translation.doc_id == Document.id, Translation.user_id == Document.user_id)
+    ).filter(
+        Document.id == doc_id,
+        Document.is_transcription_validated.is_(True),
+        Document.is_translation_validated.is_(True)
+    ).first()
+
+
+def stored_content_hash(model, container_id, stored_hash):
+    """ hash of a content, stored on its row by the rows written before the hashes were kept """
+    if stored_hash is not None:
+        return stored_hash
+    container = model.query.get(container_id)
+    container.content_hash = content_hash(container.content)
+    return container.content_hash
+
+
+def get_alignment_view(doc_id, transcription, translation):
+    """ segments of the reference transcription and translation, paired
+
+    The pairs are cached in AlignmentViewCache and computed again when
+    the hash of one of the contents changes.
+
+    :return: the AlignmentViewCache of the document
+    """
+    cached = AlignmentViewCache.query.filter(AlignmentViewCache.doc_id == doc_id).first()
+    if cached is not None and cached.transcription_hash == transcription.content_hash \
+            and cached.translation_hash == translation.content_hash:
+        return cached
+
+    alignments = list(zip_longest(split_segments(transcription.content), split_segments(translation.content),
+                                  fillvalue=''))
+
+    if cached is None:
+        cached = AlignmentViewCache(doc_id=doc_id)
+        db.session.add(cached)
+    cached.transcription_hash = transcription.content_hash
+    cached.translation_hash = translation.content_hash
+    cached.etag = content_hash(transcription.content_hash + translation.content_hash)
+    cached.nb_alignments = len(alignments)
+    cached.alignments = json.dumps(alignments, ensure_ascii=False, separators=(',', ':'))
+    cached.date_update = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    try:
+        db.session.commit()
+    except Exception as e:
+        # another request has stored the same pairs meanwhile
+        db.session.rollback()
+        print(str(e))
+        cached = AlignmentViewCache.query.filter(AlignmentViewCache.doc_id == doc_id).one()
+
+    return cached
+
+
 @api_bp.route('/api/<api_version>/documents/<doc_id>/view/transcription-alignment')
 def view_document_translation_alignment(api_version, doc_id):
-    translation = get_reference_translation(doc_id)
-    transcription = get_reference_transcription(doc_id)
-
-    if not transcription or not translation:
+    refs = reference_content_hashes(doc_id)
+    if refs is None:
         return make_404()
-    splitted_transcription = split_segments(transcription.content)
-    splitted_translation = split_segments(translation.content)
-    alignments = list(zip_longest(splitted_transcription, splitted_translation, fillvalue=''))
 
-    if len(alignments) <= 1:
+    transcription_id, transcription_hash, translation_id, translation_hash = refs
+    transcription_hash = stored_content_hash(Transcription, transcription_id, transcription_hash)
+    translation_hash = stored_content_hash(Translation, translation_id, translation_hash)
+    etag = content_hash(transcription_hash + translation_hash)
+
+    # neither the contents nor the cached pairs are read to answer 304
+    if etag in request.if_none_match:
+        db.session.commit()
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    cached = AlignmentViewCache.query.filter(AlignmentViewCache.doc_id == doc_id).first()
+    if cached is None or cached.etag != etag:
+        cached = get_alignment_view(int(doc_id), Transcription.query.get(transcription_id),
+                                    Translation.query.get(translation_id))
+    else:
+        db.session.commit()
+
+    if cached.nb_alignments <= 1:
         return make_404(details="Aucun alignement")
 
-    return make_200({
-        "doc_id": doc_id,
-        "alignments": alignments
-    })
+    # the cached json text of the pairs is written as is into the response
+    response = Response(
+        '{"data":{"doc_id":%s,"alignments":%s}}' % (json.dumps(doc_id), cached.alignments),
+        status=200,
+        content_type="application/json; charset=utf-8"
+    )
+    response.set_etag(cached.etag)
+    return response
 
 
 def clone_translation_alignments(doc_id, old_user_id, user_id):
@@ -0,0 +1,88 @@
+from sqlalchemy.orm import joinedload
+
+from app.models import Note, TranscriptionHasNote, TranslationHasNote, CommentaryHasNote, AlignmentTranslation, \
+    AlignmentImage, AlignmentDiscours
+
+"""
+========================================================
+    Annotations overlapping a range of a content
+========================================================
+
+The annotations of a container (transcription, translation or commentary) are its notes
+and, depending on the container, its translation alignments, image alignments and speech parts.
+
+A range [ptr_start, ptr_end] overlaps the selection [start, end] when ptr_start <= end and
+ptr_end >= start: the ranges touching the selection are included. The predicate runs in SQL,
+on the (container, ptr_start) indexes of the annotation tables, so that only the overlapping
+annotations are read.
+"""
+
+ANNOTATION_KINDS = ("transcription", "translation", "commentary")
+ANNOTATION_CATEGORIES = ("notes", "translation_alignments", "image_alignments", "speech_parts")
+
+HAS_NOTE_MODELS = {
+    "transcription": (TranscriptionHasNote, TranscriptionHasNote.transcription_id),
+    "translation": (TranslationHasNote, TranslationHasNote.translation_id),
+    "commentary": (CommentaryHasNote, CommentaryHasNote.commentary_id),
+}
+
+
+def _serialize_note(note, has_note):
+    data = note.serialize()
+    data["ptr_start"] = has_note.ptr_start
+    data["ptr_end"] = has_note.ptr_end
+    return data
+
+
+def _overlapping(query, ptr_start, ptr_end, start, end):
+    """ the rows of a query whose range overlaps [start, end], by increasing start """
+    return query.filter(ptr_start <= end, ptr_end >= start).order_by(ptr_start, ptr_end)
+
+
+def find_annotations_in_range(kind, container, user_id, start, end):
+    """ annotations of a container overlapping [start, end], grouped by category
+
+    :param kind: transcription, translation or commentary
+    :param container: the Transcription, Translation or Commentary
+    :param user_id: owner of the image alignments and speech parts
+    :return: {category: [annotation, ...]} with the annotations sorted by start
+    """
+    found = {category: [] for category in ANNOTATION_CATEGORIES}
+
+    has_note_model, container_column = HAS_NOTE_MODELS[kind]
+    query = has_note_model.query.join(Note, Note.id == has_note_model.note_id).filter(
+        container_column == container.id).with_entities(has_note_model, Note)
+    found["notes"] = [
+        _serialize_note(note, has_note)
+        for has_note, note in _overlapping(query, has_note_model.ptr_start, has_note_model.ptr_end, start, end)
+    ]
+
+    if kind == "transcription":
+        query = AlignmentTranslation.query.filter(AlignmentTranslation.transcription_id == container.id)
+        found["translation_alignments"] = [
+            [al.ptr_transcription_start, al.ptr_transcription_end, al.ptr_translation_start, al.ptr_translation_end]
+            for al in _overlapping(query, AlignmentTranslation.ptr_transcription_start,
+                                   AlignmentTranslation.ptr_transcription_end, start, end)
+        ]
+        query = AlignmentImage.query.filter(AlignmentImage.transcription_id == container.id,
+                                            AlignmentImage.user_id == user_id)
+        found["image_alignments"] = [
+            al.serialize()
+            for al in _overlapping(query, AlignmentImage.ptr_transcription_start,
+                                   AlignmentImage.ptr_transcription_end, start, end)
+        ]
+        query = AlignmentDiscours.query.options(joinedload(AlignmentDiscours.speech_part_type)).filter(
+            AlignmentDiscours.transcription_id == container.id, AlignmentDiscours.user_id == user_id)
+        found["speech_parts"] = [
+            al.serialize()
+            for al in _overlapping(query, AlignmentDiscours.ptr_start, AlignmentDiscours.ptr_end, start, end)
+        ]
+    elif kind == "translation":
+        query = AlignmentTranslation.query.filter(AlignmentTranslation.translation_id == container.id)
+        found["translation_alignments"] = [
+            [al.ptr_transcription_start, al.ptr_transcription_end, al.ptr_translation_start, al.ptr_translation_end]
+            for al in _overlapping(query, AlignmentTranslation.ptr_translation_start,
+                                   AlignmentTranslation.ptr_translation_end, start, end)
+        ]
+
+    return found
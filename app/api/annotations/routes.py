@@ -0,0 +1,115 @@
+from flask import current_app, request
+from flask_jwt_extended import jwt_required
+
+from app import api_bp
+from app.api.annotations.annotation_index import ANNOTATION_KINDS, find_annotations_in_range
+from app.locator import TagAwareLocator, DEFAULT_MIN_SCORE
+from app.utils import forbid_if_nor_teacher_nor_admin_and_wants_user_data, make_200, make_400, make_404
+
+
+def get_annotated_container(kind, doc_id, user_id, type_id=None):
+    """ the transcription, translation or commentary of a user
+
+    :return: (container, error response)
+    """
+    from app.api.transcriptions.routes import get_transcription
+    from app.api.translations.routes import get_translation
+    from app.api.commentaries.routes import get_commentary
+
+    if kind == "transcription":
+        container = get_transcription(doc_id, user_id)
+    elif kind == "translation":
+        container = get_translation(doc_id, user_id)
+    else:
+        if type_id is None:
+            return None, make_400(details="'type_id' is required for commentaries")
+        container = get_commentary(doc_id, user_id, type_id)
+    if container is None:
+        return None, make_404(details="No %s available" % kind)
+    return container, None
+
+
+@api_bp.route('/api/<api_version>/documents/<doc_id>/annotations/from-user/<user_id>')
+@jwt_required
+def api_get_annotations_in_range(api_version, doc_id, user_id):
+    """
+    Annotations (notes, alignments, speech parts) overlapping a range of a user's content
+
+    ?on=transcription|translation|commentary (default: transcription)
+    &start=<ptr>&end=<ptr>
+    &type_id=<commentary type> (commentary only)
+
+    :return: {"on", "start", "end", "notes": [], "translation_alignments": [], "image_alignments": [],
+              "speech_parts": []}
+    """
+    forbid = forbid_if_nor_teacher_nor_admin_and_wants_user_data(current_app, user_id)
+    if forbid:
+        return forbid
+
+    kind = request.args.get("on", "transcription")
+    if kind not in ANNOTATION_KINDS:
+        return make_400(details="'on' must be one of %s" % ", ".join(ANNOTATION_KINDS))
+    try:
+        start = int(request.args["start"])
+        end = int(request.args["end"])
+    except (KeyError, ValueError):
+        return make_400(details="'start' and 'end' pointers are required")
+    if start > end:
+        return make_400(details="'start' must not be greater than 'end'")
+
+    container, error = get_annotated_container(kind, doc_id, user_id, request.args.get("type_id"))
+    if error:
+        return error
+
+    data = find_annotations_in_range(kind, container, int(user_id), start, end)
+    data.update({"on": kind, "start": start, "end": end})
+    return make_200(data=data)
+
+
+@api_bp.route('/api/<api_version>/documents/<doc_id>/locate/from-user/<user_id>', methods=['POST'])
+@jwt_required
+def api_post_locate_in_content(api_version, doc_id, user_id):
+    """
+    Find phrases in a user's content and map positions of its plain text to the content, in a batch
+    {
+        "data": {
+            "on": "transcription|translation|commentary",
+            "type_id": <commentary type> (commentary only),
+            "phrases": ["phrase", ...] or [{"phrase": "phrase", "start": <ptr to search from>}, ...],
+            "min_score": 0.6,
+            "text_offsets": [<plain text position>, ...],
+            "html_offsets": [<content position>, ...]
+        }
+    }
+
+    :return: {"phrases": [{"ptr_start", "ptr_end", "score"} or null, ...],
+              "text_offsets": [<content position>, ...], "html_offsets": [<plain text position>, ...]}
+    """
+    forbid = forbid_if_nor_teacher_nor_admin_and_wants_user_data(current_app, user_id)
+    if forbid:
+        return forbid
+
+    data = request.get_json().get("data", {})
+    kind = data.get("on", "transcription")
+    if kind not in ANNOTATION_KINDS:
+        return make_400(details="'on' must be one of %s" % ", ".join(ANNOTATION_KINDS))
+
+    container, error = get_annotated_container(kind, doc_id, user_id, data.get("type_id"))
+    if error:
+        return error
+
+    locator = TagAwareLocator.from_container(container)
+    try:
+        min_score = float(data.get("min_score", DEFAULT_MIN_SCORE))
+        phrases = []
+        for query in data.get("phrases", []):
+            if not isinstance(query, dict):
+                query = {"phrase": query}
+            found = locator.find(str(query["phrase"]), int(query.get("start", 0)), min_score)
+            phrases.append(None if found is None else dict(zip(("ptr_start", "ptr_end", "score"), found)))
+        text_offsets = [locator.to_html(int(pos)) for pos in data.get("text_offsets", [])]
+        html_offsets = [locator.to_text(int(pos)) for pos in data.get("html_offsets", [])]
+    except (KeyError, TypeError, ValueError) as e:
+        return make_400(details="Malformed query: %s" % str(e))
+
+    return make_200(data={"phrases": phrases, "text_offsets": text_offsets, "html_offsets": html_offsets})
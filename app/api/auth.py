@@ -1,9 +1,9 @@
 import datetime
-import string
-from random import randint, random, choice
 
 from flask import jsonify, request, url_for, app, current_app
 from flask_jwt_extended import (
+    create_access_token,
+    create_refresh_token,
     jwt_required,
     unset_refresh_cookies,
     unset_access_cookies
@@ -12,15 +12,35 @@ from flask_mail import Message
 import jwt
 import jwt.exceptions
 from sqlalchemy import or_
-from werkzeug.security import check_password_hash, generate_password_hash
 
-from app import api_bp, make_403, db, mail
+from app import api_bp, make_403, db
+from app.invitations import invitation_message, invite_users, make_password, parse_roster
+from app.mail_outbox import queue_mail, wake_mail_sender
 from app.models import User, Role
+from app.passwords import PasswordHasherBusy, check_password, get_password_hasher, hash_password, needs_rehash
+from app.token_versions import get_token_version
 
-from app.utils import make_401, forbid_if_nor_teacher_nor_admin, make_400, make_200
+from app.utils import make_401, forbid_if_nor_teacher_nor_admin, forbid_if_not_admin, make_400, make_200
 from .. import config
 
 
+def create_tokens(user, expires_delta=None):
+    """ access and refresh tokens of a user. The access token claims the id, the roles
+    and the token version of the user (see app/token_versions.py)
+
+    :param expires_delta: lifetime of the access token, JWT_ACCESS_TOKEN_EXPIRES when None
+    :return: (identity data, access token, refresh token)
+    """
+    data = {
+        "email": user.email,
+        "user_id": user.id,
+        "roles": sorted(user.role_names),
+        "ver": get_token_version(user.id),
+    }
+    access_token = create_access_token(identity=data, expires_delta=expires_delta)
+    return data, access_token, create_refresh_token(identity=data)
+
+
 @api_bp.route('/api/<api_version>/logout')
 def logout(api_version):
     resp = jsonify({})
@@ -40,18 +60,22 @@ def login(api_version):
         print("User unknown")
         return make_401("User unknown")
 
-    passwords_match = check_password_hash(user.password, password)
+    passwords_match = check_password(user.password, password)
     if not passwords_match:
         print("Invalid credentials")
         return make_401("Invalid credentials")
 
-    token = jwt.encode({
-        'sub': user.email,
-        'iat': datetime.datetime.utcnow(),
-        'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=60*24)},
-        current_app.config['SECRET_KEY'])
+    if needs_rehash(user.password):
+        # best effort: with a busy hasher, the old hash is kept until a later login
+        try:
+            user.password = hash_password(password)
+            db.session.commit()
+        except PasswordHasherBusy:
+            print("Password not rehashed: the hasher is busy")
 
-    return jsonify({'token': token.decode('UTF-8'), 'user_data': user.serialize()})
+    data, token, refresh_token = create_tokens(user, expires_delta=datetime.timedelta(minutes=60*24))
+
+    return jsonify({'token': token, 'user_data': user.serialize()})
 
 
 @api_bp.route('/api/<api_version>/invite-user', methods=['POST'])
@@ -68,23 +92,19 @@ def invite_user(api_version):
         return make_401("Email unknown")
 
     username = email.split('@')[0]
-    password = ''.join(choice(string.ascii_letters) for i in range(5)) + str(randint(1, 100)).zfill(3)
-
-    msg = Message('Contribute to Adele', sender=current_app.config['MAIL_USERNAME'], recipients=[email])
-    msg.body = "Vous avez été invité(e) à contribuer au projet Adele (" \
-               "https://dev.chartes.psl.eu/adele/profile).\nIdentifiant: %s\nMot de passe: %s\nN'oubliez pas de " \
-               "changer votre mot de passe après votre première connexion !" % (email, password)
+    password = make_password()
+    msg = invitation_message(email, password)
 
     print(email, role)
     print(msg.body)
 
+    # out of the try: a busy hasher answers 503
+    password_hash = hash_password(password)
     try:
-        new_user = User(username=username, password=generate_password_hash(password), email=email,
+        new_user = User(username=username, password=password_hash, email=email,
                         first_name=username, last_name=username,
                         active=True, email_confirmed_at=datetime.datetime.now())
 
-        print('checkpassword:', check_password_hash(new_user.password, password))
-
         if role not in ('student', 'teacher', 'admin'):
             role = 'student'
 
@@ -96,14 +116,54 @@ def invite_user(api_version):
             new_user.roles = Role.query.filter(Role.id >= 2).all()
 
         db.session.add(new_user)
+        # the invitation is sent only if the user is created
+        queue_mail(msg)
         db.session.commit()
     except Exception as e:
         print(f'cannot invite user ({username}, {email}): {str(e)}')
         db.session.rollback()
         return make_400("Cannot invite user: %s" % str(e))
 
-    mail.send(msg)
-    return make_200(msg)
+    wake_mail_sender()
+    return make_200(new_user.serialize())
+
+
+@api_bp.route('/api/<api_version>/invite-users', methods=['POST'])
+@jwt_required
+@forbid_if_nor_teacher_nor_admin
+def invite_users_roster(api_version):
+    """
+    Invite the users of a roster, given as a CSV file (text/csv, with a header line:
+    email[,role,username,firstname,lastname]) or as JSON:
+    {
+        "users": [{"email": ..., "role": "student"}, ...],
+        "whitelist_id": 1
+    }
+    The whitelist can also be given by the whitelist-id parameter.
+    :return: {"invited": [emails], "existing": [emails], "whitelist_id": 1}
+    """
+    whitelist_id = request.args.get('whitelist-id', None)
+    try:
+        if request.mimetype in ('text/csv', 'text/plain'):
+            rows = parse_roster(request.get_data(), format='csv')
+        else:
+            json = request.get_json(force=True, silent=True)
+            if not isinstance(json, dict):
+                return make_400("Invalid roster")
+            whitelist_id = json.get('whitelist_id', whitelist_id)
+            rows = parse_roster(json.get('users'))
+        result = invite_users(rows, whitelist_id=int(whitelist_id) if whitelist_id is not None else None)
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return make_400(str(e))
+    except Exception as e:
+        print('cannot invite the roster: %s' % str(e))
+        db.session.rollback()
+        return make_400("Cannot invite the users: %s" % str(e))
+
+    wake_mail_sender()
+    return make_200(result)
 
 
 @api_bp.route('/api/<api_version>/update-user', methods=['POST'])
@@ -129,11 +189,11 @@ def update_user(api_version):
         print("Passwords do not match")
         return make_401("Invalid credentials")
 
-    # passwords_match = check_password_hash(user.password, password)
+    # passwords_match = check_password(user.password, password)
 
     try:
         print('update info:', username, firstname, lastname, email)
-        user.password = generate_password_hash(password)
+        user.password = hash_password(password)
         user.username = username if username else user.username
         user.first_name = firstname if firstname else user.first_name
         user.last_name = lastname if lastname else user.last_name
@@ -144,6 +204,9 @@ def update_user(api_version):
         db.session.commit()
 
         resp = {"error": None}
+    except PasswordHasherBusy:
+        db.session.rollback()
+        raise
     except Exception as e:
         resp = {"error": str(e)}
 
@@ -182,7 +245,9 @@ def send_password_reset_link(api_version):
     msg.body = "Vous avez demandé à réinitialiser votre mot de passe. "\
                "Vous pouvez choisir un nouveau mot de passe en suivant ce lien: %s " \
                "\nSi vous n'avez pas fait cette demande vous pouvez ignorer cet email." % link
-    mail.send(msg)
+    queue_mail(msg)
+    db.session.commit()
+    wake_mail_sender()
     return response, 200
 
 
@@ -208,9 +273,17 @@ def reset_password(api_version):
         }), 422
 
     user = User.query.filter(User.email == email).first()
-    user.password = generate_password_hash(password)
+    user.password = hash_password(password)
     db.session.add(user)
     db.session.commit()
 
     response = jsonify({"error": None})
     return response, 200
+
+
+@api_bp.route('/api/<api_version>/metrics/password-hashing')
+@jwt_required
+@forbid_if_not_admin
+def password_hashing_metrics(api_version):
+    """ queue depth and latencies of the password hashing pool of the process """
+    return make_200(get_password_hasher().metrics())
@@ -0,0 +1,192 @@
+import atexit
+import threading
+import time
+
+from flask import current_app, has_app_context
+
+from app.utils import check_no_XMLParserError, make_success, content_hash
+
+"""
+===========================
+    Autosave coalescing
+===========================
+
+Editors autosave their content every few seconds. When AUTOSAVE_COALESCING is enabled,
+a PUT sent with ?autosave=1 on a transcription, a translation or a commentary is not
+written right away: the content is kept in memory as the pending save of its
+(kind, doc_id, user_id[, type_id]) key, replacing any previous pending save of the same key,
+and the route answers 202. The pending content is written (notes reconciliation, revision
+and commit, exactly like a regular PUT) once the key has received no autosave for
+AUTOSAVE_QUIET_PERIOD seconds.
+
+A regular PUT (without ?autosave) is an explicit "save now": it is written immediately
+and supersedes the pending save of its key. PATCH and DELETE flush or drop the pending
+save before touching the content.
+
+Durability:
+    - a 202 only means the content has been validated and buffered, not that it is stored;
+    - the buffer lives in the memory of the process: pending saves are flushed on a normal
+      interpreter shutdown (atexit) but are lost if the process is killed or crashes, so at
+      most AUTOSAVE_QUIET_PERIOD seconds of edits can be lost;
+    - each process has its own buffer: with several workers, the autosaves of a given
+      key must be routed to the same worker, otherwise a stale buffered content may
+      overwrite a newer one written by another worker;
+    - reads return the last flushed content until the quiet period has elapsed;
+    - a pending save failing to be written (e.g. the container has been deleted in the
+      meantime) is logged and dropped.
+"""
+
+WRITERS = {}
+
+
+def register_writer(kind, writer):
+    """ register the function writing a pending save of a given kind
+
+    :param kind: 'transcription', 'translation' or 'commentary'
+    :param writer: function(doc_id, user_id, type_id, content, author_id) writing and committing the content
+    """
+    WRITERS[kind] = writer
+
+
+def make_key(kind, doc_id, user_id, type_id=None):
+    return kind, int(doc_id), int(user_id), None if type_id is None else int(type_id)
+
+
+class PendingSave(object):
+    __slots__ = ('content', 'author_id', 'updated_at')
+
+    def __init__(self, content, author_id, updated_at):
+        self.content = content
+        self.author_id = author_id
+        self.updated_at = updated_at
+
+
+class AutosaveBuffer(object):
+
+    def __init__(self, app, quiet_period=None, clock=time.monotonic, background=True):
+        self.app = app
+        self.quiet_period = quiet_period if quiet_period is not None else app.config.get("AUTOSAVE_QUIET_PERIOD", 5)
+        self.clock = clock
+        self.background = background
+        self.pending = {}
+        self.lock = threading.Lock()
+        # held while a pending save is written, so that an explicit save cannot be overwritten
+        # by an older buffered content being flushed at the same time
+        self.write_lock = threading.Lock()
+        self.flusher = None
+        self.stopping = threading.Event()
+        self.exit_hook_registered = False
+
+    def put(self, key, content, author_id=None):
+        """ buffer the content as the latest pending save of the key """
+        with self.lock:
+            self.pending[key] = PendingSave(content, author_id, self.clock())
+            if not self.exit_hook_registered:
+                atexit.register(self.shutdown)
+                self.exit_hook_registered = True
+            if self.background and (self.flusher is None or not self.flusher.is_alive()):
+                self.flusher = threading.Thread(target=self._run, name="autosave-flusher", daemon=True)
+                self.flusher.start()
+
+    def discard(self, key):
+        """ drop the pending save of the key, if any """
+        with self.write_lock, self.lock:
+            return self.pending.pop(key, None) is not None
+
+    def is_pending(self, key):
+        with self.lock:
+            return key in self.pending
+
+    def _pop(self, due_only, keys=None):
+        now = self.clock()
+        with self.lock:
+            if keys is None:
+                keys = list(self.pending)
+            popped = []
+            for key in keys:
+                save = self.pending.get(key)
+                if save is None or (due_only and now - save.updated_at < self.quiet_period):
+                    continue
+                popped.append((key, self.pending.pop(key)))
+            return popped
+
+    def _write(self, saves):
+        written = 0
+        for (kind, doc_id, user_id, type_id), save in saves:
+            try:
+                if has_app_context():
+                    # flushed from a request: reuse its session
+                    WRITERS[kind](doc_id, user_id, type_id, save.content, save.author_id)
+                else:
+                    with self.app.app_context():
+                        WRITERS[kind](doc_id, user_id, type_id, save.content, save.author_id)
+                written += 1
+            except Exception as e:
+                print("Autosave error", kind, doc_id, user_id, type_id, str(e))
+        return written
+
+    def flush_due(self):
+        """ write the pending saves whose quiet period has elapsed
+
+        :return: the number of written saves
+        """
+        with self.write_lock:
+            return self._write(self._pop(due_only=True))
+
+    def flush(self, keys=None):
+        """ write the pending saves of the given keys (all of them by default) right away
+
+        :return: the number of written saves
+        """
+        with self.write_lock:
+            return self._write(self._pop(due_only=False, keys=keys))
+
+    def shutdown(self):
+        self.stopping.set()
+        self.flush()
+
+    def _run(self):
+        while not self.stopping.wait(max(self.quiet_period / 2.0, 0.05)):
+            self.flush_due()
+            with self.lock:
+                if not self.pending:
+                    self.flusher = None
+                    return
+
+
+def get_autosave_buffer(app):
+    if getattr(app, "autosave_buffer", None) is None:
+        app.autosave_buffer = AutosaveBuffer(app)
+    return app.autosave_buffer
+
+
+def wants_autosave(app, request):
+    """ True when the request is an autosave that can be coalesced """
+    return app.config.get("AUTOSAVE_COALESCING", False) and request.args.get("autosave") in ("1", "true")
+
+
+def buffer_autosave(key, content):
+    """ validate and buffer an autosaved content
+
+    :return: a 202 response or an error response
+    """
+    error = check_no_XMLParserError(content)
+    if error:
+        return error
+    buffer = get_autosave_buffer(current_app._get_current_object())
+    buffer.put(key, content, author_id=current_app.get_current_user().id)
+    return make_success(data={"pending": True, "content_hash": content_hash(content)}, status=202)
+
+
+def drop_autosave(key):
+    """ forget the pending save of the key, which is about to be overwritten or deleted """
+    app = current_app._get_current_object()
+    if getattr(app, "autosave_buffer", None) is not None:
+        app.autosave_buffer.discard(key)
+
+
+def flush_autosave(key):
+    """ write the pending save of the key, if any """
+    app = current_app._get_current_object()
+    if getattr(app, "autosave_buffer", None) is not None:
+        app.autosave_buffer.flush(keys=[key])
@@ -4,11 +4,16 @@ from markupsafe import Markup
 from sqlalchemy.orm.exc import NoResultFound
 
 from app import db
+from app.api.autosave import make_key, wants_autosave, buffer_autosave, drop_autosave, flush_autosave, \
+    register_writer
+from app.api.content_edits import apply_edits
+from app.api.reanchoring import reanchor_pointers
 from app.api.routes import api_bp
 from app.api.transcriptions.routes import get_reference_transcription, add_notes_refs_to_text
 from app.models import Commentary, Document, Note, TranscriptionHasNote, CommentaryHasNote, Transcription, findNoteInDoc, set_notes_from_content
 from app.utils import make_403, make_200, make_404, forbid_if_nor_teacher_nor_admin_and_wants_user_data, make_409, \
-    make_400, get_doc, is_closed, check_no_XMLParserError, forbid_if_nor_teacher_nor_admin, forbid_if_not_in_whitelist
+    make_400, get_doc, is_closed, check_no_XMLParserError, forbid_if_nor_teacher_nor_admin, forbid_if_not_in_whitelist, \
+    content_hash
 
 
 def get_commentaries(doc_id, user_id):
@@ -139,6 +144,7 @@ def delete_commentary(doc_id, user_id, type_id):
     ).all()
 
     for c in commentaries:
+        drop_autosave(make_key('commentary', c.doc_id, c.user_id, c.type_id))
         db.session.delete(c)
 
     try:
@@ -216,6 +222,41 @@ def api_post_commentary(api_version, doc_id, user_id):
         return make_400("no data")
 
 
+def forbid_commentary_update(doc_id):
+    doc = get_doc(doc_id)
+    # teachers can still post notes in if the commentaries are validated
+    current_user = current_app.get_current_user()
+    if not current_user.is_teacher and doc.is_commentaries_validated:
+        return make_403()
+
+    return is_closed(doc_id)
+
+
+def get_commentary(doc_id, user_id, type_id):
+    return Commentary.query.filter(
+        type_id == Commentary.type_id,
+        doc_id == Commentary.doc_id,
+        user_id == Commentary.user_id,
+    ).first()
+
+
+def update_commentary_content(c, content):
+    """ replace the content of a commentary, move the pointers into it and reconcile its notes.
+    The caller is responsible for committing the session.
+
+    :return: the re-anchoring report (see app.api.reanchoring)
+    """
+    error = check_no_XMLParserError(content)
+    if error:
+        raise Exception('Commentary content is malformed: %s', str(error))
+    previous_content = c.content
+    c.content = content
+    reanchoring = reanchor_pointers('commentary', c.id, previous_content, content)
+    set_notes_from_content(c)
+    db.session.add(c)
+    return reanchoring
+
+
 @api_bp.route('/api/<api_version>/documents/<doc_id>/commentaries/from-user/<user_id>', methods=['PUT'])
 @jwt_required
 def api_put_commentary(api_version, doc_id, user_id):
@@ -230,45 +271,98 @@ def api_put_commentary(api_version, doc_id, user_id):
         :param doc_id:
         :return:
         """
-    doc = get_doc(doc_id)
-    # teachers can still post notes in if the commentaries are validated
-    current_user = current_app.get_current_user()
-    if not current_user.is_teacher and doc.is_commentaries_validated:
-        return make_403()
+    forbid = forbid_commentary_update(doc_id)
+    if forbid:
+        return forbid
+
+    data = request.get_json()
+    if "data" in data:
+        data = data["data"]
+        c = get_commentary(doc_id, user_id, data["type_id"])
+
+        if c is None:
+            return make_404()
+
+        key = make_key('commentary', doc_id, user_id, data["type_id"])
+        if wants_autosave(current_app, request):
+            return buffer_autosave(key, data["content"])
+        # an explicit save supersedes the pending autosave
+        drop_autosave(key)
+
+        try:
+            reanchoring = update_commentary_content(c, data["content"])
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print('Error', str(e))
+            return make_400(str(e))
+        return make_200(data=dict(c.serialize(), reanchoring=reanchoring))
+    else:
+        return make_400("no data")
+
 
-    forbid = is_closed(doc_id)
+@api_bp.route('/api/<api_version>/documents/<doc_id>/commentaries/from-user/<user_id>', methods=['PATCH'])
+@jwt_required
+def api_patch_commentary(api_version, doc_id, user_id):
+    """
+        Apply text edits to the commentary content (see app.api.content_edits)
+        {
+            "data":
+                {
+                    "type_id": 1,
+                    "base": "<content_hash>",
+                    "edits": [{"offset": 3, "length": 2, "replacement": "Om"}]
+                }
+        }
+        :param api_version:
+        :param doc_id:
+        :return:
+        """
+    forbid = forbid_commentary_update(doc_id)
     if forbid:
         return forbid
 
     data = request.get_json()
     if "data" in data:
         data = data["data"]
-        c = Commentary.query.filter(
-            data["type_id"] == Commentary.type_id,
-            doc_id == Commentary.doc_id,
-            user_id == Commentary.user_id,
-        ).first()
+        if "type_id" not in data:
+            return make_400("no type_id")
+        flush_autosave(make_key('commentary', doc_id, user_id, data["type_id"]))
+        c = get_commentary(doc_id, user_id, data["type_id"])
 
         if c is None:
             return make_404()
 
+        if data.get("base") != content_hash(c.content):
+            return make_409(details="The commentary has changed since this version")
+
         try:
-            error = check_no_XMLParserError(data["content"])
-            if error:
-                raise Exception('Commentary content is malformed: %s', str(error))
-            c.content = data["content"]
-            set_notes_from_content(c)
-            db.session.add(c)
+            reanchoring = update_commentary_content(c, apply_edits(c.content, data.get("edits", [])))
             db.session.commit()
         except Exception as e:
             db.session.rollback()
             print('Error', str(e))
             return make_400(str(e))
-        return make_200(data=c.serialize())
+        return make_200(data=dict(c.serialize(), reanchoring=reanchoring))
     else:
         return make_400("no data")
 
 
+def write_autosaved_commentary(doc_id, user_id, type_id, content, author_id):
+    c = get_commentary(doc_id, user_id, type_id)
+    if c is None:
+        raise Exception("Commentary not found")
+    try:
+        update_commentary_content(c, content)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+register_writer('commentary', write_autosaved_commentary)
+
+
 def clone_commentary(doc_id, user_id, type_id):
     com_to_be_cloned = Commentary.query.filter(Commentary.user_id == user_id,
                                                Commentary.doc_id == doc_id,
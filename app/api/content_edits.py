@@ -0,0 +1,67 @@
+"""
+===========================
+    Content edits
+===========================
+
+Text edits sent to the PATCH endpoints of transcriptions, translations and commentaries.
+
+    {
+        "data": {
+            "base": "<content_hash of the content the edits were made on>",
+            "edits": [
+                {"offset": 12, "length": 3, "replacement": "<ex>us</ex>"},
+                ...
+            ]
+        }
+    }
+
+Offsets and lengths are counted in characters of the base content. Edits must not overlap;
+they are all applied against the base content, whatever the order they are sent in.
+"""
+
+
+def parse_edits(edits):
+    """ validate the edits sent by the client
+
+    :param edits: list of {"offset", "length", "replacement"}
+    :return: list of (offset, length, replacement) tuples sorted by offset
+    """
+    if not isinstance(edits, list):
+        raise ValueError("edits must be a list")
+
+    parsed = []
+    for edit in edits:
+        try:
+            offset = int(edit["offset"])
+            length = int(edit.get("length", 0))
+            replacement = edit.get("replacement", "") or ""
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise ValueError("Malformed edit: %s" % edit)
+        if offset < 0 or length < 0 or not isinstance(replacement, str):
+            raise ValueError("Malformed edit: %s" % edit)
+        parsed.append((offset, length, replacement))
+
+    parsed.sort(key=lambda e: e[0])
+    return parsed
+
+
+def apply_edits(content, edits):
+    """ apply the edits to the content in a single pass
+
+    :param content: the base content
+    :param edits: edits as sent by the client
+    :return: the edited content
+    """
+    content = content or ""
+    parts = []
+    pos = 0
+    for offset, length, replacement in parse_edits(edits):
+        if offset < pos:
+            raise ValueError("Overlapping edits at offset %s" % offset)
+        if offset + length > len(content):
+            raise ValueError("Edit out of bounds at offset %s" % offset)
+        parts.append(content[pos:offset])
+        parts.append(replacement)
+        pos = offset + length
+    parts.append(content[pos:])
+    return "".join(parts)
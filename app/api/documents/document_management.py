@@ -3,6 +3,7 @@ from flask_jwt_extended import jwt_required
 from sqlalchemy import desc, asc, text, func
 
 from app import api_bp, db
+from app.document_access import editable_documents_query
 from app.models import Document
 from app.utils import make_200, forbid_if_nor_teacher_nor_admin
 
@@ -42,3 +43,29 @@ def api_get_dashboard_manage_documents(api_version):
         } for d in docs
     ]})
 
+
+
+@api_bp.route('/api/<api_version>/dashboard/my-documents', methods=['GET'])
+@jwt_required
+def api_get_dashboard_my_documents(api_version):
+    """
+        The documents the current user can edit, read from the document access index
+    """
+    page_number = request.args.get('num-page', 1)
+    page_size = request.args.get('page-size', 50)
+
+    query = editable_documents_query(current_app.get_current_user())
+    total = query.count()
+    docs = query.order_by(Document.id).paginate(int(page_number), int(page_size), max_per_page=100,
+                                                 error_out=False).items
+
+    return make_200(data={"total": total, "documents": [
+        {
+            "id": d.id, "title": d.title, "pressmark": d.pressmark,
+            "whitelist_id": d.whitelist_id,
+            "user_id": d.user_id,
+            "is-published": d.is_published,
+            "is-closed": d.is_closed,
+            "date-closing": d.date_closing,
+        } for d in docs
+    ]})
@@ -0,0 +1,302 @@
+import re
+
+from flask import current_app, request
+from flask_jwt_extended import jwt_required
+from sqlalchemy import select, union, func, literal, and_, exists
+
+from app import api_bp, db
+from app.api.revisions.revision_store import record_revision
+from app.api.speech_parts.speech_part_stats import refresh_speech_part_stats
+from app.models import Document, Transcription, Translation, Commentary, SpeechParts, Note, TranscriptionHasNote, \
+    TranslationHasNote, CommentaryHasNote, AlignmentTranslation, AlignmentImage, AlignmentDiscours, ImageZone
+from app.utils import make_200, make_400, make_404, forbid_if_nor_teacher_nor_admin, forbid_if_not_in_whitelist
+
+"""
+===========================
+    Dossier clone
+===========================
+
+Copy the whole work of a student on a document (transcription, translation, commentaries,
+notes, translation alignments, speech parts and image alignments) into the teacher's account.
+
+Every part the student has replaces the teacher's one, parts the student has not started are
+left untouched. Rows are copied with INSERT ... SELECT statements so that the cost does not
+depend on the number of notes or alignments. Cloned notes get new ids: id + offset, the offset
+being chosen above the current max note id, and the <adele-note id="..."> of the cloned contents
+are rewritten accordingly.
+"""
+
+NOTE_ID_REGEX = re.compile(r'(<adele-note\b[^>]*?\bid\s*=\s*["\']?)(\d+)')
+
+
+def rewrite_note_ids(content, note_ids, offset):
+    """ shift the ids of the cloned notes referenced in the content
+
+    :param content:
+    :param note_ids: ids of the cloned notes
+    :param offset: value added to the note ids
+    :return: the rewritten content
+    """
+    if not content or not note_ids:
+        return content
+
+    def shift(m):
+        note_id = int(m.group(2))
+        if note_id in note_ids:
+            note_id += offset
+        return "%s%s" % (m.group(1), note_id)
+
+    return NOTE_ID_REGEX.sub(shift, content)
+
+
+def get_container(model, doc_id, user_id, **filters):
+    query = model.query.filter(model.doc_id == doc_id, model.user_id == user_id)
+    for key, value in filters.items():
+        query = query.filter(getattr(model, key) == value)
+    return query.first()
+
+
+def clear_teacher_notes(note_ids, teacher_id):
+    """ delete the teacher's notes which are not used by any content anymore """
+    if not note_ids:
+        return
+    note = Note.__table__
+    used = [
+        exists().where(t.c.note_id == note.c.id)
+        for t in (TranscriptionHasNote.__table__, TranslationHasNote.__table__, CommentaryHasNote.__table__)
+    ]
+    db.session.execute(note.delete().where(and_(
+        note.c.id.in_(note_ids),
+        note.c.user_id == teacher_id,
+        *[~u for u in used]
+    )))
+
+
+def clone_dossier(doc_id, student_id, teacher_id):
+    """ copy the dossier of a student into the teacher's account (the caller commits)
+
+    :param doc_id:
+    :param student_id:
+    :param teacher_id:
+    :return: number of cloned rows per kind or None when the student has nothing on this document
+    """
+    doc_id, student_id, teacher_id = int(doc_id), int(student_id), int(teacher_id)
+
+    s_tr = get_container(Transcription, doc_id, student_id)
+    s_tl = get_container(Translation, doc_id, student_id)
+    s_coms = Commentary.query.filter(Commentary.doc_id == doc_id, Commentary.user_id == student_id).all()
+    s_sp = get_container(SpeechParts, doc_id, student_id)
+    if s_tr is None and s_tl is None and not s_coms and s_sp is None:
+        return None
+
+    t_tr = get_container(Transcription, doc_id, teacher_id)
+    t_tl = get_container(Translation, doc_id, teacher_id)
+    t_coms = {c.type_id: c for c in Commentary.query.filter(Commentary.doc_id == doc_id,
+                                                              Commentary.user_id == teacher_id).all()}
+
+    thn = TranscriptionHasNote.__table__
+    tlhn = TranslationHasNote.__table__
+    chn = CommentaryHasNote.__table__
+    note = Note.__table__
+    al_tl = AlignmentTranslation.__table__
+    al_img = AlignmentImage.__table__
+    al_dis = AlignmentDiscours.__table__
+    zone = ImageZone.__table__
+
+    # 1) clear the notes of the teacher's parts which are about to be replaced
+    replaced_tr = s_tr is not None and t_tr is not None
+    replaced_tl = s_tl is not None and t_tl is not None
+    replaced_coms = [t_coms[c.type_id].id for c in s_coms if c.type_id in t_coms]
+    old_links = []
+    if replaced_tr:
+        old_links.append(select(thn.c.note_id).where(thn.c.transcription_id == t_tr.id))
+    if replaced_tl:
+        old_links.append(select(tlhn.c.note_id).where(tlhn.c.translation_id == t_tl.id))
+    if replaced_coms:
+        old_links.append(select(chn.c.note_id).where(chn.c.commentary_id.in_(replaced_coms)))
+    old_note_ids = [row[0] for row in db.session.execute(union(*old_links))] if old_links else []
+
+    if replaced_tr:
+        db.session.execute(thn.delete().where(thn.c.transcription_id == t_tr.id))
+    if replaced_tl:
+        db.session.execute(tlhn.delete().where(tlhn.c.translation_id == t_tl.id))
+    if replaced_coms:
+        db.session.execute(chn.delete().where(chn.c.commentary_id.in_(replaced_coms)))
+    clear_teacher_notes(old_note_ids, teacher_id)
+
+    # 2) clone the notes with shifted ids
+    # a note inserted concurrently above max_id makes the insert fail on the primary key (and the
+    # whole clone be rolled back) rather than mixing the notes of two users
+    src_links = []
+    if s_tr is not None:
+        src_links.append(select(thn.c.note_id).where(thn.c.transcription_id == s_tr.id))
+    if s_tl is not None:
+        src_links.append(select(tlhn.c.note_id).where(tlhn.c.translation_id == s_tl.id))
+    if s_coms:
+        src_links.append(select(chn.c.note_id).where(chn.c.commentary_id.in_([c.id for c in s_coms])))
+    note_ids = set(row[0] for row in db.session.execute(union(*src_links))) if src_links else set()
+
+    offset = 0
+    if note_ids:
+        max_id = db.session.execute(select(func.max(note.c.id))).scalar() or 0
+        offset = max_id + 1 - min(note_ids)
+        db.session.execute(note.insert().from_select(
+            ['id', 'type_id', 'user_id', 'content'],
+            select(note.c.id + offset, note.c.type_id, literal(teacher_id), note.c.content).where(
+                note.c.id.in_(union(*src_links)))
+        ))
+
+    # 3) containers
+    def clone_content(src, dst, model, kind=None, **filters):
+        content = rewrite_note_ids(src.content, note_ids, offset)
+        previous_content = None
+        if dst is None:
+            dst = model(doc_id=doc_id, user_id=teacher_id, content=content, **filters)
+        else:
+            previous_content = dst.content
+            dst.content = content
+        db.session.add(dst)
+        db.session.flush()
+        if kind is not None:
+            record_revision(kind, doc_id, teacher_id, content, previous_content=previous_content,
+                            author_id=teacher_id)
+        return dst
+
+    cloned = {'notes': len(note_ids)}
+    if s_tr is not None:
+        t_tr = clone_content(s_tr, t_tr, Transcription, 'transcription')
+        cloned['transcription_notes'] = db.session.execute(thn.insert().from_select(
+            ['transcription_id', 'note_id', 'ptr_start', 'ptr_end'],
+            select(literal(t_tr.id), thn.c.note_id + offset, thn.c.ptr_start, thn.c.ptr_end).where(
+                thn.c.transcription_id == s_tr.id)
+        )).rowcount
+    if s_tl is not None:
+        t_tl = clone_content(s_tl, t_tl, Translation, 'translation')
+        cloned['translation_notes'] = db.session.execute(tlhn.insert().from_select(
+            ['translation_id', 'note_id', 'ptr_start', 'ptr_end'],
+            select(literal(t_tl.id), tlhn.c.note_id + offset, tlhn.c.ptr_start, tlhn.c.ptr_end).where(
+                tlhn.c.translation_id == s_tl.id)
+        )).rowcount
+    cloned['commentaries'] = 0
+    for s_com in s_coms:
+        t_com = clone_content(s_com, t_coms.get(s_com.type_id), Commentary, type_id=s_com.type_id)
+        db.session.execute(chn.insert().from_select(
+            ['commentary_id', 'note_id', 'ptr_start', 'ptr_end'],
+            select(literal(t_com.id), chn.c.note_id + offset, chn.c.ptr_start, chn.c.ptr_end).where(
+                chn.c.commentary_id == s_com.id)
+        ))
+        cloned['commentaries'] += 1
+    if s_sp is not None:
+        clone_content(s_sp, get_container(SpeechParts, doc_id, teacher_id), SpeechParts)
+        cloned['speech_parts'] = 1
+
+    # 4) alignments: the student's ones replace the teacher's ones
+    def replace_alignments(table, target_filter, source_filter, columns, values):
+        if not db.session.execute(select(exists().where(source_filter))).scalar():
+            return 0
+        db.session.execute(table.delete().where(target_filter))
+        return db.session.execute(table.insert().from_select(columns, select(*values).where(source_filter))).rowcount
+
+    if s_tr is not None and s_tl is not None:
+        cloned['translation_alignments'] = replace_alignments(
+            al_tl,
+            al_tl.c.transcription_id == t_tr.id,
+            and_(al_tl.c.transcription_id == s_tr.id, al_tl.c.translation_id == s_tl.id),
+            ['transcription_id', 'translation_id', 'ptr_transcription_start', 'ptr_transcription_end',
+             'ptr_translation_start', 'ptr_translation_end'],
+            [literal(t_tr.id), literal(t_tl.id), al_tl.c.ptr_transcription_start, al_tl.c.ptr_transcription_end,
+             al_tl.c.ptr_translation_start, al_tl.c.ptr_translation_end]
+        )
+    if s_tr is not None:
+        cloned['speech_part_alignments'] = replace_alignments(
+            al_dis,
+            and_(al_dis.c.transcription_id == t_tr.id, al_dis.c.user_id == teacher_id),
+            and_(al_dis.c.transcription_id == s_tr.id, al_dis.c.user_id == student_id),
+            ['transcription_id', 'speech_part_type_id', 'user_id', 'ptr_start', 'ptr_end', 'note'],
+            [literal(t_tr.id), al_dis.c.speech_part_type_id, literal(teacher_id), al_dis.c.ptr_start,
+             al_dis.c.ptr_end, al_dis.c.note]
+        )
+        # image alignments point to the zones of their user: only the zones the teacher owns can be aligned
+        cloned['image_alignments'] = replace_alignments(
+            al_img,
+            and_(al_img.c.transcription_id == t_tr.id, al_img.c.user_id == teacher_id),
+            and_(al_img.c.transcription_id == s_tr.id,
+                 al_img.c.user_id == student_id,
+                 exists().where(and_(zone.c.user_id == teacher_id,
+                                     zone.c.zone_id == al_img.c.zone_id,
+                                     zone.c.manifest_url == al_img.c.manifest_url,
+                                     zone.c.canvas_idx == al_img.c.canvas_idx,
+                                     zone.c.img_idx == al_img.c.img_idx))),
+            ['transcription_id', 'user_id', 'zone_id', 'manifest_url', 'canvas_idx', 'img_idx',
+             'ptr_transcription_start', 'ptr_transcription_end'],
+            [literal(t_tr.id), literal(teacher_id), al_img.c.zone_id, al_img.c.manifest_url, al_img.c.canvas_idx,
+             al_img.c.img_idx, al_img.c.ptr_transcription_start, al_img.c.ptr_transcription_end]
+        )
+
+    if cloned.get('speech_parts') or cloned.get('speech_part_alignments'):
+        refresh_speech_part_stats(doc_id, teacher_id)
+
+    return cloned
+
+
+def clone_dossiers(items, teacher):
+    """ clone several dossiers in a single transaction
+
+    :param items: list of {"doc_id", "user_id"}
+    :param teacher:
+    :return: a response
+    """
+    results = []
+    try:
+        for item in items:
+            doc = Document.query.filter(Document.id == item["doc_id"]).first()
+            if doc is None:
+                db.session.rollback()
+                return make_404(details="Document %s not found" % item["doc_id"])
+            is_not_allowed = forbid_if_not_in_whitelist(current_app, doc)
+            if is_not_allowed:
+                db.session.rollback()
+                return is_not_allowed
+
+            cloned = clone_dossier(doc.id, item["user_id"], teacher.id)
+            if cloned is None:
+                db.session.rollback()
+                return make_404(details="Nothing to clone from user %s on document %s" % (item["user_id"], doc.id))
+            results.append({"doc_id": doc.id, "user_id": int(item["user_id"]), "cloned": cloned})
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(str(e))
+        return make_400(str(e))
+
+    return make_200(data=results)
+
+
+@api_bp.route('/api/<api_version>/documents/<doc_id>/clone/from-user/<user_id>', methods=['GET'])
+@jwt_required
+@forbid_if_nor_teacher_nor_admin
+def api_documents_clone_dossier(api_version, doc_id, user_id):
+    """ clone every part of the work of a user on the document into the current user's account """
+    return clone_dossiers([{"doc_id": doc_id, "user_id": user_id}], current_app.get_current_user())
+
+
+@api_bp.route('/api/<api_version>/documents/clone', methods=['POST'])
+@jwt_required
+@forbid_if_nor_teacher_nor_admin
+def api_documents_clone_dossiers(api_version):
+    """
+    Clone several dossiers at once, all or nothing
+    {
+        "data": [
+            {"doc_id": 21, "user_id": 5},
+            {"doc_id": 22, "user_id": 6}
+        ]
+    }
+    """
+    data = request.get_json()
+    if not data or not isinstance(data.get("data"), list):
+        return make_400("no data")
+    for item in data["data"]:
+        if not isinstance(item, dict) or "doc_id" not in item or "user_id" not in item:
+            return make_400("Malformed item: %s" % item)
+    return clone_dossiers(data["data"], current_app.get_current_user())
@@ -14,6 +14,7 @@ from app.models import Institution, Editor, Country, District, ActeType, Languag
 from app.utils import forbid_if_nor_teacher_nor_admin, make_204, make_409, check_no_XMLParserError, forbid_if_not_admin
 from ..alignments.alignments_translation import clone_translation_alignments
 from ..commentaries.routes import delete_commentary
+from ..speech_parts.speech_part_stats import refresh_speech_part_stats
 from ..transcriptions.routes import get_reference_transcription, delete_document_transcription
 from ..translations.routes import delete_document_translation
 
@@ -931,6 +932,8 @@ def api_transfer_document_ownership(api_version, doc_id, user_id):
             doc.is_speechparts_validated = validation_flags['speech-parts']
             doc.is_commentaries_validated = validation_flags['commentaries']
 
+            refresh_speech_part_stats(doc_id, current_owner.id)
+            refresh_speech_part_stats(doc_id, new_owner.id)
             db.session.commit()
         else:
             # 1) transfer the ownership from the current_owner to the new_owner
@@ -948,3 +951,4 @@ def api_transfer_document_ownership(api_version, doc_id, user_id):
 # IMPORT DOCUMENT VALIDATION STEP ROUTES
 from .document_validation import *
 from .document_management import *
+from .dossier_clone import *
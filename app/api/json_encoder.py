@@ -0,0 +1,75 @@
+import datetime
+import decimal
+import json
+
+from flask.json import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+"""
+========================================================
+    JSON encoding of the responses
+========================================================
+
+The responses are encoded by orjson when it is installed, by the json module otherwise
+(JSON_ENCODER = 'auto', 'orjson' or 'json'). They are compact unless JSON_INDENT is set,
+as it is in the development config.
+
+Both encoders write the same values:
+    - datetimes as '%Y-%m-%d %H:%M:%S', as the dates stored in the database, and dates as '%Y-%m-%d'
+    - decimals as numbers
+    - Markup (and the other str subclasses) as strings
+"""
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+DATE_FORMAT = '%Y-%m-%d'
+
+
+def default(o):
+    """ the values neither encoder writes as we want """
+    if isinstance(o, datetime.datetime):
+        return o.strftime(DATETIME_FORMAT)
+    if isinstance(o, datetime.date):
+        return o.strftime(DATE_FORMAT)
+    if isinstance(o, decimal.Decimal):
+        return int(o) if o == o.to_integral_value() else float(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError("Object of type %s is not JSON serializable" % type(o).__name__)
+
+
+class AdeleJSONEncoder(JSONEncoder):
+    """ encoder of the json module (and of jsonify) """
+
+    def default(self, o):
+        try:
+            return default(o)
+        except TypeError:
+            return super().default(o)
+
+
+def make_json_dumps(encoder='auto', indent=None):
+    """ function encoding a response
+
+    :param encoder: 'orjson', 'json', or 'auto' for orjson when it is installed
+    :param indent: indentation of the output (orjson only indents by 2), compact when None
+    :return: function(obj) returning str or bytes
+    """
+    if encoder == 'orjson' and orjson is None:
+        raise ImportError("orjson is not installed")
+    if encoder in ('auto', 'orjson') and orjson is not None:
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if indent:
+            options |= orjson.OPT_INDENT_2
+
+        def dumps(obj):
+            return orjson.dumps(obj, default=default, option=options)
+    else:
+        separators = (',', ': ') if indent else (',', ':')
+
+        def dumps(obj):
+            return json.dumps(obj, cls=AdeleJSONEncoder, ensure_ascii=False, indent=indent, separators=separators)
+    return dumps
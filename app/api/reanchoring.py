@@ -0,0 +1,255 @@
+import re
+from bisect import bisect_left, bisect_right
+from difflib import SequenceMatcher
+
+from sqlalchemy import and_, bindparam, select
+
+from app import db
+from app.models import AlignmentDiscours, AlignmentImage, AlignmentTranslation, CommentaryHasNote, \
+    TranscriptionHasNote, TranslationHasNote
+
+"""
+========================================================
+    Pointer re-anchoring
+========================================================
+
+The notes, alignments and speech parts point into the contents with character offsets.
+When a content is saved, the previous and the new contents are compared and every pointer
+is moved to the same place of the new content:
+    - the contents are diffed by chunks (up to a tag or a strong punctuation), then by tokens
+      (tags, entities, words, spaces, punctuation) inside the changed chunks, the common prefix
+      and suffix being skipped at each level
+    - a pointer inside unchanged text follows it
+    - a range start inside changed text moves to the start of the new text, a range end
+      to its end; the text inserted at the boundaries of a range stays out of it
+    - a range whose text was deleted is collapsed (start == end) and reported
+
+The moved pointers are written with one executemany statement per table. The tables whose
+primary key holds the pointers have their moved rows deleted then inserted again.
+"""
+
+# a chunk ends with a tag, a strong punctuation or a newline
+CHUNK_REGEX = re.compile(r'[^<.!?;\n]*(?:<[^>]*>|[.!?;]+\s*|\n)|[^<.!?;\n]+|[<.!?;\n]')
+TOKEN_REGEX = re.compile(r'<[^>]*>|&[#\w]+;|\w+|\s+|.', re.S)
+SPLIT_REGEXES = (CHUNK_REGEX, TOKEN_REGEX)
+MAX_REFINED_LENGTH = 200
+
+
+class OffsetMap(object):
+
+    def __init__(self, old, new):
+        """
+        :param old: the previous content
+        :param new: the new content
+        """
+        old = old or ""
+        new = new or ""
+        self.old_len = len(old)
+        self.new_len = len(new)
+        # only the blocks of the old content are needed: the pure insertions are dropped
+        self.blocks = [block for block in diff_blocks(old, new) if block[2] > block[1]]
+        self._starts = [block[1] for block in self.blocks]
+        self._ends = [block[2] for block in self.blocks]
+
+    def map_start(self, pos):
+        """ position of the new content where a range starting at pos starts """
+        if pos >= self.old_len:
+            return pos + self.new_len - self.old_len
+        tag, i1, i2, j1, j2 = self.blocks[bisect_right(self._starts, pos) - 1]
+        if tag == 'equal':
+            return j1 + pos - i1
+        return j1
+
+    def map_end(self, pos):
+        """ position of the new content where a range ending at pos ends """
+        if pos <= 0:
+            return pos
+        if pos > self.old_len:
+            return pos + self.new_len - self.old_len
+        tag, i1, i2, j1, j2 = self.blocks[bisect_left(self._ends, pos)]
+        if tag == 'equal':
+            return j1 + pos - i1
+        return j2
+
+    def map_range(self, start, end):
+        """
+        :return: (new start, new end, collapsed) where collapsed tells the text of the range was deleted
+        """
+        new_start = self.map_start(start)
+        new_end = max(self.map_end(end), new_start)
+        return new_start, new_end, end > start and new_end == new_start
+
+
+def diff_blocks(old, new):
+    """ diff of two texts, by chunks (sentences, paragraphs), then by tokens inside the replaced chunks,
+    then by characters inside the short replaced tokens
+
+    :return: list of (tag, old_start, old_end, new_start, new_end) in characters
+    """
+    return _diff(old, new, 0, 0, 0)
+
+
+def _diff(old, new, old_offset, new_offset, level):
+    if level < len(SPLIT_REGEXES):
+        old_units = SPLIT_REGEXES[level].findall(old)
+        new_units = SPLIT_REGEXES[level].findall(new)
+    else:
+        old_units, new_units = old, new
+    old_positions = _token_positions(old_units)
+    new_positions = _token_positions(new_units)
+
+    # the edits of a save are usually grouped: only the middle part is given to the matcher
+    prefix = 0
+    max_prefix = min(len(old_units), len(new_units))
+    while prefix < max_prefix and old_units[prefix] == new_units[prefix]:
+        prefix += 1
+    suffix = 0
+    max_suffix = max_prefix - prefix
+    while suffix < max_suffix and old_units[-1 - suffix] == new_units[-1 - suffix]:
+        suffix += 1
+    old_end = len(old_units) - suffix
+    new_end = len(new_units) - suffix
+
+    blocks = []
+    if prefix:
+        blocks.append(('equal', old_offset, old_offset + old_positions[prefix],
+                       new_offset, new_offset + new_positions[prefix]))
+    # the popular units (spaces, frequent tags) only extend the matches found on the rarer ones:
+    # the parts left unmatched are diffed again at the next level
+    matcher = SequenceMatcher(None, old_units[prefix:old_end], new_units[prefix:new_end])
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        i1, i2 = old_positions[prefix + i1], old_positions[prefix + i2]
+        j1, j2 = new_positions[prefix + j1], new_positions[prefix + j2]
+        if tag == 'replace' and level < len(SPLIT_REGEXES) and (
+                level + 1 < len(SPLIT_REGEXES) or i2 - i1 <= MAX_REFINED_LENGTH and j2 - j1 <= MAX_REFINED_LENGTH):
+            # a deleted tag joins two words into one token: the short replacements are diffed by character
+            blocks.extend(_diff(old[i1:i2], new[j1:j2], old_offset + i1, new_offset + j1, level + 1))
+        else:
+            blocks.append((tag, old_offset + i1, old_offset + i2, new_offset + j1, new_offset + j2))
+    if suffix:
+        blocks.append(('equal', old_offset + old_positions[old_end], old_offset + len(old),
+                       new_offset + new_positions[new_end], new_offset + len(new)))
+    return blocks
+
+
+def _token_positions(tokens):
+    positions = [0]
+    for token in tokens:
+        positions.append(positions[-1] + len(token))
+    return positions
+
+
+# kind of content: list of (model, column of the content id, (start column, end column))
+POINTER_TABLES = {
+    'transcription': (
+        (TranscriptionHasNote, 'transcription_id', ('ptr_start', 'ptr_end')),
+        (AlignmentTranslation, 'transcription_id', ('ptr_transcription_start', 'ptr_transcription_end')),
+        (AlignmentImage, 'transcription_id', ('ptr_transcription_start', 'ptr_transcription_end')),
+        (AlignmentDiscours, 'transcription_id', ('ptr_start', 'ptr_end')),
+    ),
+    'translation': (
+        (TranslationHasNote, 'translation_id', ('ptr_start', 'ptr_end')),
+        (AlignmentTranslation, 'translation_id', ('ptr_translation_start', 'ptr_translation_end')),
+    ),
+    'commentary': (
+        (CommentaryHasNote, 'commentary_id', ('ptr_start', 'ptr_end')),
+    ),
+}
+
+
+def reanchor_pointers(kind, container_id, old_content, new_content):
+    """ move the pointers into a content after it changed.
+    The caller is responsible for committing the session.
+
+    :param kind: transcription, translation or commentary
+    :param container_id: id of the transcription, translation or commentary
+    :param old_content: the content the pointers were set on
+    :param new_content: the new content
+    :return: {"moved": nb of moved ranges, "collapsed": [{"table", "ptr_start", "ptr_end", ...primary key}]}
+             the collapsed ranges are given with their new pointers
+    """
+    report = {"moved": 0, "collapsed": []}
+    if old_content is None or old_content == new_content:
+        return report
+
+    db.session.flush()
+    offset_map = OffsetMap(old_content, new_content)
+    for model, container_column, ptr_columns in POINTER_TABLES[kind]:
+        moved, collapsed = _reanchor_table(model.__table__, container_column, ptr_columns,
+                                           container_id, offset_map)
+        report["moved"] += moved
+        report["collapsed"].extend(collapsed)
+        if moved:
+            _forget_instances(model, set(ptr_columns) & set(model.__table__.primary_key.columns.keys()))
+    return report
+
+
+def _reanchor_table(table, container_column, ptr_columns, container_id, offset_map):
+    start_column, end_column = ptr_columns
+    pk_columns = [column.name for column in table.primary_key.columns]
+    columns = [column.name for column in table.columns]
+    rows = db.session.execute(select(table).where(table.c[container_column] == container_id)).mappings().all()
+
+    moved_rows = []
+    collapsed = []
+    for row in rows:
+        try:
+            start, end = int(row[start_column]), int(row[end_column])
+        except (TypeError, ValueError):
+            continue
+        new_start, new_end, is_collapsed = offset_map.map_range(start, end)
+        if is_collapsed:
+            report_row = {name: row[name] for name in pk_columns if name not in ptr_columns}
+            report_row.update(table=table.name, ptr_start=new_start, ptr_end=new_end)
+            collapsed.append(report_row)
+        if (new_start, new_end) != (start, end):
+            moved_rows.append((row, new_start, new_end))
+    if not moved_rows:
+        return 0, collapsed
+
+    if start_column not in pk_columns and end_column not in pk_columns:
+        update = table.update().where(
+            and_(*[table.c[name] == bindparam('_pk_%s' % name) for name in pk_columns])
+        ).values({start_column: bindparam('_start'), end_column: bindparam('_end')})
+        params = []
+        for row, new_start, new_end in moved_rows:
+            param = {'_pk_%s' % name: row[name] for name in pk_columns}
+            param.update(_start=new_start, _end=new_end)
+            params.append(param)
+        db.session.execute(update, params)
+        return len(moved_rows), collapsed
+
+    # the pointers are part of the primary key: updating the rows one after the other could
+    # collide with the key of a row not moved yet
+    delete = table.delete().where(
+        and_(*[table.c[name] == bindparam('_pk_%s' % name) for name in pk_columns])
+    )
+    db.session.execute(delete, [{'_pk_%s' % name: row[name] for name in pk_columns}
+                                for row, _, _ in moved_rows])
+    moved_keys = set()
+    kept_keys = set(tuple(row[name] for name in pk_columns) for row in rows)
+    kept_keys.difference_update(tuple(row[name] for name in pk_columns) for row, _, _ in moved_rows)
+    values = []
+    for row, new_start, new_end in moved_rows:
+        new_row = {name: row[name] for name in columns}
+        new_row.update({start_column: new_start, end_column: new_end})
+        key = tuple(new_row[name] for name in pk_columns)
+        # two ranges moved onto the same pointers are merged
+        if key in kept_keys or key in moved_keys:
+            continue
+        moved_keys.add(key)
+        values.append(new_row)
+    if values:
+        db.session.execute(table.insert(), values)
+    return len(moved_rows), collapsed
+
+
+def _forget_instances(model, pointers_in_key):
+    """ the loaded instances of a model may hold the previous pointers,
+    or the primary key of a row which was deleted then inserted again """
+    for instance in list(db.session.identity_map.values()):
+        if isinstance(instance, model):
+            if pointers_in_key:
+                db.session.expunge(instance)
+            else:
+                db.session.expire(instance)
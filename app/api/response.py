@@ -1,7 +1,11 @@
-import json
 import pprint
 
-from flask import Response
+from flask import Response, current_app, has_app_context
+
+from app.api.json_encoder import make_json_dumps
+
+# outside of an application
+default_json_dumps = make_json_dumps()
 
 
 class APIResponseFactory:
@@ -32,8 +36,9 @@ class APIResponseFactory:
         if len(meta) > 0:
             r["meta"] = meta
 
+        dumps = current_app.json_dumps if has_app_context() else default_json_dumps
         return Response(
-            json.dumps(r, indent=2, ensure_ascii=False),
+            dumps(r),
             status=status,
             content_type="application/json; charset=utf-8",
             headers={
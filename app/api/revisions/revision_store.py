@@ -0,0 +1,247 @@
+import datetime
+import json
+from difflib import SequenceMatcher
+
+from flask import current_app
+
+from app import db
+from app.models import ContentRevision
+from app.utils import content_hash
+
+"""
+===========================
+    Revision store
+===========================
+
+Every save of a transcription or a translation content appends a ContentRevision.
+Revisions are stored either as a full snapshot of the content or as a delta against
+the previous revision. A snapshot is written every REVISION_SNAPSHOT_INTERVAL revisions
+so that materializing any revision never applies more than that number of deltas.
+
+A delta is a JSON list of operations applied to the previous content:
+    - a positive int n: copy the next n characters
+    - a negative int -n: skip the next n characters
+    - a string: insert this string
+"""
+
+KINDS = ('transcription', 'translation')
+
+# above this size, the changed region is not diffed char by char and is stored as a replacement
+MAX_DIFFED_REGION = 20000
+
+
+def make_delta(old, new):
+    """ compute the delta transforming old into new
+
+    :param old: previous content
+    :param new: new content
+    :return: list of delta operations
+    """
+    # most edits are local: only diff the region between the common prefix and suffix
+    prefix = 0
+    max_prefix = min(len(old), len(new))
+    while prefix < max_prefix and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    max_suffix = max_prefix - prefix
+    while suffix < max_suffix and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+
+    old_mid = old[prefix:len(old) - suffix]
+    new_mid = new[prefix:len(new) - suffix]
+
+    ops = []
+    if prefix:
+        ops.append(prefix)
+    if len(old_mid) + len(new_mid) > MAX_DIFFED_REGION:
+        opcodes = [('replace', 0, len(old_mid), 0, len(new_mid))]
+    else:
+        opcodes = SequenceMatcher(None, old_mid, new_mid, autojunk=False).get_opcodes()
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            ops.append(i2 - i1)
+        else:
+            if i2 > i1:
+                ops.append(i1 - i2)
+            if j2 > j1:
+                ops.append(new_mid[j1:j2])
+    if suffix:
+        ops.append(suffix)
+    return ops
+
+
+def apply_delta(old, ops):
+    """ apply a delta computed by make_delta() to old
+
+    :param old: previous content
+    :param ops: list of delta operations
+    :return: the new content
+    """
+    parts = []
+    pos = 0
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op)
+        elif op >= 0:
+            parts.append(old[pos:pos + op])
+            pos += op
+        else:
+            pos -= op
+    return "".join(parts)
+
+
+def encode_delta(ops):
+    return json.dumps(ops, ensure_ascii=False, separators=(',', ':'))
+
+
+def decode_delta(data):
+    return json.loads(data)
+
+
+def get_revisions_query(kind, doc_id, user_id):
+    return ContentRevision.query.filter(
+        ContentRevision.kind == kind,
+        ContentRevision.doc_id == doc_id,
+        ContentRevision.user_id == user_id
+    )
+
+
+def get_last_revision(kind, doc_id, user_id):
+    return get_revisions_query(kind, doc_id, user_id).order_by(ContentRevision.revision.desc()).first()
+
+
+def record_revision(kind, doc_id, user_id, content, previous_content=None, author_id=None):
+    """ add a new revision of a content to the session (the caller commits)
+
+    :param kind: 'transcription' or 'translation'
+    :param doc_id:
+    :param user_id: owner of the content
+    :param content: the new content
+    :param previous_content: the content before the change, if any
+    :param author_id: user who made the change
+    :return: the new ContentRevision or None when the content did not change
+    """
+    if kind not in KINDS:
+        raise ValueError("Unknown revision kind: %s" % kind)
+
+    content = content or ""
+    new_hash = content_hash(content)
+    last = get_last_revision(kind, doc_id, user_id)
+
+    if last is not None and last.content_hash == new_hash:
+        return None
+
+    snapshot_interval = current_app.config.get("REVISION_SNAPSHOT_INTERVAL", 20)
+    revision = 1 if last is None else last.revision + 1
+    data = None
+    is_snapshot = True
+
+    # deltas are only stored when the previous revision is known to be the previous content
+    if last is not None and previous_content is not None and last.content_hash == content_hash(previous_content):
+        last_snapshot = get_revisions_query(kind, doc_id, user_id).filter(
+            ContentRevision.is_snapshot == True
+        ).order_by(ContentRevision.revision.desc()).first()
+        if last_snapshot is not None and revision - last_snapshot.revision < snapshot_interval:
+            delta = encode_delta(make_delta(previous_content, content))
+            if len(delta) < len(content):
+                data = delta
+                is_snapshot = False
+
+    if is_snapshot:
+        data = content
+
+    new_revision = ContentRevision(
+        kind=kind,
+        doc_id=doc_id,
+        user_id=user_id,
+        author_id=author_id,
+        revision=revision,
+        is_snapshot=is_snapshot,
+        data=data,
+        content_hash=new_hash,
+        content_length=len(content),
+        date_insert=datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    )
+    db.session.add(new_revision)
+    return new_revision
+
+
+def materialize_revision(kind, doc_id, user_id, revision):
+    """ rebuild the content of a given revision from the closest snapshot
+
+    :return: the content or None if the revision does not exist
+    """
+    query = get_revisions_query(kind, doc_id, user_id)
+    snapshot = query.filter(
+        ContentRevision.is_snapshot == True,
+        ContentRevision.revision <= revision
+    ).order_by(ContentRevision.revision.desc()).first()
+    if snapshot is None:
+        return None
+
+    deltas = query.filter(
+        ContentRevision.revision > snapshot.revision,
+        ContentRevision.revision <= revision
+    ).order_by(ContentRevision.revision).all()
+
+    if snapshot.revision + len(deltas) != int(revision):
+        return None
+
+    content = snapshot.data
+    for rev in deltas:
+        if rev.is_snapshot:
+            content = rev.data
+        else:
+            content = apply_delta(content, decode_delta(rev.data))
+    return content
+
+
+def compact_revisions(keep_last=None, older_than=None, kind=None):
+    """ drop old revisions while keeping every remaining revision materializable
+
+    For each content history, the revisions before the last `keep_last` ones are deleted
+    (only if they are older than `older_than` when given) and the oldest remaining revision
+    is rewritten as a snapshot.
+
+    :param keep_last: number of revisions to keep for each content
+    :param older_than: datetime, only revisions inserted before this date can be dropped
+    :param kind: restrict the compaction to 'transcription' or 'translation'
+    :return: the number of deleted revisions
+    """
+    if keep_last is None:
+        keep_last = current_app.config.get("REVISION_KEEP_LAST", 100)
+    keep_last = max(int(keep_last), 1)
+
+    histories = db.session.query(
+        ContentRevision.kind, ContentRevision.doc_id, ContentRevision.user_id
+    ).distinct()
+    if kind is not None:
+        histories = histories.filter(ContentRevision.kind == kind)
+
+    deleted = 0
+    for h_kind, h_doc_id, h_user_id in histories.all():
+        query = get_revisions_query(h_kind, h_doc_id, h_user_id)
+        revisions = query.with_entities(
+            ContentRevision.revision, ContentRevision.date_insert
+        ).order_by(ContentRevision.revision).all()
+        if len(revisions) <= keep_last:
+            continue
+
+        droppable = revisions[:-keep_last]
+        if older_than is not None:
+            limit = older_than.strftime('%Y-%m-%d %H:%M:%S')
+            droppable = [r for r in droppable if r.date_insert is not None and r.date_insert < limit]
+        if not droppable:
+            continue
+
+        new_base = droppable[-1].revision + 1
+        base = query.filter(ContentRevision.revision == new_base).one()
+        if not base.is_snapshot:
+            base.data = materialize_revision(h_kind, h_doc_id, h_user_id, new_base)
+            base.is_snapshot = True
+            db.session.add(base)
+
+        deleted += query.filter(ContentRevision.revision < new_base).delete(synchronize_session=False)
+
+    db.session.commit()
+    return deleted
@@ -0,0 +1,99 @@
+from flask import current_app
+from flask_jwt_extended import jwt_required
+
+from app import db
+from app.api.revisions.revision_store import get_revisions_query, materialize_revision
+from app.api.routes import api_bp
+from app.models import ContentRevision, Document, Transcription, Translation
+from app.utils import make_404, make_200, make_400, forbid_if_nor_teacher_nor_admin_and_wants_user_data, \
+    forbid_if_nor_teacher_nor_admin, forbid_if_not_in_whitelist, is_closed
+
+"""
+===========================
+    Revisions
+===========================
+"""
+
+CONTAINER_MODELS = {
+    'transcription': Transcription,
+    'translation': Translation
+}
+
+
+@api_bp.route('/api/<api_version>/documents/<doc_id>/transcriptions/from-user/<user_id>/revisions',
+              defaults={'kind': 'transcription'})
+@api_bp.route('/api/<api_version>/documents/<doc_id>/translations/from-user/<user_id>/revisions',
+              defaults={'kind': 'translation'})
+@jwt_required
+def api_get_revisions(api_version, doc_id, user_id, kind):
+    forbid = forbid_if_nor_teacher_nor_admin_and_wants_user_data(current_app, user_id)
+    if forbid:
+        return forbid
+
+    revisions = get_revisions_query(kind, doc_id, user_id).order_by(ContentRevision.revision.desc()).all()
+    return make_200(data=[rev.serialize() for rev in revisions])
+
+
+@api_bp.route('/api/<api_version>/documents/<doc_id>/transcriptions/from-user/<user_id>/revisions/<int:revision>',
+              defaults={'kind': 'transcription'})
+@api_bp.route('/api/<api_version>/documents/<doc_id>/translations/from-user/<user_id>/revisions/<int:revision>',
+              defaults={'kind': 'translation'})
+@jwt_required
+def api_get_revision(api_version, doc_id, user_id, revision, kind):
+    forbid = forbid_if_nor_teacher_nor_admin_and_wants_user_data(current_app, user_id)
+    if forbid:
+        return forbid
+
+    rev = get_revisions_query(kind, doc_id, user_id).filter(ContentRevision.revision == revision).first()
+    if rev is None:
+        return make_404()
+
+    data = rev.serialize()
+    data['content'] = materialize_revision(kind, doc_id, user_id, revision)
+    if data['content'] is None:
+        return make_404(details="This revision has been compacted")
+    return make_200(data=data)
+
+
+@api_bp.route('/api/<api_version>/documents/<doc_id>/transcriptions/from-user/<user_id>/revisions/<int:revision>/restore',
+              methods=['POST'], defaults={'kind': 'transcription'})
+@api_bp.route('/api/<api_version>/documents/<doc_id>/translations/from-user/<user_id>/revisions/<int:revision>/restore',
+              methods=['POST'], defaults={'kind': 'translation'})
+@jwt_required
+@forbid_if_nor_teacher_nor_admin
+def api_restore_revision(api_version, doc_id, user_id, revision, kind):
+    """
+    Replace the current content by the content of the given revision.
+    The pointers into the content are moved as for any other change of the content,
+    and the restoration itself is recorded as a new revision.
+    """
+    from app.api.transcriptions.routes import update_transcription_content
+    from app.api.translations.routes import update_translation_content
+
+    is_not_allowed = forbid_if_not_in_whitelist(current_app, Document.query.filter(Document.id == doc_id).first())
+    if is_not_allowed:
+        return is_not_allowed
+
+    forbid = is_closed(doc_id)
+    if forbid:
+        return forbid
+
+    model = CONTAINER_MODELS[kind]
+    container = model.query.filter(model.doc_id == doc_id, model.user_id == user_id).first()
+    if container is None:
+        return make_404()
+
+    content = materialize_revision(kind, doc_id, user_id, revision)
+    if content is None:
+        return make_404()
+
+    update_content = update_transcription_content if kind == 'transcription' else update_translation_content
+    try:
+        reanchoring = update_content(container, content, author_id=current_app.get_current_user().id)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print('Error', str(e))
+        return make_400(str(e))
+
+    return make_200(data=dict(container.serialize_for_user(user_id), reanchoring=reanchoring))
@@ -80,8 +80,12 @@ from app.api.traditions import routes
 from app.api.transcriptions import routes
 from app.api.translations import routes
 from app.api.users import routes
+from app.api.revisions import routes
 
 from app.api.alignments import alignments_translation
 from app.api.alignments import alignment_images
+from app.api.alignments import alignments_discours
+
+from app.api.annotations import routes
 
 from app.api.auth import login
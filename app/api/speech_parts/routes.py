@@ -5,6 +5,8 @@ from sqlalchemy.orm.exc import NoResultFound
 
 from app import db
 from app.api.routes import api_bp
+from app.api.speech_parts.speech_part_stats import refresh_speech_part_stats, get_document_speech_part_stats, \
+    get_corpus_speech_part_stats
 from app.api.transcriptions.routes import get_reference_transcription
 from app.models import (
     User,
@@ -113,6 +115,7 @@ def api_post_documents_speech_parts(api_version, doc_id, user_id):
             doc_id=doc_id, content=get_reference_transcription(doc_id).content, user_id=user_id
         )
         db.session.add(sp)
+        refresh_speech_part_stats(doc_id, user_id)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
@@ -172,6 +175,7 @@ def api_put_documents_speech_parts(api_version, doc_id, user_id):
                     )
                 sp.content = data["content"]
                 db.session.add(sp)
+                refresh_speech_part_stats(doc_id, user_id)
                 db.session.commit()
         except Exception as e:
             db.session.rollback()
@@ -211,6 +215,7 @@ def delete_document_speech_parts(doc_id, user_id):
 
     try:
         db.session.delete(sp)
+        refresh_speech_part_stats(doc_id, user_id)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
@@ -251,3 +256,34 @@ def view_document_speech_parts(api_version, doc_id, user_id=None):
             "content": Markup(sp.content) if sp.content is not None else "",
         }
     )
+
+
+@api_bp.route("/api/<api_version>/documents/<doc_id>/speech-parts-stats")
+@jwt_required
+def api_documents_speech_parts_stats(api_version, doc_id):
+    """
+    Number and length of the speech parts of each type in the document, for all its users and per user.
+    Students only get their own speech parts.
+    :param api_version:
+    :param doc_id:
+    :return:
+    """
+    if get_doc(doc_id) is None:
+        return make_404()
+    user = current_app.get_current_user()
+    user_ids = None if user.is_teacher or user.is_admin else [user.id]
+    return make_200(data=get_document_speech_part_stats(doc_id, user_ids=user_ids))
+
+
+@api_bp.route("/api/<api_version>/speech-parts-stats")
+@jwt_required
+def api_speech_parts_stats(api_version):
+    """
+    Number and length of the speech parts of each type in all the documents.
+    Students only get their own speech parts.
+    :param api_version:
+    :return:
+    """
+    user = current_app.get_current_user()
+    user_ids = None if user.is_teacher or user.is_admin else [user.id]
+    return make_200(data=get_corpus_speech_part_stats(user_ids=user_ids))
@@ -0,0 +1,196 @@
+import re
+
+from sqlalchemy import func, select
+
+from app import db
+from app.locator import TagAwareLocator
+from app.models import AlignmentDiscours, SpeechParts, SpeechPartStat, SpeechPartType, Transcription, User
+
+"""
+========================================================
+    Speech part statistics
+========================================================
+
+Number and plain text length of the speech parts of each type, per document and user, kept in
+the speech_part_stat table, and computed again each time the speech parts of the user are written,
+so that the statistics are read without parsing any content.
+
+The speech parts of a user are either marked in the speech parts content of the user or aligned
+on the transcription (AlignmentDiscours); both describe the same speech parts, so a single source
+is counted for each (document, user):
+    - the speech parts content, when it marks speech parts. As the notes (<adele-note id="...">)
+      and the segments (<adele-segment>) of the other contents, a speech part is a custom element
+      wrapping its text, its type being the id of its speech part type:
+          <adele-speechpart type="2">Omnibus presentes</adele-speechpart>
+      the elements may be nested; those without a type are ignored
+    - the speech part alignments otherwise
+"""
+
+SPEECH_PART_TAG_REGEX = re.compile(r'<(/?)adele-speechpart\b([^>]*)>', re.I)
+TYPE_ATTR_REGEX = re.compile(r'\btype\s*=\s*["\']?(\d+)')
+
+
+def speech_parts_of_content(container):
+    """ speech parts marked in a content
+
+    :param container: a SpeechParts
+    :return: list of (speech_part_type_id, plain text length)
+    """
+    if not container.content:
+        return []
+    locator = None
+    found = []
+    opened = []
+    for m in SPEECH_PART_TAG_REGEX.finditer(container.content):
+        if not m.group(1):
+            type_id = TYPE_ATTR_REGEX.search(m.group(2))
+            opened.append((int(type_id.group(1)) if type_id else None, m.end()))
+        elif opened:
+            type_id, start = opened.pop()
+            if type_id is None:
+                continue
+            if locator is None:
+                locator = TagAwareLocator.from_container(container)
+            found.append((type_id, locator.to_text(m.start()) - locator.to_text(start)))
+    return found
+
+
+def speech_parts_of_alignments(doc_id, user_id):
+    """ speech parts aligned on the transcriptions of a document
+
+    :return: list of (speech_part_type_id, plain text length)
+    """
+    found = []
+    locators = {}
+    for al, transcription in AlignmentDiscours.query.join(
+            Transcription, Transcription.id == AlignmentDiscours.transcription_id).filter(
+            Transcription.doc_id == doc_id, AlignmentDiscours.user_id == user_id).with_entities(
+            AlignmentDiscours, Transcription):
+        if al.speech_part_type_id is None or al.ptr_start is None or al.ptr_end is None:
+            continue
+        if transcription.id not in locators:
+            locators[transcription.id] = TagAwareLocator.from_container(transcription)
+        locator = locators[transcription.id]
+        found.append((al.speech_part_type_id,
+                      max(0, locator.to_text(int(al.ptr_end)) - locator.to_text(int(al.ptr_start)))))
+    return found
+
+
+def refresh_speech_part_stats(doc_id, user_id):
+    """ compute again the statistics of the speech parts of a user on a document.
+    The caller is responsible for committing the session.
+
+    :return: the number of rows written
+    """
+    doc_id, user_id = int(doc_id), int(user_id)
+    table = SpeechPartStat.__table__
+    db.session.flush()
+    db.session.execute(table.delete().where(table.c.doc_id == doc_id, table.c.user_id == user_id))
+
+    sp = SpeechParts.query.filter(SpeechParts.doc_id == doc_id, SpeechParts.user_id == user_id).first()
+    parts = speech_parts_of_content(sp) if sp is not None else []
+    if not parts:
+        parts = speech_parts_of_alignments(doc_id, user_id)
+    if not parts:
+        return 0
+
+    known_types = set(row[0] for row in db.session.execute(select(SpeechPartType.id)))
+    stats = {}
+    for type_id, length in parts:
+        if type_id not in known_types:
+            continue
+        nb, total, longest = stats.get(type_id, (0, 0, 0))
+        stats[type_id] = (nb + 1, total + length, max(longest, length))
+    if stats:
+        db.session.execute(table.insert(), [
+            {"doc_id": doc_id, "user_id": user_id, "speech_part_type_id": type_id,
+             "nb": nb, "length": total, "max_length": longest}
+            for type_id, (nb, total, longest) in stats.items()
+        ])
+    return len(stats)
+
+
+def speech_part_aligners(transcription_id):
+    """ ids of the users having speech parts aligned on a transcription """
+    return [row[0] for row in db.session.execute(
+        select(AlignmentDiscours.user_id).where(AlignmentDiscours.transcription_id == transcription_id).distinct()
+    ) if row[0] is not None]
+
+
+def rebuild_speech_part_stats():
+    """ compute again the statistics of every document and user
+
+    :return: the number of (document, user) refreshed
+    """
+    pairs = set(db.session.execute(select(SpeechParts.doc_id, SpeechParts.user_id)).fetchall())
+    pairs.update(db.session.execute(
+        select(Transcription.doc_id, AlignmentDiscours.user_id).join(
+            Transcription, Transcription.id == AlignmentDiscours.transcription_id)
+    ).fetchall())
+    db.session.execute(SpeechPartStat.__table__.delete())
+    for doc_id, user_id in pairs:
+        if doc_id is not None and user_id is not None:
+            refresh_speech_part_stats(doc_id, user_id)
+    return len(pairs)
+
+
+def _serialize_type_stats(type_id, nb, length, max_length, labels, **extra):
+    data = {
+        "speech_part_type_id": type_id,
+        "label": labels.get(type_id),
+        "nb": nb,
+        "length": length,
+        "mean_length": round(length / nb, 1) if nb else 0,
+        "max_length": max_length,
+    }
+    data.update(extra)
+    return data
+
+
+def get_document_speech_part_stats(doc_id, user_ids=None):
+    """ statistics of a document, for all its users and per user
+
+    :param user_ids: only the speech parts of these users, all of them when None
+    :return: {"types": [...], "users": [{"user_id", "username", "types": [...]}]}
+    """
+    labels = dict(db.session.execute(select(SpeechPartType.id, SpeechPartType.label)).fetchall())
+    query = SpeechPartStat.query.join(User, User.id == SpeechPartStat.user_id).filter(
+        SpeechPartStat.doc_id == doc_id).with_entities(SpeechPartStat, User.username)
+    if user_ids is not None:
+        query = query.filter(SpeechPartStat.user_id.in_(user_ids))
+
+    totals = {}
+    users = []
+    for stat, username in query.order_by(SpeechPartStat.user_id, SpeechPartStat.speech_part_type_id):
+        if not users or users[-1]["user_id"] != stat.user_id:
+            users.append({"user_id": stat.user_id, "username": username, "types": []})
+        users[-1]["types"].append(
+            _serialize_type_stats(stat.speech_part_type_id, stat.nb, stat.length, stat.max_length, labels))
+        nb, length, max_length, nb_users = totals.get(stat.speech_part_type_id, (0, 0, 0, 0))
+        totals[stat.speech_part_type_id] = (nb + stat.nb, length + stat.length,
+                                            max(max_length, stat.max_length), nb_users + 1)
+    return {
+        "types": [_serialize_type_stats(type_id, nb, length, max_length, labels, nb_users=nb_users)
+                  for type_id, (nb, length, max_length, nb_users) in sorted(totals.items())],
+        "users": users,
+    }
+
+
+def get_corpus_speech_part_stats(user_ids=None):
+    """ statistics of all the documents, aggregated in the database
+
+    :param user_ids: only the speech parts of these users, all of them when None
+    :return: list of the statistics of each speech part type
+    """
+    labels = dict(db.session.execute(select(SpeechPartType.id, SpeechPartType.label)).fetchall())
+    query = select(
+        SpeechPartStat.speech_part_type_id,
+        func.sum(SpeechPartStat.nb),
+        func.sum(SpeechPartStat.length),
+        func.max(SpeechPartStat.max_length),
+        func.count(SpeechPartStat.doc_id.distinct()),
+    ).group_by(SpeechPartStat.speech_part_type_id).order_by(SpeechPartStat.speech_part_type_id)
+    if user_ids is not None:
+        query = query.where(SpeechPartStat.user_id.in_(user_ids))
+    return [_serialize_type_stats(type_id, nb, length, max_length, labels, nb_docs=nb_docs)
+            for type_id, nb, length, max_length, nb_docs in db.session.execute(query)]
@@ -4,13 +4,19 @@ from markupsafe import Markup
 from sqlalchemy.orm.exc import NoResultFound
 
 from app import db
+from app.api.autosave import make_key, wants_autosave, buffer_autosave, drop_autosave, flush_autosave, \
+    register_writer
+from app.api.content_edits import apply_edits
+from app.api.reanchoring import reanchor_pointers
 from app.api.documents.document_validation import unvalidate_all
+from app.api.revisions.revision_store import record_revision
 from app.api.routes import api_bp
+from app.api.speech_parts.speech_part_stats import refresh_speech_part_stats, speech_part_aligners
 from app.models import Transcription, User, Document, \
     Note, TranscriptionHasNote, TranslationHasNote, findNoteInDoc, set_notes_from_content
 from app.utils import make_404, make_200, forbid_if_nor_teacher_nor_admin_and_wants_user_data, \
     forbid_if_nor_teacher_nor_admin, make_400, forbid_if_not_in_whitelist, is_closed, \
-    forbid_if_other_user, make_403, get_doc, check_no_XMLParserError
+    forbid_if_other_user, make_403, get_doc, check_no_XMLParserError, content_hash, make_409
 
 """
 ===========================
@@ -116,6 +122,7 @@ def api_post_documents_transcriptions(api_version, doc_id, user_id):
             tr = Transcription(doc_id=doc_id, content=data["content"], user_id=user_id)
             set_notes_from_content(tr)
             db.session.add(tr)
+            record_revision('transcription', doc_id, user_id, tr.content, author_id=current_user.id)
             db.session.commit()
         except Exception as e:
             db.session.rollback()
@@ -127,6 +134,47 @@ def api_post_documents_transcriptions(api_version, doc_id, user_id):
         return make_400("no data")
 
 
+def forbid_transcription_update(doc_id):
+    is_not_allowed = forbid_if_not_in_whitelist(current_app, Document.query.filter(Document.id == doc_id).first())
+    if is_not_allowed:
+        return is_not_allowed
+
+    # teachers can still update validated transcription
+    current_user = current_app.get_current_user()
+    if not current_user.is_teacher and get_doc(doc_id).is_transcription_validated:
+        return make_403()
+
+    return is_closed(doc_id)
+
+
+def update_transcription_content(transcription, content, author_id=None):
+    """ replace the content of a transcription, move the pointers into it, reconcile its notes
+    and record a new revision.
+    The caller is responsible for committing the session.
+
+    :return: the re-anchoring report (see app.api.reanchoring)
+    """
+    error = check_no_XMLParserError(content)
+    if error:
+        raise Exception('Transcription content is malformed: %s', str(error))
+    previous_content = transcription.content
+    transcription.content = content
+    reanchoring = reanchor_pointers('transcription', transcription.id, previous_content, content)
+    if reanchoring["moved"]:
+        # the lengths of the speech parts aligned on the transcription may have changed
+        for user_id in speech_part_aligners(transcription.id):
+            refresh_speech_part_stats(transcription.doc_id, user_id)
+    notes = set(transcription.notes)
+    set_notes_from_content(transcription)
+    db.session.flush()
+    for note in notes:
+        note.delete_if_unused()
+    record_revision('transcription', transcription.doc_id, transcription.user_id, transcription.content,
+                    previous_content=previous_content, author_id=author_id)
+    db.session.add(transcription)
+    return reanchoring
+
+
 @api_bp.route('/api/<api_version>/documents/<doc_id>/transcriptions/from-user/<user_id>', methods=["PUT"])
 @jwt_required
 def api_put_documents_transcriptions(api_version, doc_id, user_id):
@@ -146,46 +194,93 @@ def api_put_documents_transcriptions(api_version, doc_id, user_id):
     #if forbid:
     #    return forbid
 
-    is_not_allowed = forbid_if_not_in_whitelist(current_app, Document.query.filter(Document.id == doc_id).first())
-    if is_not_allowed:
-        return is_not_allowed
+    forbid = forbid_transcription_update(doc_id)
+    if forbid:
+        return forbid
 
-    # teachers can still update validated transcription
-    current_user = current_app.get_current_user()
-    if not current_user.is_teacher and get_doc(doc_id).is_transcription_validated:
-        return make_403()
+    data = request.get_json()
+    if "data" in data:
+        data = data["data"]
+        transcription = get_transcription(doc_id=doc_id, user_id=user_id)
+        if transcription is None:
+            return make_404()
+        key = make_key('transcription', doc_id, user_id)
+        if wants_autosave(current_app, request) and "content" in data:
+            return buffer_autosave(key, data["content"])
+        # an explicit save supersedes the pending autosave
+        drop_autosave(key)
+        try:
+            reanchoring = update_transcription_content(transcription, data["content"],
+                                                       author_id=current_app.get_current_user().id)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print('Error', str(e))
+            return make_400(str(e))
+        return make_200(data=dict(transcription.serialize_for_user(user_id), reanchoring=reanchoring))
+    else:
+        return make_400("no data")
 
-    forbid = is_closed(doc_id)
+
+@api_bp.route('/api/<api_version>/documents/<doc_id>/transcriptions/from-user/<user_id>', methods=["PATCH"])
+@jwt_required
+def api_patch_documents_transcriptions(api_version, doc_id, user_id):
+    """
+    Apply text edits to the transcription content (see app.api.content_edits)
+     {
+         "data":
+             {
+                 "base": "<content_hash>",
+                 "edits": [{"offset": 3, "length": 2, "replacement": "Om"}]
+             }
+     }
+     :param user_id:
+     :param api_version:
+     :param doc_id:
+     :return:
+     """
+    forbid = forbid_transcription_update(doc_id)
     if forbid:
         return forbid
 
     data = request.get_json()
     if "data" in data:
         data = data["data"]
+        flush_autosave(make_key('transcription', doc_id, user_id))
         transcription = get_transcription(doc_id=doc_id, user_id=user_id)
         if transcription is None:
             return make_404()
+        if data.get("base") != content_hash(transcription.content):
+            return make_409(details="The transcription has changed since this version")
         try:
-                error = check_no_XMLParserError(data["content"])
-                if error:
-                    raise Exception('Transcription content is malformed: %s', str(error))
-                transcription.content = data["content"]
-                notes = set(transcription.notes)
-                set_notes_from_content(transcription)
-                db.session.flush()
-                for note in notes:
-                    note.delete_if_unused()
-                db.session.add(transcription)
-                db.session.commit()
+            content = apply_edits(transcription.content, data.get("edits", []))
+            reanchoring = update_transcription_content(transcription, content,
+                                                       author_id=current_app.get_current_user().id)
+            db.session.commit()
         except Exception as e:
             db.session.rollback()
             print('Error', str(e))
             return make_400(str(e))
-        return make_200(data=transcription.serialize_for_user(user_id))
+        return make_200(data=dict(transcription.serialize_for_user(user_id), reanchoring=reanchoring))
     else:
         return make_400("no data")
 
 
+def write_autosaved_transcription(doc_id, user_id, type_id, content, author_id):
+    transcription = get_transcription(doc_id=doc_id, user_id=user_id)
+    if transcription is None:
+        raise Exception("Transcription not found")
+    try:
+        update_transcription_content(transcription, content, author_id=author_id)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+register_writer('transcription', write_autosaved_transcription)
+
+
 def delete_document_transcription(doc_id, user_id):
     forbid = forbid_if_nor_teacher_nor_admin_and_wants_user_data(current_app, user_id)
     if forbid:
@@ -216,8 +311,12 @@ def delete_document_transcription(doc_id, user_id):
     if tr is None:
         return make_404()
 
+    drop_autosave(make_key('transcription', doc_id, user_id))
     try:
+        speech_part_users = speech_part_aligners(tr.id)
         db.session.delete(tr)
+        for speech_part_user_id in speech_part_users:
+            refresh_speech_part_stats(doc_id, speech_part_user_id)
         doc = unvalidate_all(doc)
         db.session.add(doc)
         db.session.commit()
@@ -250,10 +349,12 @@ def clone_transcription(doc_id, user_id):
     teacher = current_app.get_current_user()
     teacher_tr = Transcription.query.filter(Transcription.user_id == teacher.id,
                                             Transcription.doc_id == doc_id).first()
+    previous_content = None
     if teacher_tr is None:
         teacher_tr = Transcription(doc_id=doc_id, user_id=teacher.id, content=tr_to_be_cloned.content)
     else:
         # replace the teacher's tr content
+        previous_content = teacher_tr.content
         teacher_tr.content = tr_to_be_cloned.content
         # remove the old teacher's notes
         for note in teacher_tr.notes:
@@ -269,6 +370,8 @@ def clone_transcription(doc_id, user_id):
         teacher_tr.notes.append(note)
 
     db.session.add(teacher_tr)
+    record_revision('transcription', doc_id, teacher.id, teacher_tr.content,
+                    previous_content=previous_content, author_id=teacher.id)
 
     try:
         db.session.commit()
@@ -297,23 +400,44 @@ def _ptr_start(k):
 
 
 def add_notes_refs_to_text(text, notes, btag=BTAG, etag=ETAG):
-    len_of_tag = len(btag) + len(etag)
-    text_with_notes = text
+    """ surround the text of the notes with btag/etag; the notes are sorted by ptr_start in place
+
+    :param text:
+    :param notes: list of {"id", "ptr_start", "ptr_end"}
+    :return: the text with the notes tags
+    """
+    if not notes:
+        return text
 
     notes.sort(key=_ptr_start)
-    for num_note, note in enumerate(notes):
-        offset = len_of_tag * num_note
-        offset += 3 * num_note  # decalage?
-        start_offset = int(note["ptr_start"]) + offset
-        end_offset = int(note["ptr_end"]) + offset
-        kwargs = {
-            "btag": btag.format(note["id"]),
-            "etag": etag,
-            "text_before": text_with_notes[0:start_offset],
-            "text_between": text_with_notes[start_offset:end_offset],
-            "text_after": text_with_notes[end_offset:]
-        }
-        text_with_notes = "{text_before}{btag}{text_between}{etag}{text_after}".format(**kwargs)
+    ptrs = [(int(note["ptr_start"]), int(note["ptr_end"])) for note in notes]
+    btags = [btag.format(note["id"]) for note in notes]
+    # length each note is expected to add to the text (btag with a formatted id of 10 digits)
+    shift = len(btag) + len(etag) + 3
+
+    # notes which do not overlap are inserted in a single pass
+    parts = []
+    pos = 0
+    for (start, end), note_btag in zip(ptrs, btags):
+        if not (pos <= start <= end <= len(text)) or len(note_btag) + len(etag) != shift:
+            return _insert_notes_refs_one_by_one(text, ptrs, btags, etag, shift)
+        parts.extend((text[pos:start], note_btag, text[start:end], etag))
+        pos = end
+    parts.append(text[pos:])
+    return "".join(parts)
+
+
+def _insert_notes_refs_one_by_one(text, ptrs, btags, etag, shift):
+    """ insert the tags of each note in the text produced by the previous note,
+    shifting its pointers by the length added by the previous notes """
+    text_with_notes = text
+    for num_note, ((start, end), note_btag) in enumerate(zip(ptrs, btags)):
+        offset = shift * num_note
+        start_offset = start + offset
+        end_offset = end + offset
+        text_with_notes = "".join((text_with_notes[0:start_offset], note_btag,
+                                   text_with_notes[start_offset:end_offset], etag,
+                                   text_with_notes[end_offset:]))
     return text_with_notes
 
 
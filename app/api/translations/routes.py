@@ -4,12 +4,17 @@ from markupsafe import Markup
 from sqlalchemy.orm.exc import NoResultFound
 
 from app import db
+from app.api.autosave import make_key, wants_autosave, buffer_autosave, drop_autosave, flush_autosave, \
+    register_writer
+from app.api.content_edits import apply_edits
+from app.api.reanchoring import reanchor_pointers
+from app.api.revisions.revision_store import record_revision
 from app.api.routes import api_bp
 from app.models import User, Document, Translation, \
     Note, TranslationHasNote, TranscriptionHasNote, findNoteInDoc, set_notes_from_content
 from app.utils import make_404, make_200, forbid_if_nor_teacher_nor_admin_and_wants_user_data, \
     forbid_if_nor_teacher_nor_admin, make_400, forbid_if_not_in_whitelist, make_403, is_closed, \
-    forbid_if_other_user, get_doc, check_no_XMLParserError
+    forbid_if_other_user, get_doc, check_no_XMLParserError, content_hash, make_409
 
 """
 ===========================
@@ -123,6 +128,7 @@ def api_post_documents_translations(api_version, doc_id, user_id):
                 tr = Translation(doc_id=doc_id, content=data["content"], user_id=user_id)
                 db.session.add(tr)
                 db.session.flush()
+                record_revision('translation', doc_id, user_id, tr.content, author_id=current_user.id)
             # case 2) there's only "notes" in data
             if "notes" in data:
                 tr = Translation.query.filter(Translation.doc_id == doc_id,
@@ -183,6 +189,39 @@ def api_post_documents_translations(api_version, doc_id, user_id):
         return make_400("no data")
 
 
+def forbid_translation_update(doc_id):
+    # teachers can still update validated translation
+    current_user = current_app.get_current_user()
+    if not current_user.is_teacher and get_doc(doc_id).is_translation_validated:
+        return make_403()
+
+    return is_closed(doc_id)
+
+
+def update_translation_content(translation, content, author_id=None):
+    """ replace the content of a translation, move the pointers into it, reconcile its notes
+    and record a new revision.
+    The caller is responsible for committing the session.
+
+    :return: the re-anchoring report (see app.api.reanchoring)
+    """
+    error = check_no_XMLParserError(content)
+    if error:
+        raise Exception('Translation content is malformed: %s', str(error))
+    previous_content = translation.content
+    translation.content = content
+    reanchoring = reanchor_pointers('translation', translation.id, previous_content, content)
+    notes = set(translation.notes)
+    set_notes_from_content(translation)
+    db.session.flush()
+    for note in notes:
+        note.delete_if_unused()
+    record_revision('translation', translation.doc_id, translation.user_id, translation.content,
+                    previous_content=previous_content, author_id=author_id)
+    db.session.add(translation)
+    return reanchoring
+
+
 @api_bp.route('/api/<api_version>/documents/<doc_id>/translations/from-user/<user_id>', methods=["PUT"])
 @jwt_required
 def api_put_documents_translations(api_version, doc_id, user_id):
@@ -202,12 +241,7 @@ def api_put_documents_translations(api_version, doc_id, user_id):
     #if forbid:
     #    return forbid
 
-    # teachers can still update validated translation
-    current_user = current_app.get_current_user()
-    if not current_user.is_teacher and get_doc(doc_id).is_translation_validated:
-        return make_403()
-
-    forbid = is_closed(doc_id)
+    forbid = forbid_translation_update(doc_id)
     if forbid:
         return forbid
 
@@ -217,28 +251,85 @@ def api_put_documents_translations(api_version, doc_id, user_id):
         translation = get_translation(doc_id=doc_id, user_id=user_id)
         if translation is None:
             return make_404()
+        key = make_key('translation', doc_id, user_id)
+        if wants_autosave(current_app, request) and "content" in data:
+            return buffer_autosave(key, data["content"])
+        # an explicit save supersedes the pending autosave
+        drop_autosave(key)
+        reanchoring = None
         try:
             if "content" in data:
-                error = check_no_XMLParserError(data["content"])
-                if error:
-                    raise Exception('Translation content is malformed: %s', str(error))
-                translation.content = data["content"]
-                notes = set(translation.notes)
-                set_notes_from_content(translation)
-                db.session.flush()
-                for note in notes:
-                    note.delete_if_unused()
-                db.session.add(translation)
+                reanchoring = update_translation_content(translation, data["content"],
+                                                         author_id=current_app.get_current_user().id)
                 db.session.commit()
         except Exception as e:
             db.session.rollback()
             print('Error', str(e))
             return make_400(str(e))
-        return make_200(data=translation.serialize_for_user(user_id))
+        return make_200(data=dict(translation.serialize_for_user(user_id), reanchoring=reanchoring))
     else:
         return make_400("no data")
 
 
+@api_bp.route('/api/<api_version>/documents/<doc_id>/translations/from-user/<user_id>', methods=["PATCH"])
+@jwt_required
+def api_patch_documents_translations(api_version, doc_id, user_id):
+    """
+    Apply text edits to the translation content (see app.api.content_edits)
+     {
+         "data":
+             {
+                 "base": "<content_hash>",
+                 "edits": [{"offset": 3, "length": 2, "replacement": "Om"}]
+             }
+     }
+     :param user_id:
+     :param api_version:
+     :param doc_id:
+     :return:
+     """
+    forbid = forbid_translation_update(doc_id)
+    if forbid:
+        return forbid
+
+    data = request.get_json()
+    if "data" in data:
+        data = data["data"]
+        flush_autosave(make_key('translation', doc_id, user_id))
+        translation = get_translation(doc_id=doc_id, user_id=user_id)
+        if translation is None:
+            return make_404()
+        if data.get("base") != content_hash(translation.content):
+            return make_409(details="The translation has changed since this version")
+        try:
+            content = apply_edits(translation.content, data.get("edits", []))
+            reanchoring = update_translation_content(translation, content,
+                                                       author_id=current_app.get_current_user().id)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print('Error', str(e))
+            return make_400(str(e))
+        return make_200(data=dict(translation.serialize_for_user(user_id), reanchoring=reanchoring))
+    else:
+        return make_400("no data")
+
+
+def write_autosaved_translation(doc_id, user_id, type_id, content, author_id):
+    translation = get_translation(doc_id=doc_id, user_id=user_id)
+    if translation is None:
+        raise Exception("Translation not found")
+    try:
+        update_translation_content(translation, content, author_id=author_id)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+register_writer('translation', write_autosaved_translation)
+
+
 def delete_document_translation(doc_id, user_id):
     forbid = forbid_if_nor_teacher_nor_admin_and_wants_user_data(current_app, user_id)
     if forbid:
@@ -265,6 +356,7 @@ def delete_document_translation(doc_id, user_id):
     if tr is None:
         return make_404()
 
+    drop_autosave(make_key('translation', doc_id, user_id))
     try:
         for note in tr.notes:
             if note.user_id == int(user_id):
@@ -302,10 +394,12 @@ def clone_translation(doc_id, user_id):
     teacher = current_app.get_current_user()
     teacher_tr = Translation.query.filter(Translation.user_id == teacher.id,
                                           Translation.doc_id == doc_id).first()
+    previous_content = None
     if teacher_tr is None:
         teacher_tr = Translation(doc_id=doc_id, user_id=teacher.id, content=tr_to_be_cloned.content)
     else:
         # replace the teacher's tr content
+        previous_content = teacher_tr.content
         teacher_tr.content = tr_to_be_cloned.content
         # remove the old teacher's notes
         for note in teacher_tr.notes:
@@ -321,6 +415,8 @@ def clone_translation(doc_id, user_id):
         teacher_tr.notes.append(note)
 
     db.session.add(teacher_tr)
+    record_revision('translation', doc_id, teacher.id, teacher_tr.content,
+                    previous_content=previous_content, author_id=teacher.id)
 
     try:
         db.session.commit()
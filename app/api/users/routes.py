@@ -1,13 +1,15 @@
 from flask import request, current_app, jsonify
 from flask_jwt_extended import jwt_required
 import jwt
-from sqlalchemy import func, text
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import selectinload
 from sqlalchemy.orm.exc import NoResultFound
 
 from app import auth, db
 from app.api.response import APIResponseFactory
 from app.api.routes import api_bp
-from app.models import User, Role, Whitelist, Document
+from app.models import User, Role, Whitelist, Document, association_user_has_role, association_whitelist_has_user
+from app.token_versions import bump_token_version
 from app.utils import make_200, make_404, forbid_if_nor_teacher_nor_admin, make_409, make_403, make_400, \
     forbid_if_nor_teacher_nor_admin_and_wants_user_data
 
@@ -57,23 +59,69 @@ def api_users(api_version, user_id):
         return make_404()
 
 
+# case insensitive, as their indexes
+SEARCHED_USER_COLUMNS = (User.username, User.first_name, User.last_name, User.email)
+
+
+def _prefix_condition(column, prefix):
+    """ column starts with prefix, written as a range so that the index of the column is used """
+    column = column.collate('NOCASE')
+    return and_(column >= prefix, column < prefix + '\U0010ffff')
+
+
+def filter_users(query, role=None, whitelist_id=None, search=None):
+    """ filter a query of users in SQL
+
+    :param role: name of a role the users have
+    :param whitelist_id: id of a whitelist the users belong to
+    :param search: case insensitive prefix of the username, the first name, the last name or the email
+    """
+    if role:
+        query = query.join(association_user_has_role, association_user_has_role.c.user_id == User.id).join(
+            Role, Role.id == association_user_has_role.c.role_id).filter(Role.name == role)
+    if whitelist_id:
+        query = query.join(association_whitelist_has_user, association_whitelist_has_user.c.user_id == User.id).filter(
+            association_whitelist_has_user.c.whitelist_id == whitelist_id)
+    if search:
+        query = query.filter(or_(*[_prefix_condition(column, search) for column in SEARCHED_USER_COLUMNS]))
+    return query
+
+
+def paginate_users(query):
+    """ total and page of a query of users, the roles of the page being loaded in a single query """
+    page_number = request.args.get('num-page', 1)
+    page_size = request.args.get('page-size', 50)
+    total = query.count()
+    users = query.options(selectinload(User.roles)).paginate(
+        int(page_number), int(page_size), max_per_page=100, error_out=False).items
+    return total, users
+
+
 @api_bp.route('/api/<api_version>/users')
 @jwt_required
 @forbid_if_nor_teacher_nor_admin
 def api_all_users(api_version):
-    page_number = request.args.get('num-page', 1)
-    page_size = request.args.get('page-size', 50)
-
-    query = User.query
-    total = query.count()
+    """
+    Filtered with the parameters:
+        role: name of a role of the users
+        whitelist-id: id of a whitelist the users belong to
+        search: prefix of the username, the first name, the last name or the email
+    """
+    query = filter_users(User.query, role=request.args.get('role'), whitelist_id=request.args.get('whitelist-id'),
+                         search=request.args.get('search'))
 
     sort = request.args.get('sort-by', None)
     if sort:
         field, order = sort.split('.')
-        query = query.order_by(text("%s %s" % (field, "desc" if order == "asc" else "asc")))
-
-    users = query.paginate(int(page_number), int(page_size), max_per_page=100, error_out=False).items
+        # qualified by the table: the column names may be ambiguous with the filters joined
+        column = User.__table__.c.get(field)
+        if column is None:
+            return make_400("Unknown field: %s" % field)
+        query = query.order_by(column.desc() if order == "asc" else column.asc())
+    else:
+        query = query.order_by(User.id)
 
+    total, users = paginate_users(query)
     return make_200(data={"total": total, "users": [u.serialize() for u in users]})
 
 
@@ -81,8 +129,14 @@ def api_all_users(api_version):
 @jwt_required
 @forbid_if_nor_teacher_nor_admin
 def api_all_teachers(api_version):
-    teachers = [u.serialize() for u in User.query.order_by(User.username).all() if u.is_teacher]
-    return make_200(data={"users": teachers})
+    """ all the teachers, or a page of them when num-page is given; filtered by the search parameter """
+    query = filter_users(User.query, role="teacher", search=request.args.get('search')).order_by(User.username)
+    if 'num-page' in request.args:
+        total, teachers = paginate_users(query)
+    else:
+        teachers = query.options(selectinload(User.roles)).all()
+        total = len(teachers)
+    return make_200(data={"total": total, "users": [u.serialize() for u in teachers]})
 
 
 @api_bp.route('/api/<api_version>/users/<user_id>/roles')
@@ -137,6 +191,7 @@ def api_post_users_roles(api_version, user_id):
 
         db.session.add(target_user)
         try:
+            bump_token_version(target_user.id)
             db.session.commit()
             return make_200(data=[r.serialize() for r in target_user.roles])
         except Exception as e:
@@ -159,6 +214,7 @@ def api_delete_user(api_version, user_id):
 
         try:
             db.session.delete(target_user)
+            bump_token_version(target_user.id)
             db.session.commit()
             return make_200(data=[])
         except Exception as e:
@@ -187,6 +243,7 @@ def api_delete_users_roles(api_version, user_id):
     db.session.add(target_user)
 
     try:
+        bump_token_version(target_user.id)
         db.session.commit()
         return make_200()
     except Exception as e:
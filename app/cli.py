@@ -1,3 +1,4 @@
+import datetime
 import pprint
 from urllib.request import urlopen
 
@@ -59,6 +60,17 @@ def make_cli():
             db.session.commit()
             click.echo("Dropped then recreated the database")
 
+    @click.command("db-indexes")
+    def db_indexes():
+        """ Creates the indexes missing from the tables of an existing database
+        """
+        with app.app_context():
+            from app import db
+            for table in db.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(db.engine, checkfirst=True)
+            click.echo("Indexes created")
+
     @click.command("load-fixtures")
     def db_load_fixtures():
         """ Reload fixtures
@@ -148,6 +160,138 @@ def make_cli():
             print('@context not supported:', data['@context'])
             return
 
+    @click.command("revisions-compact")
+    @click.option('--keep-last', default=None, type=int, help="number of revisions to keep for each content")
+    @click.option('--older-than-days', default=None, type=int, help="only drop revisions older than this")
+    @click.option('--kind', default=None, type=click.Choice(['transcription', 'translation']))
+    def db_revisions_compact(keep_last, older_than_days, kind):
+        """ Drop old content revisions, keeping the remaining ones materializable
+        """
+        with app.app_context():
+            from app.api.revisions.revision_store import compact_revisions
+
+            older_than = None
+            if older_than_days is not None:
+                older_than = datetime.datetime.now() - datetime.timedelta(days=older_than_days)
+            deleted = compact_revisions(keep_last=keep_last, older_than=older_than, kind=kind)
+            click.echo("%s revision(s) deleted" % deleted)
+
+    @click.command("plain-text-backfill")
+    @click.option('--all', 'all_rows', is_flag=True, help="recompute the plain text of every content")
+    @click.option('--batch-size', default=500, type=int)
+    def db_plain_text_backfill(all_rows, batch_size):
+        """ Add the plain text columns if needed and compute the plain text of the existing contents
+        """
+        with app.app_context():
+            from app import db
+            from app.models import Transcription, Translation, Commentary, SpeechParts
+            from app.plain_text import add_plain_text_columns, backfill_plain_text
+
+            models = (Transcription, Translation, Commentary, SpeechParts)
+            for column in add_plain_text_columns(db, models):
+                click.echo("Added column %s" % column)
+            counts = backfill_plain_text(db, models, only_missing=not all_rows, batch_size=batch_size)
+            for table, count in counts.items():
+                click.echo("%s: %s row(s) updated" % (table, count))
+
+    @click.command("alignments-suggest")
+    @click.option('--doc-id', required=True, type=int)
+    @click.option('--user-id', required=True, type=int, help="owner of the translation")
+    @click.option('--save', is_flag=True, help="replace the alignments of the translation with the suggestions")
+    def db_alignments_suggest(doc_id, user_id, save):
+        """ Propose alignments between the reference transcription of a document and a translation
+        """
+        with app.app_context():
+            from app import db
+            from app.alignment_suggestions import suggest_translation_alignments
+            from app.api.alignments.alignments_translation import replace_translation_alignments
+            from app.api.transcriptions.routes import get_reference_transcription
+            from app.api.translations.routes import get_translation
+
+            transcription = get_reference_transcription(doc_id)
+            translation = get_translation(doc_id, user_id)
+            if transcription is None or translation is None:
+                click.echo("No reference transcription or no translation for this document")
+                return
+
+            ptrs = suggest_translation_alignments(transcription, translation)
+            for ptr in ptrs:
+                click.echo("%s\t%s\t%s\t%s" % ptr)
+            if save:
+                replace_translation_alignments(transcription.id, translation.id, ptrs)
+                db.session.commit()
+                click.echo("%s alignment(s) saved" % len(ptrs))
+
+    @click.command("speech-part-stats")
+    def db_speech_part_stats():
+        """ Compute again the statistics of the speech parts of every document and user
+        """
+        with app.app_context():
+            from app import db
+            from app.api.speech_parts.speech_part_stats import rebuild_speech_part_stats
+
+            refreshed = rebuild_speech_part_stats()
+            db.session.commit()
+            click.echo("%s document(s) and user(s) refreshed" % refreshed)
+
+    @click.command("document-access")
+    def db_document_access():
+        """ Compute again the index of the documents each user can edit
+        """
+        with app.app_context():
+            from app import db
+            from app.document_access import refresh_document_access
+            from app.models import DocumentAccess
+
+            refresh_document_access()
+            db.session.commit()
+            click.echo("%s document access(es) indexed" % DocumentAccess.query.count())
+
+    @click.command("invite-users")
+    @click.argument('roster', type=click.File('rb'))
+    @click.option('--whitelist-id', default=None, type=int, help="add the users to this whitelist")
+    def db_invite_users(roster, whitelist_id):
+        """ Invite the users of a roster (CSV with a header line, or JSON), and send their invitations
+        """
+        with app.app_context():
+            from app import db
+            from app.invitations import RosterError, invite_users, parse_roster
+            from app.mail_outbox import send_all_pending
+
+            name = getattr(roster, 'name', '')
+            try:
+                rows = parse_roster(roster.read(), format='json' if name.endswith('.json') else None)
+                result = invite_users(rows, whitelist_id=whitelist_id)
+            except RosterError as e:
+                db.session.rollback()
+                raise click.ClickException(str(e))
+            db.session.commit()
+            click.echo("%s user(s) invited, %s already existing" % (len(result["invited"]), len(result["existing"])))
+            if app.config.get("MAIL_OUTBOX_SENDER") != 'worker':
+                sent, failed = send_all_pending()
+                click.echo("%s mail(s) sent, %s failed attempt(s)" % (sent, failed))
+
+    @click.command("mail-worker")
+    @click.option('--once', is_flag=True, help="send the due mails and exit")
+    @click.option('--batch-size', default=None, type=int)
+    def mail_worker(once, batch_size):
+        """ Send the mails of the outbox (when MAIL_OUTBOX_SENDER is 'worker')
+        """
+        import time
+
+        with app.app_context():
+            from app import db
+            from app.mail_outbox import send_all_pending
+
+            while True:
+                sent, failed = send_all_pending(batch_size)
+                if sent or failed:
+                    click.echo("%s mail(s) sent, %s failed attempt(s)" % (sent, failed))
+                db.session.remove()
+                if once:
+                    return
+                time.sleep(app.config["MAIL_OUTBOX_POLL_INTERVAL"])
+
     @click.command("run")
     def run():
         """ Run the application in Debug Mode [Not Recommended on production]
@@ -156,8 +300,16 @@ def make_cli():
 
     cli.add_command(db_create)
     cli.add_command(db_recreate)
+    cli.add_command(db_indexes)
     cli.add_command(db_add_manifest)
     cli.add_command(db_load_fixtures)
+    cli.add_command(db_revisions_compact)
+    cli.add_command(db_plain_text_backfill)
+    cli.add_command(db_alignments_suggest)
+    cli.add_command(db_speech_part_stats)
+    cli.add_command(db_document_access)
+    cli.add_command(db_invite_users)
+    cli.add_command(mail_worker)
 
     cli.add_command(run)
 
@@ -0,0 +1,130 @@
+import datetime
+
+from sqlalchemy import event, false, func, inspect, literal, or_, select, union_all
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import Document, DocumentAccess, User, Whitelist, association_whitelist_has_user
+
+"""
+========================================================
+    Document access index
+========================================================
+
+The documents a user can edit as their owner or as a member of their whitelist are kept
+in the document_access table, with their closing date: the documents of a user which
+are not closed are read with a single query on its primary key.
+
+The rows of a document are computed again each time the session flushes a change of:
+    - its owner, its whitelist or its closing date, or the document itself
+    - the members of its whitelist
+The deleted documents and users lose their rows by cascade.
+"""
+
+CLOSING_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+INDEXED_DOCUMENT_ATTRIBUTES = ('user_id', 'whitelist_id', 'date_closing', 'whitelist', 'user')
+
+
+def _access_rows_query(doc_ids=None):
+    """ (user_id, doc_id, is_owner, from_whitelist, date_closing) of the documents """
+    owners = select(
+        Document.user_id.label('user_id'), Document.id.label('doc_id'),
+        literal(1).label('is_owner'), literal(0).label('from_whitelist')
+    ).where(Document.user_id.isnot(None))
+    wl = association_whitelist_has_user
+    members = select(
+        wl.c.user_id.label('user_id'), Document.id.label('doc_id'),
+        literal(0).label('is_owner'), literal(1).label('from_whitelist')
+    ).join_from(Document, wl, wl.c.whitelist_id == Document.whitelist_id)
+    if doc_ids is not None:
+        owners = owners.where(Document.id.in_(doc_ids))
+        members = members.where(Document.id.in_(doc_ids))
+    access = union_all(owners, members).subquery()
+    return select(
+        access.c.user_id, access.c.doc_id,
+        func.max(access.c.is_owner), func.max(access.c.from_whitelist), Document.date_closing
+    ).join_from(access, Document, Document.id == access.c.doc_id).group_by(
+        access.c.user_id, access.c.doc_id, Document.date_closing)
+
+
+def refresh_document_access(doc_ids=None, connection=None):
+    """ compute again the access rows of some documents, of all of them when doc_ids is None.
+    The caller is responsible for committing the session.
+    """
+    connection = connection if connection is not None else db.session.connection()
+    table = DocumentAccess.__table__
+    if doc_ids is not None:
+        doc_ids = list(doc_ids)
+        if not doc_ids:
+            return
+        connection.execute(table.delete().where(table.c.doc_id.in_(doc_ids)))
+    else:
+        connection.execute(table.delete())
+    connection.execute(table.insert().from_select(
+        ['user_id', 'doc_id', 'is_owner', 'from_whitelist', 'date_closing'], _access_rows_query(doc_ids)))
+
+
+def _open_condition():
+    now = datetime.datetime.now().strftime(CLOSING_DATE_FORMAT)
+    return or_(DocumentAccess.date_closing.is_(None), DocumentAccess.date_closing == '',
+               DocumentAccess.date_closing >= now)
+
+
+def editable_documents_query(user):
+    """ query of the documents a user can edit: all of them for the teachers and the admins,
+    otherwise the ones it owns or from its whitelists which are not closed """
+    if user.is_anonymous:
+        return Document.query.filter(false())
+    if user.is_admin or user.is_teacher:
+        return Document.query
+    return Document.query.join(DocumentAccess, DocumentAccess.doc_id == Document.id).filter(
+        DocumentAccess.user_id == user.id, _open_condition())
+
+
+def whitelisted_documents_query(user):
+    """ query of the documents whose whitelist holds a user """
+    if user.is_anonymous:
+        return Document.query.filter(false())
+    return Document.query.join(DocumentAccess, DocumentAccess.doc_id == Document.id).filter(
+        DocumentAccess.user_id == user.id, DocumentAccess.from_whitelist == True)
+
+
+def _attribute_changed(instance, names):
+    state = inspect(instance)
+    return any(state.attrs[name].history.has_changes() for name in names)
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_document_access_changes(session, flush_context, instances):
+    documents = set()
+    whitelists = set()
+    for instance in session.new:
+        if isinstance(instance, Document):
+            documents.add(instance)
+    for instance in session.dirty:
+        if isinstance(instance, Document) and _attribute_changed(instance, INDEXED_DOCUMENT_ATTRIBUTES):
+            documents.add(instance)
+        elif isinstance(instance, Whitelist) and _attribute_changed(instance, ('users',)):
+            whitelists.add(instance)
+        elif isinstance(instance, User) and _attribute_changed(instance, ('whitelists',)):
+            history = inspect(instance).attrs.whitelists.history
+            whitelists.update(history.added)
+            whitelists.update(history.deleted)
+    if documents or whitelists:
+        pending = session.info.setdefault('document_access', (set(), set()))
+        pending[0].update(documents)
+        pending[1].update(whitelists)
+
+
+@event.listens_for(Session, 'after_flush')
+def _refresh_document_access(session, flush_context):
+    documents, whitelists = session.info.pop('document_access', (set(), set()))
+    if not documents and not whitelists:
+        return
+    doc_ids = set(doc.id for doc in documents if doc.id is not None and doc not in session.deleted)
+    whitelist_ids = [wl.id for wl in whitelists if wl.id is not None]
+    connection = session.connection()
+    if whitelist_ids:
+        doc_ids.update(row[0] for row in connection.execute(
+            select(Document.id).where(Document.whitelist_id.in_(whitelist_ids))))
+    refresh_document_access(doc_ids, connection)
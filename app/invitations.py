@@ -0,0 +1,195 @@
+import csv
+import datetime
+import io
+import json
+import multiprocessing
+import string
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from random import choice, randint
+
+from flask import current_app
+from flask_mail import Message
+from sqlalchemy import select
+from werkzeug.security import generate_password_hash
+
+from app import db
+from app.document_access import refresh_document_access
+from app.mail_outbox import queue_mails
+from app.models import Document, Role, User, Whitelist, association_user_has_role, association_whitelist_has_user
+
+"""
+========================================================
+    Invitations
+========================================================
+
+A user is invited with a random password, which is sent to it by mail.
+
+A roster (a CSV file or a JSON list, one user per row) is invited in one transaction:
+the passwords are hashed by a pool of processes, the users and their roles are inserted
+with one statement each, the mails are queued in the outbox (see app/mail_outbox.py),
+and the users can be added to a whitelist. The users whose email already exists are not
+invited again, but are added to the whitelist.
+"""
+
+# the roles given to an invited user
+INVITATION_ROLES = {
+    'student': ('student',),
+    'teacher': ('student', 'teacher'),
+    'admin': ('admin', 'student', 'teacher'),
+}
+ROSTER_FIELDS = ('email', 'role', 'username', 'firstname', 'lastname')
+# below this number of passwords, starting the processes costs more than it saves
+HASH_POOL_MIN_SIZE = 8
+
+
+class RosterError(ValueError):
+    pass
+
+
+def make_password():
+    return ''.join(choice(string.ascii_letters) for i in range(5)) + str(randint(1, 100)).zfill(3)
+
+
+def invitation_message(email, password):
+    msg = Message('Contribute to Adele', sender=current_app.config['MAIL_USERNAME'], recipients=[email])
+    msg.body = "Vous avez été invité(e) à contribuer au projet Adele (" \
+               "https://dev.chartes.psl.eu/adele/profile).\nIdentifiant: %s\nMot de passe: %s\nN'oubliez pas de " \
+               "changer votre mot de passe après votre première connexion !" % (email, password)
+    return msg
+
+
+def hash_passwords(passwords, processes=None):
+    """ hash the passwords with PASSWORD_HASH_METHOD, in a pool of processes when there are enough of them.
+    A roster is hashed at once, without the per-request pool of app/passwords.py
+
+    :param processes: size of the pool, INVITATION_HASH_PROCESSES (or the number of CPUs) by default
+    """
+    processes = processes or current_app.config.get("INVITATION_HASH_PROCESSES") or multiprocessing.cpu_count()
+    hash_password = partial(generate_password_hash, method=current_app.config.get("PASSWORD_HASH_METHOD",
+                                                                                   "pbkdf2:sha256"))
+    if processes == 1 or len(passwords) < HASH_POOL_MIN_SIZE:
+        return [hash_password(p) for p in passwords]
+    # the processes are spawned rather than forked from a threaded web worker
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return list(pool.map(hash_password, passwords,
+                             chunksize=max(1, len(passwords) // (processes * 4))))
+
+
+def parse_roster(content, format=None):
+    """ rows of a roster
+
+    :param content: CSV text (with a header line), JSON text, or a list of dicts or emails
+    :param format: 'csv' or 'json', guessed from the content by default
+    :return: a list of dicts with the ROSTER_FIELDS keys
+    """
+    if isinstance(content, bytes):
+        content = content.decode('utf-8-sig')
+    if isinstance(content, str):
+        if format is None:
+            format = 'json' if content.lstrip()[:1] in ('[', '{') else 'csv'
+        if format == 'json':
+            try:
+                content = json.loads(content)
+            except ValueError as e:
+                raise RosterError("Invalid JSON roster: %s" % e)
+            if isinstance(content, dict):
+                content = content.get("users")
+        else:
+            try:
+                dialect = csv.Sniffer().sniff(content.split('\n', 1)[0], delimiters=',;\t')
+            except csv.Error:
+                dialect = csv.excel
+            reader = csv.DictReader(io.StringIO(content), dialect=dialect)
+            content = [{(k or '').strip().lower(): v for k, v in row.items()} for row in reader]
+    if not isinstance(content, list):
+        raise RosterError("A roster is a list of users")
+
+    rows = []
+    for line, row in enumerate(content, start=1):
+        if isinstance(row, str):
+            row = {"email": row}
+        if not isinstance(row, dict):
+            raise RosterError("Row %s: invalid user" % line)
+        row = {field: (str(row.get(field) or '')).strip() for field in ROSTER_FIELDS}
+        if '@' not in row['email']:
+            raise RosterError("Row %s: invalid email '%s'" % (line, row['email']))
+        row['role'] = row['role'].lower() or 'student'
+        if row['role'] not in INVITATION_ROLES:
+            raise RosterError("Row %s: unknown role '%s'" % (line, row['role']))
+        row['username'] = row['username'] or row['email'].split('@')[0]
+        row['firstname'] = row['firstname'] or row['username']
+        row['lastname'] = row['lastname'] or row['username']
+        rows.append(row)
+    if not rows:
+        raise RosterError("The roster is empty")
+    return rows
+
+
+def _check_duplicates(rows, field):
+    seen = {}
+    for line, row in enumerate(rows, start=1):
+        if row[field] in seen:
+            raise RosterError("Row %s: %s '%s' already used row %s" % (line, field, row[field], seen[row[field]]))
+        seen[row[field]] = line
+
+
+def invite_users(rows, whitelist_id=None):
+    """ invite the users of a roster, and add them to a whitelist.
+    The caller is responsible for committing the session and waking the mail sender up.
+
+    :param rows: rows of parse_roster
+    :return: {'invited': [emails], 'existing': [emails], 'whitelist_id': whitelist_id}
+    """
+    if whitelist_id is not None and Whitelist.query.get(whitelist_id) is None:
+        raise RosterError("Unknown whitelist %s" % whitelist_id)
+    _check_duplicates(rows, 'email')
+
+    user = User.__table__
+    existing_ids = dict(db.session.execute(
+        select(user.c.email, user.c.id).where(user.c.email.in_([row['email'] for row in rows]))).fetchall())
+    new_rows = [row for row in rows if row['email'] not in existing_ids]
+    _check_duplicates(new_rows, 'username')
+    taken = db.session.execute(
+        select(user.c.username).where(user.c.username.in_([row['username'] for row in new_rows]))).scalars().all()
+    if taken:
+        raise RosterError("Usernames already taken: %s" % ", ".join(sorted(taken)))
+
+    passwords = [make_password() for row in new_rows]
+    hashes = hash_passwords(passwords)
+    now = datetime.datetime.now()
+    if new_rows:
+        db.session.execute(user.insert(), [
+            {"username": row['username'], "password": pw_hash, "email": row['email'],
+             "firstname": row['firstname'], "lastname": row['lastname'], "is_active": True, "confirmed_at": now}
+            for row, pw_hash in zip(new_rows, hashes)
+        ])
+    new_ids = dict(db.session.execute(
+        select(user.c.email, user.c.id).where(user.c.email.in_([row['email'] for row in new_rows]))).fetchall())
+
+    role_ids = dict(db.session.execute(select(Role.name, Role.id)).fetchall())
+    role_links = [{"user_id": new_ids[row['email']], "role_id": role_ids[name]}
+                  for row in new_rows for name in INVITATION_ROLES[row['role']] if name in role_ids]
+    if role_links:
+        db.session.execute(association_user_has_role.insert(), role_links)
+
+    if whitelist_id is not None:
+        wl = association_whitelist_has_user
+        user_ids = list(new_ids.values()) + list(existing_ids.values())
+        members = set(db.session.execute(select(wl.c.user_id).where(
+            wl.c.whitelist_id == whitelist_id, wl.c.user_id.in_(user_ids))).scalars())
+        added = [{"whitelist_id": whitelist_id, "user_id": user_id} for user_id in user_ids if user_id not in members]
+        if added:
+            db.session.execute(wl.insert(), added)
+            # the members are not added through the ORM, which keeps the index up to date on flush
+            refresh_document_access(db.session.execute(
+                select(Document.id).where(Document.whitelist_id == whitelist_id)).scalars().all())
+
+    queue_mails([invitation_message(row['email'], password) for row, password in zip(new_rows, passwords)])
+    # the users loaded by the session do not know their new roles and whitelists
+    db.session.expire_all()
+    return {
+        "invited": [row['email'] for row in new_rows],
+        "existing": [row['email'] for row in rows if row['email'] in existing_ids],
+        "whitelist_id": whitelist_id,
+    }
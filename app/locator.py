@@ -0,0 +1,153 @@
+import re
+from bisect import bisect_left
+from collections import Counter
+from difflib import SequenceMatcher
+
+from app.plain_text import html_to_plain_text, map_text_start, map_text_end, map_html_pos
+
+"""
+========================================================
+    Tag-aware locator
+========================================================
+
+Finds phrases in an HTML content, and maps the positions of its plain text to the content.
+
+The content is processed once (plain text, offset map, normalized text for the phrase search);
+each offset mapping then costs a binary search.
+A phrase is first searched as is in the normalized text (lowercase, whitespace collapsed).
+Otherwise its words vote for the places where it could start, and the best candidates
+are compared to the phrase with difflib.
+"""
+
+WORD_REGEX = re.compile(r'\w+')
+DEFAULT_MIN_SCORE = 0.6
+MAX_CANDIDATES = 3
+
+
+def normalize(text):
+    """ lowercase the text and collapse its whitespace
+
+    :return: (normalized text, position in the text of each normalized character)
+    """
+    chars = []
+    positions = []
+    for pos, char in enumerate(text):
+        if char.isspace():
+            if chars and chars[-1] != " ":
+                chars.append(" ")
+                positions.append(pos)
+            continue
+        for lowered in char.lower():
+            chars.append(lowered)
+            positions.append(pos)
+    return "".join(chars), positions
+
+
+class TagAwareLocator(object):
+
+    def __init__(self, plain_text, runs):
+        """
+        :param plain_text: plain text of the content
+        :param runs: offset map of the content (see app.plain_text)
+        """
+        self.text = plain_text
+        self.runs = runs
+        self._text_starts = [run[0] for run in runs]
+        self._text_ends = [run[2] for run in runs]
+        self._html_starts = [run[1] for run in runs]
+        self._normalized = None
+        self._positions = None
+        self._words = None
+
+    @classmethod
+    def from_html(cls, html):
+        return cls(*html_to_plain_text(html))
+
+    @classmethod
+    def from_container(cls, container):
+        """ locator of a content using the PlainTextMixin, computing the plain text if not stored yet """
+        if container.plain_text is not None and container.plain_text_offsets is not None:
+            return cls(container.plain_text, container.plain_text_runs)
+        return cls.from_html(container.content)
+
+    def to_html(self, pos, end=False):
+        """ map a position of the plain text to a position of the HTML content
+
+        :param end: True when pos ends a range: the position is then mapped before the following tags
+        """
+        if not self.runs:
+            return pos
+        if end:
+            return map_text_end(self.runs, self._text_ends, pos)
+        return map_text_start(self.runs, self._text_starts, pos)
+
+    def to_text(self, pos):
+        """ map a position of the HTML content to a position of the plain text """
+        if not self.runs:
+            return pos
+        return map_html_pos(self.runs, self._html_starts, pos)
+
+    def _index(self):
+        if self._normalized is None:
+            self._normalized, self._positions = normalize(self.text)
+            self._words = {}
+            for m in WORD_REGEX.finditer(self._normalized):
+                self._words.setdefault(m.group(0), []).append(m.start())
+
+    def find_text(self, phrase, start=0, min_score=DEFAULT_MIN_SCORE):
+        """ find a phrase in the plain text
+
+        :param start: position of the plain text where the search starts
+        :param min_score: minimal similarity (0 to 1) of an approximate match
+        :return: (text_start, text_end, score) or None
+        """
+        self._index()
+        needle = normalize(phrase)[0].strip()
+        if not needle:
+            return None
+        norm_start = bisect_left(self._positions, start)
+
+        found = self._normalized.find(needle, norm_start)
+        if found >= 0:
+            return self._text_span(found, found + len(needle)) + (1.0,)
+
+        # the words of the phrase vote for the position where it would start
+        slack = len(needle) // 4 + 1
+        votes = Counter()
+        for m in WORD_REGEX.finditer(needle):
+            for pos in self._words.get(m.group(0), ()):
+                if pos - m.start() >= norm_start - slack:
+                    votes[pos - m.start()] += 1
+
+        best = None
+        for candidate, _ in votes.most_common(MAX_CANDIDATES):
+            window_start = max(norm_start, candidate - slack)
+            window = self._normalized[window_start:candidate + len(needle) + slack]
+            blocks = [block for block in SequenceMatcher(None, window, needle, autojunk=False).get_matching_blocks()
+                      if block.size]
+            if not blocks:
+                continue
+            span_start = window_start + blocks[0].a
+            span_end = window_start + blocks[-1].a + blocks[-1].size
+            score = SequenceMatcher(None, self._normalized[span_start:span_end], needle, autojunk=False).ratio()
+            if best is None or score > best[2]:
+                best = (span_start, span_end, score)
+
+        if best is None or best[2] < min_score:
+            return None
+        return self._text_span(best[0], best[1]) + (best[2],)
+
+    def _text_span(self, norm_start, norm_end):
+        return self._positions[norm_start], self._positions[norm_end - 1] + 1
+
+    def find(self, phrase, start=0, min_score=DEFAULT_MIN_SCORE):
+        """ find a phrase in the HTML content
+
+        :param start: position of the HTML content where the search starts
+        :return: (html_start, html_end, score) or None
+        """
+        found = self.find_text(phrase, self.to_text(start), min_score)
+        if found is None:
+            return None
+        text_start, text_end, score = found
+        return self.to_html(text_start), self.to_html(text_end, end=True), score
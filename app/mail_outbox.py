@@ -0,0 +1,229 @@
+import datetime
+import json
+import smtplib
+import threading
+import uuid
+
+from flask import current_app
+from flask_mail import BadHeaderError, Connection, Message
+from sqlalchemy import bindparam, or_, select
+
+from app import db
+from app.models import MailOutbox
+
+"""
+========================================================
+    Mail outbox
+========================================================
+
+The mails are not sent by the requests: they are written to the mail_outbox table,
+in the transaction of the request, and sent later by a sender which does not block it:
+    - the sender thread of the process (MAIL_OUTBOX_SENDER = 'thread'), woken up
+      by wake_mail_sender once the request has committed its mails
+    - or a separate worker (MAIL_OUTBOX_SENDER = 'worker'): flask mail-worker
+
+Each round of a sender claims up to MAIL_OUTBOX_BATCH_SIZE due mails, so that several
+senders never send the same mail, and sends them over a single SMTP connection.
+A mail which cannot be sent is tried again after MAIL_OUTBOX_RETRY_DELAY * 2 ** (attempts - 1)
+seconds, and is marked as failed after MAIL_OUTBOX_MAX_ATTEMPTS attempts.
+The mails claimed by a sender which died are claimed again after MAIL_OUTBOX_CLAIM_LEASE seconds:
+a mail is sent at least once, and twice at worst.
+"""
+
+PENDING = 'pending'
+SENT = 'sent'
+FAILED = 'failed'
+
+# refused by the server for this mail only: the other mails of the batch can be sent
+MAIL_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError,
+               BadHeaderError, AssertionError)
+
+
+def _outbox_row(msg):
+    return {
+        "sender": msg.sender if isinstance(msg.sender, str) else "%s <%s>" % tuple(msg.sender),
+        "recipients": json.dumps(list(msg.send_to)),
+        "subject": msg.subject or '',
+        "body": msg.body,
+        "html": msg.html,
+    }
+
+
+def queue_mails(messages):
+    """ write Flask-Mail messages to the outbox.
+    The caller is responsible for committing the session and waking the sender up.
+
+    :return: the number of queued mails
+    """
+    rows = [_outbox_row(msg) for msg in messages]
+    if rows:
+        db.session.execute(MailOutbox.__table__.insert(), rows)
+    return len(rows)
+
+
+def queue_mail(msg):
+    return queue_mails([msg])
+
+
+def _to_message(row):
+    return Message(row.subject, sender=row.sender, recipients=json.loads(row.recipients),
+                   body=row.body, html=row.html)
+
+
+def claim_due_mails(batch_size):
+    """ claim the pending mails whose next attempt is due, committing the claim
+
+    :return: the claimed rows
+    """
+    table = MailOutbox.__table__
+    now = datetime.datetime.now()
+    lease = datetime.timedelta(seconds=current_app.config.get("MAIL_OUTBOX_CLAIM_LEASE", 300))
+    token = uuid.uuid4().hex
+    due = select(table.c.id).where(
+        table.c.status == PENDING, table.c.next_attempt_at <= now,
+        or_(table.c.claimed_at.is_(None), table.c.claimed_at < now - lease)
+    ).order_by(table.c.id).limit(batch_size)
+    claimed = db.session.execute(
+        table.update().where(table.c.id.in_(due.scalar_subquery())).values(claimed_by=token, claimed_at=now)
+    ).rowcount
+    db.session.commit()
+    if not claimed:
+        return []
+    return db.session.execute(select(table).where(table.c.claimed_by == token).order_by(table.c.id)).fetchall()
+
+
+def _send_batch(rows, mail_state):
+    """ send the rows over one connection
+
+    :return: the ids of the sent rows, {id: error} of the others
+    """
+    sent, errors = [], {}
+    try:
+        with Connection(mail_state) as connection:
+            for row in rows:
+                try:
+                    connection.send(_to_message(row))
+                    sent.append(row.id)
+                except MAIL_ERRORS as e:
+                    errors[row.id] = "%s: %s" % (type(e).__name__, e)
+    except Exception as e:
+        # the connection failed: the mails which were not sent are tried again later
+        error = "%s: %s" % (type(e).__name__, e)
+        for row in rows:
+            if row.id not in sent:
+                errors.setdefault(row.id, error)
+    return sent, errors
+
+
+def send_pending(batch_size=None, mail_state=None):
+    """ send one batch of the due mails of the outbox
+
+    :param batch_size: defaults to MAIL_OUTBOX_BATCH_SIZE
+    :param mail_state: the Flask-Mail settings of the server, current_app.extensions['mail'] by default
+    :return: (number of sent mails, number of failed attempts)
+    """
+    config = current_app.config
+    rows = claim_due_mails(batch_size or config.get("MAIL_OUTBOX_BATCH_SIZE", 50))
+    if not rows:
+        return 0, 0
+    sent, errors = _send_batch(rows, mail_state if mail_state is not None else current_app.extensions['mail'])
+
+    table = MailOutbox.__table__
+    now = datetime.datetime.now()
+    if sent:
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('_id')).values(
+                status=SENT, sent_at=now, attempts=table.c.attempts + 1, claimed_by=None, claimed_at=None),
+            [{"_id": id} for id in sent])
+    if errors:
+        max_attempts = config.get("MAIL_OUTBOX_MAX_ATTEMPTS", 5)
+        retry_delay = config.get("MAIL_OUTBOX_RETRY_DELAY", 60)
+        failures = []
+        for row in rows:
+            if row.id not in errors:
+                continue
+            attempts = row.attempts + 1
+            print("Cannot send mail %s (attempt %s): %s" % (row.id, attempts, errors[row.id]))
+            failures.append({
+                "_id": row.id, "_attempts": attempts, "_error": errors[row.id],
+                "_status": FAILED if attempts >= max_attempts else PENDING,
+                "_next_attempt_at": now + datetime.timedelta(seconds=retry_delay * 2 ** (attempts - 1)),
+            })
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('_id')).values(
+                status=bindparam('_status'), attempts=bindparam('_attempts'), last_error=bindparam('_error'),
+                next_attempt_at=bindparam('_next_attempt_at'), claimed_by=None, claimed_at=None),
+            failures)
+    db.session.commit()
+    return len(sent), len(errors)
+
+
+def send_all_pending(batch_size=None, mail_state=None):
+    """ send the due mails batch after batch, until none is left
+
+    :return: (number of sent mails, number of failed attempts)
+    """
+    total_sent, total_failed = 0, 0
+    while True:
+        sent, failed = send_pending(batch_size, mail_state)
+        if not sent and not failed:
+            return total_sent, total_failed
+        total_sent += sent
+        total_failed += failed
+
+
+class MailSender(object):
+    """ thread sending the outbox of a process: woken up when mails are queued,
+    and every MAIL_OUTBOX_POLL_INTERVAL seconds for the retries """
+
+    def __init__(self, app, mail_state=None):
+        self.app = app
+        self.mail_state = mail_state
+        self.poll_interval = app.config.get("MAIL_OUTBOX_POLL_INTERVAL", 10)
+        self.woken = threading.Event()
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def wake(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.stopping.clear()
+                self.thread = threading.Thread(target=self._run, name="mail-sender", daemon=True)
+                self.thread.start()
+        self.woken.set()
+
+    def stop(self):
+        self.stopping.set()
+        self.woken.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        while not self.stopping.is_set():
+            self.woken.wait(self.poll_interval)
+            self.woken.clear()
+            if self.stopping.is_set():
+                return
+            with self.app.app_context():
+                try:
+                    send_all_pending(mail_state=self.mail_state)
+                except Exception as e:
+                    print("Mail sender error", str(e))
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+
+def get_mail_sender(app):
+    if getattr(app, "mail_sender", None) is None:
+        app.mail_sender = MailSender(app)
+    return app.mail_sender
+
+
+def wake_mail_sender():
+    """ tell the sender thread of the process that mails have been committed to the outbox,
+    when the outbox is not sent by a separate worker """
+    app = current_app._get_current_object()
+    if app.config.get("MAIL_OUTBOX_SENDER") == 'thread':
+        get_mail_sender(app).wake()
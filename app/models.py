@@ -2,12 +2,15 @@ import datetime
 
 from bs4 import BeautifulSoup
 from flask import current_app, url_for
-from sqlalchemy import ForeignKeyConstraint, desc
+from sqlalchemy import ForeignKeyConstraint, desc, event
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import validates
 from sqlalchemy.sql import case
 
 from app import db
+from app.plain_text import html_to_plain_text, encode_offsets, decode_offsets
+from app.utils import content_hash
 
 association_document_has_acte_type = db.Table('document_has_acte_type',
                                               db.Column('doc_id', db.Integer, db.ForeignKey('document.id'),
@@ -47,7 +50,9 @@ association_document_from_district = db.Table('document_from_district',
                                               )
 association_user_has_role = db.Table('user_has_role',
                                      db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
-                                     db.Column('role_id', db.Integer, db.ForeignKey('role.id'), primary_key=True)
+                                     db.Column('role_id', db.Integer, db.ForeignKey('role.id'), primary_key=True),
+                                     # the users of a role
+                                     db.Index('ix_user_has_role_role_id', 'role_id', 'user_id')
                                      )
 association_document_linked_to_document = db.Table('document_linked_to_document',
                                                    db.Column('doc_id', db.Integer, db.ForeignKey('document.id'),
@@ -125,6 +130,7 @@ class AlignmentImage(db.Model):
             name="fk_alignment_image",
             ondelete='CASCADE'
         ),
+        db.Index('ix_alignment_image_ptr', 'transcription_id', 'user_id', 'ptr_transcription_start'),
     )
 
     def serialize(self):
@@ -148,6 +154,11 @@ class AlignmentTranslation(db.Model):
     ptr_translation_start = db.Column(db.Integer, primary_key=True)
     ptr_translation_end = db.Column(db.Integer, primary_key=True)
 
+    __table_args__ = (
+        db.Index('ix_alignment_translation_transcription_ptr', 'transcription_id', 'ptr_transcription_start'),
+        db.Index('ix_alignment_translation_translation_ptr', 'translation_id', 'ptr_translation_start'),
+    )
+
     transcription = db.relationship("Transcription")
     translation = db.relationship("Translation")
 
@@ -162,6 +173,21 @@ class AlignmentTranslation(db.Model):
         }
 
 
+class AlignmentViewCache(db.Model):
+    """
+    Segments of the reference transcription and translation of a document, paired for the reading view.
+    The pairs are valid as long as the hashes of both reference contents are unchanged.
+    alignments is the json text of the pairs, served as is.
+    """
+    doc_id = db.Column(db.Integer, db.ForeignKey('document.id', ondelete='CASCADE'), primary_key=True)
+    transcription_hash = db.Column(db.String, nullable=False)
+    translation_hash = db.Column(db.String, nullable=False)
+    etag = db.Column(db.String, nullable=False)
+    nb_alignments = db.Column(db.Integer, nullable=False)
+    alignments = db.Column(db.Text, nullable=False)
+    date_update = db.Column(db.String())
+
+
 class Country(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     ref = db.Column(db.String)
@@ -178,6 +204,28 @@ class Country(db.Model):
         }
 
 
+class PlainTextMixin(object):
+    """ Maintains the plain text of the content, its offset map (see app.plain_text) and its hash """
+    plain_text = db.Column(db.Text)
+    plain_text_offsets = db.Column(db.Text)
+    content_hash = db.Column(db.String(40))
+
+    @validates('content')
+    def update_plain_text(self, key, content):
+        self.set_plain_text(content)
+        self.content_hash = content_hash(content)
+        return content
+
+    def set_plain_text(self, content):
+        plain_text, runs = html_to_plain_text(content)
+        self.plain_text = plain_text
+        self.plain_text_offsets = encode_offsets(runs)
+
+    @property
+    def plain_text_runs(self):
+        return decode_offsets(self.plain_text_offsets)
+
+
 class CommentaryType(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     label = db.Column(db.String)
@@ -189,7 +237,7 @@ class CommentaryType(db.Model):
         }
 
 
-class Commentary(db.Model):
+class Commentary(PlainTextMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     doc_id = db.Column(db.Integer, db.ForeignKey('document.id', ondelete='CASCADE'))
     type_id = db.Column(db.Integer, db.ForeignKey('commentary_type.id', ondelete='CASCADE'), nullable=False)
@@ -214,6 +262,7 @@ class Commentary(db.Model):
             'user_id': self.user_id,
             'type': self.type.serialize(),
             'content': self.content,
+            'content_hash': content_hash(self.content),
             'notes': self.notes_of_user(self.user_id)
         }
 
@@ -224,6 +273,46 @@ class CommentaryHasNote(db.Model):
     ptr_start = db.Column(db.Integer, primary_key=True)
     ptr_end = db.Column(db.Integer, primary_key=True)
 
+    __table_args__ = (db.Index('ix_commentary_has_note_ptr', 'commentary_id', 'ptr_start'),)
+
+
+class ContentRevision(db.Model):
+    """ One saved version of a transcription or a translation content.
+
+    Revisions are identified by (kind, doc_id, user_id, revision) so that the history survives
+    the deletion and re-creation of the container. A revision either holds the full
+    content (snapshot) or a delta against the previous revision (see app.api.revisions.revision_store).
+    """
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'doc_id', 'user_id', 'revision', name='uix_content_revision'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String, nullable=False)
+    doc_id = db.Column(db.Integer, db.ForeignKey('document.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    author_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'))
+    revision = db.Column(db.Integer, nullable=False)
+    is_snapshot = db.Column(db.Boolean(), nullable=False, default=False)
+    data = db.Column(db.Text, nullable=False)
+    content_hash = db.Column(db.String, nullable=False)
+    content_length = db.Column(db.Integer, nullable=False)
+    date_insert = db.Column(db.String())
+
+    def serialize(self):
+        return {
+            'kind': self.kind,
+            'doc_id': self.doc_id,
+            'user_id': self.user_id,
+            'author_id': self.author_id,
+            'revision': self.revision,
+            'is_snapshot': self.is_snapshot,
+            'content_hash': self.content_hash,
+            'content_length': self.content_length,
+            'stored_length': len(self.data),
+            'date_insert': self.date_insert
+        }
+
 
 class District(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -684,6 +773,21 @@ class Role(db.Model):
         }
 
 
+class SpeechPartStat(db.Model):
+    """
+    Number and plain text length of the speech parts of each type, per document and user.
+    Derived from the speech parts content and from the speech part alignments of the user,
+    and refreshed when they are written (see app.api.speech_parts.speech_part_stats).
+    """
+    doc_id = db.Column(db.Integer, db.ForeignKey('document.id', ondelete='CASCADE'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    speech_part_type_id = db.Column(db.Integer, db.ForeignKey('speech_part_type.id', ondelete='CASCADE'),
+                                    primary_key=True)
+    nb = db.Column(db.Integer, nullable=False, default=0)
+    length = db.Column(db.Integer, nullable=False, default=0)
+    max_length = db.Column(db.Integer, nullable=False, default=0)
+
+
 class SpeechPartType(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     lang_code = db.Column(db.String, db.ForeignKey("language.code", ondelete="CASCADE"))
@@ -720,8 +824,10 @@ class TranscriptionHasNote(db.Model):
     ptr_start = db.Column(db.Integer, primary_key=True)
     ptr_end = db.Column(db.Integer, primary_key=True)
 
+    __table_args__ = (db.Index('ix_transcription_has_note_ptr', 'transcription_id', 'ptr_start'),)
+
 
-class Transcription(db.Model):
+class Transcription(PlainTextMixin, db.Model):
     __table_args__ = (
         db.UniqueConstraint('doc_id', 'user_id', name='uix_user', ),
     )
@@ -746,11 +852,12 @@ class Transcription(db.Model):
             'doc_id': self.doc_id,
             'user_id': self.user_id,
             'content': self.content,
+            'content_hash': content_hash(self.content),
             'notes': self.notes_of_user(user_id)
         }
 
 
-class SpeechParts(db.Model):
+class SpeechParts(PlainTextMixin, db.Model):
     __table_args__ = (
         db.UniqueConstraint('doc_id', 'user_id', name='uix_user', ),
     )
@@ -775,8 +882,10 @@ class TranslationHasNote(db.Model):
     ptr_start = db.Column(db.Integer, primary_key=True)
     ptr_end = db.Column(db.Integer, primary_key=True)
 
+    __table_args__ = (db.Index('ix_translation_has_note_ptr', 'translation_id', 'ptr_start'),)
 
-class Translation(db.Model):
+
+class Translation(PlainTextMixin, db.Model):
     __table_args__ = (
         db.UniqueConstraint('doc_id', 'user_id', name='uix_user'),
     )
@@ -801,6 +910,7 @@ class Translation(db.Model):
             'doc_id': self.doc_id,
             'user_id': self.user_id,
             'content': self.content,
+            'content_hash': content_hash(self.content),
             'notes': self.notes_of_user(user_id)
         }
 
@@ -854,6 +964,10 @@ class AnonymousUser(object):
     def documents_i_can_edit(self):
         return []
 
+    @property
+    def role_names(self):
+        return frozenset()
+
     @property
     def is_teacher(self):
         return False
@@ -867,6 +981,31 @@ class AnonymousUser(object):
         return False
 
 
+class TokenUser(object):
+    """ the user of a request, as told by the claims of its access token """
+
+    def __init__(self, id, email, roles):
+        self.id = id
+        self.email = email
+        self.role_names = frozenset(roles)
+
+    @property
+    def is_anonymous(self):
+        return False
+
+    @property
+    def is_teacher(self):
+        return "teacher" in self.role_names
+
+    @property
+    def is_admin(self):
+        return "admin" in self.role_names
+
+    @property
+    def is_student(self):
+        return "student" in self.role_names
+
+
 # Define the User data model
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -884,6 +1023,14 @@ class User(db.Model):
     first_name = db.Column('firstname', db.String(), nullable=False, server_default='')
     last_name = db.Column('lastname', db.String(), nullable=False, server_default='')
 
+    # the users are searched by the case insensitive prefix of these columns
+    __table_args__ = (
+        db.Index('ix_user_username_nocase', username.collate('NOCASE')),
+        db.Index('ix_user_email_nocase', email.collate('NOCASE')),
+        db.Index('ix_user_firstname_nocase', first_name.collate('NOCASE')),
+        db.Index('ix_user_lastname_nocase', last_name.collate('NOCASE')),
+    )
+
     # Relationships
     roles = db.relationship('Role', secondary=association_user_has_role,
                             backref=db.backref('users', lazy='dynamic'))
@@ -893,28 +1040,37 @@ class User(db.Model):
     #    self.roles.append(Role.query.filter(Role.name == 'student').first())
     #    db.session.commit()
 
+    # names of the roles, computed once per loaded user (see role_names)
+    _role_names = None
+
     @property
     def is_anonymous(self):
         return False
 
+    @property
+    def role_names(self):
+        if self._role_names is None:
+            self._role_names = frozenset(r.name for r in self.roles)
+        return self._role_names
+
     @property
     def is_teacher(self):
-        return "teacher" in [r.name for r in self.roles]
+        return "teacher" in self.role_names
 
     @property
     def is_admin(self):
-        return "admin" in [r.name for r in self.roles]
+        return "admin" in self.role_names
 
     @property
     def is_student(self):
-        return "student" in [r.name for r in self.roles]
+        return "student" in self.role_names
 
     def serialize(self):
         return {
             'id': self.id,
             'username': self.username,
             'email': self.email,
-            'email_confirmed_at': str(self.email_confirmed_at).split('.')[0],
+            'email_confirmed_at': self.email_confirmed_at,
             'active': self.active,
             'first_name': self.first_name,
             'last_name': self.last_name,
@@ -923,33 +1079,26 @@ class User(db.Model):
 
     @property
     def documents_i_can_edit(self):
-        if self.is_anonymous:
-            return []
-
-        all_docs = Document.query.all()
-        docs = []
-        if self.is_admin or self.is_teacher:
-            docs = all_docs
-        else:
-            for doc in all_docs:
-                if doc.user_id == self.id or (doc.whitelist and self in doc.whitelist.users):
-                    if self.is_teacher:
-                        docs.append(doc)
-                    elif not doc.is_closed:
-                        docs.append(doc)
-        return docs
+        from app.document_access import editable_documents_query
+        return editable_documents_query(self).all()
 
     @property
     def documents_from_my_whitelists(self):
-        if self.is_anonymous:
-            return []
+        from app.document_access import whitelisted_documents_query
+        return whitelisted_documents_query(self).all()
+
+
+class UserTokenVersion(db.Model):
+    """ version of the tokens of a user (see app/token_versions.py).
+    There is no foreign key: the version outlives the deleted users """
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    version = db.Column(db.Integer, nullable=False, server_default='0')
 
-        docs = []
-        for doc in Document.query.all():
-            if doc.whitelist:
-                if self in doc.whitelist.users:
-                    docs.append(doc)
-        return docs
+
+@event.listens_for(User.roles, 'append')
+@event.listens_for(User.roles, 'remove')
+def forget_role_names(user, role, initiator):
+    user._role_names = None
 
 
 class Whitelist(db.Model):
@@ -966,6 +1115,39 @@ class Whitelist(db.Model):
         }
 
 
+class DocumentAccess(db.Model):
+    """ documents a user can edit as their owner or as a member of their whitelist
+    (see app/document_access.py) """
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    doc_id = db.Column(db.Integer, db.ForeignKey('document.id', ondelete='CASCADE'), primary_key=True)
+    is_owner = db.Column(db.Boolean, nullable=False, server_default='0')
+    from_whitelist = db.Column(db.Boolean, nullable=False, server_default='0')
+    date_closing = db.Column(db.String())
+
+
+class MailOutbox(db.Model):
+    """ outbound mails waiting to be sent (see app/mail_outbox.py) """
+    __tablename__ = 'mail_outbox'
+    __table_args__ = (db.Index('ix_mail_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),)
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    sender = db.Column(db.String(), nullable=False)
+    # json list of addresses
+    recipients = db.Column(db.Text, nullable=False)
+    subject = db.Column(db.String(), nullable=False, server_default='')
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now)
+    # 'pending', 'sent' or 'failed'
+    status = db.Column(db.String(), nullable=False, server_default='pending')
+    attempts = db.Column(db.Integer, nullable=False, server_default='0')
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now)
+    last_error = db.Column(db.Text)
+    sent_at = db.Column(db.DateTime)
+    claimed_by = db.Column(db.String())
+    claimed_at = db.Column(db.DateTime)
+
+
 class AlignmentDiscours(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     transcription_id = db.Column(db.Integer, db.ForeignKey('transcription.id', ondelete='CASCADE'))
@@ -975,6 +1157,8 @@ class AlignmentDiscours(db.Model):
     ptr_end = db.Column(db.Integer)
     note = db.Column(db.Text)
 
+    __table_args__ = (db.Index('ix_alignment_discours_ptr', 'transcription_id', 'user_id', 'ptr_start'),)
+
     transcription = db.relationship("Transcription")
     speech_part_type = db.relationship("SpeechPartType")
     user = db.relationship("User")
@@ -0,0 +1,155 @@
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from flask import current_app
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+"""
+========================================================
+    Password hashing
+========================================================
+
+The passwords are hashed and checked by a bounded pool of PASSWORD_HASH_WORKERS threads
+per process rather than on the thread of the request: pbkdf2 runs in hashlib without the GIL,
+so the other requests of the process keep running while a login waits for its hash, and
+no more than PASSWORD_HASH_WORKERS CPUs of a process are spent hashing.
+
+At most PASSWORD_HASH_QUEUE_SIZE hashes wait for a worker: beyond that, or when a hash waits
+more than PASSWORD_HASH_TIMEOUT seconds, PasswordHasherBusy is raised and the request answers 503.
+
+The passwords are hashed with PASSWORD_HASH_METHOD (werkzeug's format, e.g. pbkdf2:sha256:260000).
+A password whose hash was made with another method is hashed again when its user logs in.
+"""
+
+# latencies kept for the percentiles of the metrics
+LATENCY_WINDOW = 1000
+
+
+class PasswordHasherBusy(Exception):
+
+    def __init__(self, retry_after=1):
+        super().__init__("Too many passwords waiting to be hashed")
+        self.retry_after = retry_after
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class PasswordHasher(object):
+
+    def __init__(self, workers=2, queue_size=32, timeout=10):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hasher")
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.waits = collections.deque(maxlen=LATENCY_WINDOW)
+        self.durations = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def run(self, func, *args):
+        """ run func(*args) on a worker and wait for its result """
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            raise PasswordHasherBusy()
+        submitted = time.monotonic()
+        with self.lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+
+        def task():
+            started = time.monotonic()
+            with self.lock:
+                self.queued -= 1
+                self.running += 1
+                self.waits.append(started - submitted)
+            try:
+                return func(*args)
+            finally:
+                with self.lock:
+                    self.running -= 1
+                    self.completed += 1
+                    self.durations.append(time.monotonic() - started)
+
+        future = self.executor.submit(task)
+        future.add_done_callback(lambda f: self.slots.release())
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            with self.lock:
+                self.timed_out += 1
+            raise PasswordHasherBusy(retry_after=int(self.timeout))
+
+    def metrics(self):
+        with self.lock:
+            waits, durations = list(self.waits), list(self.durations)
+            metrics = {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "queue_depth": self.queued,
+                "max_queue_depth": self.max_queued,
+                "running": self.running,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+            }
+        for name, values in (("wait", waits), ("hash", durations)):
+            for percent in (50, 95):
+                value = _percentile(values, percent)
+                metrics["%s_ms_p%s" % (name, percent)] = None if value is None else round(value * 1000, 2)
+            metrics["%s_ms_max" % name] = round(max(values) * 1000, 2) if values else None
+        return metrics
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+def get_password_hasher(app=None):
+    app = app or current_app._get_current_object()
+    if getattr(app, "password_hasher", None) is None:
+        app.password_hasher = PasswordHasher(workers=app.config.get("PASSWORD_HASH_WORKERS", 2),
+                                             queue_size=app.config.get("PASSWORD_HASH_QUEUE_SIZE", 32),
+                                             timeout=app.config.get("PASSWORD_HASH_TIMEOUT", 10))
+    return app.password_hasher
+
+
+def _hash_method():
+    return current_app.config.get("PASSWORD_HASH_METHOD", "pbkdf2:sha256")
+
+
+def _normalized_method(method):
+    parts = method.split(":")
+    if parts[0] == "pbkdf2":
+        if len(parts) < 2:
+            parts.append("sha256")
+        if len(parts) < 3:
+            parts.append(str(DEFAULT_PBKDF2_ITERATIONS))
+    return ":".join(parts)
+
+
+def hash_password(password):
+    return get_password_hasher().run(generate_password_hash, password, _hash_method())
+
+
+def check_password(pw_hash, password):
+    if not pw_hash or password is None:
+        return False
+    return get_password_hasher().run(check_password_hash, pw_hash, password)
+
+
+def needs_rehash(pw_hash):
+    """ True when the hash was not made with PASSWORD_HASH_METHOD """
+    return _normalized_method(pw_hash.split("$", 1)[0]) != _normalized_method(_hash_method())
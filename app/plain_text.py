@@ -0,0 +1,202 @@
+import json
+import re
+from bisect import bisect_right, bisect_left
+from html import unescape
+
+from sqlalchemy import bindparam, inspect, or_, select, text
+
+from app.utils import content_hash
+
+"""
+========================================================
+    Plain text derived from the HTML contents
+========================================================
+
+The plain text of a content is its text with the tags removed and the entities decoded.
+The end of a block element (</p>, </div>, <br>...) is rendered as a newline.
+
+The offset map links the positions of the plain text to the positions of the HTML content.
+It is a list of runs (text_start, html_start, text_end, html_end):
+    - a run whose text and html lengths are equal is linear: text_start + i <-> html_start + i
+    - any other run (an entity, a block end) maps as a whole to its html span
+Stored as a flat JSON list: [text_start, html_start, text_end, html_end, text_start, ...]
+"""
+
+TOKEN_REGEX = re.compile(r'<!--.*?-->|<[^>]*>|&(?:#[0-9]+|#[xX][0-9a-fA-F]+|[A-Za-z][A-Za-z0-9]*);', re.S)
+BLOCK_END_REGEX = re.compile(r'</\s*(?:p|div|li|h[1-6]|blockquote|tr)\s*>|<\s*br\s*/?\s*>', re.I)
+
+
+def html_to_plain_text(html):
+    """ strip the tags of an HTML content
+
+    :param html: the content
+    :return: (plain text, runs)
+    """
+    if not html:
+        return "", []
+
+    parts = []
+    runs = []
+    text_len = 0
+
+    def add(text, html_start, html_end):
+        nonlocal text_len
+        if not text:
+            return
+        t_end = text_len + len(text)
+        if runs:
+            t_s, h_s, t_e, h_e = runs[-1]
+            # merge the linear runs which follow each other
+            if t_e == text_len and h_e == html_start and t_e - t_s == h_e - h_s \
+                    and t_end - text_len == html_end - html_start:
+                runs[-1] = (t_s, h_s, t_end, html_end)
+                parts.append(text)
+                text_len = t_end
+                return
+        runs.append((text_len, html_start, t_end, html_end))
+        parts.append(text)
+        text_len = t_end
+
+    pos = 0
+    for m in TOKEN_REGEX.finditer(html):
+        start, end = m.span()
+        if start > pos:
+            add(html[pos:start], pos, start)
+        token = m.group(0)
+        if token[0] == '&':
+            add(unescape(token), start, end)
+        elif BLOCK_END_REGEX.match(token):
+            add("\n", start, end)
+        pos = end
+    if pos < len(html):
+        add(html[pos:], pos, len(html))
+
+    return "".join(parts), runs
+
+
+def encode_offsets(runs):
+    return json.dumps([value for run in runs for value in run], separators=(',', ':'))
+
+
+def decode_offsets(data):
+    if not data:
+        return []
+    values = json.loads(data)
+    return [tuple(values[i:i + 4]) for i in range(0, len(values), 4)]
+
+
+def text_to_html(runs, pos, end=False):
+    """ map a position of the plain text to a position of the HTML content
+
+    :param runs: the offset map
+    :param pos: position in the plain text
+    :param end: True when pos ends a range: the position is then mapped before the following tags
+    :return: position in the HTML content
+    """
+    if not runs:
+        return pos
+    if end:
+        return map_text_end(runs, [run[2] for run in runs], pos)
+    return map_text_start(runs, [run[0] for run in runs], pos)
+
+
+def map_text_start(runs, text_starts, pos):
+    """ text_to_html() for a range start, text_starts being the text starts of the runs """
+    i = bisect_right(text_starts, pos) - 1
+    if i < 0:
+        return runs[0][1]
+    t_s, h_s, t_e, h_e = runs[i]
+    if pos >= t_e:
+        return h_e
+    if t_e - t_s == h_e - h_s:
+        return h_s + pos - t_s
+    return h_s
+
+
+def map_text_end(runs, text_ends, pos):
+    """ text_to_html() for a range end, text_ends being the text ends of the runs """
+    i = bisect_left(text_ends, pos)
+    if i == len(runs):
+        return runs[-1][3]
+    t_s, h_s, t_e, h_e = runs[i]
+    if pos <= t_s:
+        return h_s
+    if t_e - t_s == h_e - h_s:
+        return h_s + pos - t_s
+    return h_e
+
+
+def html_to_text(runs, pos):
+    """ map a position of the HTML content to a position of the plain text;
+    a position inside a tag is mapped to the next text position
+
+    :param runs: the offset map
+    :param pos: position in the HTML content
+    :return: position in the plain text
+    """
+    if not runs:
+        return pos
+    return map_html_pos(runs, [run[1] for run in runs], pos)
+
+
+def map_html_pos(runs, html_starts, pos):
+    """ html_to_text(), html_starts being the html starts of the runs """
+    i = bisect_right(html_starts, pos) - 1
+    if i < 0:
+        return 0
+    t_s, h_s, t_e, h_e = runs[i]
+    if pos >= h_e:
+        return t_e
+    if t_e - t_s == h_e - h_s:
+        return t_s + pos - h_s
+    return t_s
+
+
+def add_plain_text_columns(db, models):
+    """ add the plain text columns (and the hash of the content) to the tables created before they existed """
+    inspector = inspect(db.engine)
+    added = []
+    for model in models:
+        table = model.__table__.name
+        existing = set(column["name"] for column in inspector.get_columns(table))
+        for column, column_type in (("plain_text", "TEXT"), ("plain_text_offsets", "TEXT"),
+                                    ("content_hash", "VARCHAR(40)")):
+            if column not in existing:
+                db.session.execute(text('ALTER TABLE %s ADD COLUMN %s %s' % (table, column, column_type)))
+                added.append("%s.%s" % (table, column))
+    db.session.commit()
+    return added
+
+
+def backfill_plain_text(db, models, only_missing=True, batch_size=500):
+    """ compute the plain text and the hash of the existing contents
+
+    :param db:
+    :param models: models using the PlainTextMixin
+    :param only_missing: only fill the rows without plain text
+    :param batch_size: number of rows updated at once
+    :return: number of updated rows per table
+    """
+    counts = {}
+    for model in models:
+        table = model.__table__
+        query = select(table.c.id, table.c.content)
+        if only_missing:
+            query = query.where(or_(table.c.plain_text.is_(None), table.c.content_hash.is_(None)))
+        rows = db.session.execute(query).fetchall()
+
+        update = table.update().where(table.c.id == bindparam('_id')).values(
+            plain_text=bindparam('_plain_text'),
+            plain_text_offsets=bindparam('_offsets'),
+            content_hash=bindparam('_hash')
+        )
+        for i in range(0, len(rows), batch_size):
+            params = []
+            for row_id, content in rows[i:i + batch_size]:
+                plain_text, runs = html_to_plain_text(content)
+                params.append({'_id': row_id, '_plain_text': plain_text, '_offsets': encode_offsets(runs),
+                               '_hash': content_hash(content)})
+            db.session.execute(update, params)
+            db.session.commit()
+        counts[table.name] = len(rows)
+    return counts
@@ -0,0 +1,151 @@
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from flask import current_app, request
+from flask_jwt_extended import get_jwt_claims, verify_jwt_in_request_optional
+
+from app.utils import make_429
+
+"""
+========================================================
+    Rate limits
+========================================================
+
+Each request takes a token from the buckets of its budget:
+    - login: the login and password reset routes, by account, and by IP address with the
+      login_ip budget, much larger as a whole class may log in from the same address
+    - write: the other POST, PUT, PATCH and DELETE requests
+    - read: the other GET requests
+The write and read buckets are those of the user when the request carries a valid access
+token, of the IP address otherwise. RATE_LIMITS gives (requests, seconds) for each budget:
+a bucket holds up to `requests` tokens and gets `requests` new tokens every `seconds`.
+A request finding a bucket empty answers 429, with the seconds to wait in Retry-After.
+
+The buckets are kept in a small SQLite file of their own (RATE_LIMIT_STORAGE), shared by
+the processes of the server and not by the database: the limiter never waits for the
+writer of the application. If the file cannot be used, the requests are not limited, and
+the failure is reported once.
+Behind reverse proxies, TRUSTED_PROXIES gives their number, so that request.remote_addr is
+the address of the client (read from X-Forwarded-For by werkzeug's ProxyFix).
+"""
+
+LOGIN_ENDPOINTS = ('api_bp.login', 'api_bp.send_password_reset_link', 'api_bp.reset_password')
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+# buckets untouched for this long are full again: they are dropped now and then
+BUCKET_RETENTION = 24 * 3600
+
+
+class TokenBucketStore(object):
+    """ token buckets kept in a SQLite file, which several processes can share """
+
+    def __init__(self, path, timeout=1.0):
+        self.path = path
+        self.timeout = timeout
+        self.local = threading.local()
+        # the storage failures are reported once
+        self.unavailable = False
+
+    def _connection(self):
+        # one connection per thread, and not one inherited from the parent process
+        connection = getattr(self.local, "connection", None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.execute("CREATE TABLE IF NOT EXISTS bucket "
+                               "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)")
+            self.local.connection, self.local.pid = connection, os.getpid()
+        return connection
+
+    def take(self, buckets, now=None):
+        """ take a token from each bucket, if none of them is empty
+
+        :param buckets: [(key, capacity, tokens per second), ...]
+        :return: 0 if the tokens were taken, otherwise the seconds to wait for them
+        """
+        now = time.time() if now is None else now
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            levels = []
+            wait = 0
+            for key, capacity, rate in buckets:
+                row = connection.execute("SELECT tokens, updated_at FROM bucket WHERE key = ?", (key,)).fetchone()
+                tokens = capacity if row is None else min(capacity, row[0] + max(0, now - row[1]) * rate)
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / rate)
+                levels.append((key, tokens))
+            if not wait:
+                connection.executemany("INSERT OR REPLACE INTO bucket (key, tokens, updated_at) VALUES (?, ?, ?)",
+                                       [(key, tokens - 1, now) for key, tokens in levels])
+            if random.random() < 0.001:
+                connection.execute("DELETE FROM bucket WHERE updated_at < ?", (now - BUCKET_RETENTION,))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return wait
+
+    def clear(self):
+        self._connection().execute("DELETE FROM bucket")
+
+
+def get_rate_limit_store(app):
+    if getattr(app, "rate_limit_store", None) is None:
+        app.rate_limit_store = TokenBucketStore(app.config["RATE_LIMIT_STORAGE"])
+    return app.rate_limit_store
+
+
+def _request_user_id():
+    try:
+        verify_jwt_in_request_optional()
+        return (get_jwt_claims() or {}).get("user_id")
+    except Exception:
+        # an invalid token is refused by the route itself
+        return None
+
+
+def _bucket(budget, key):
+    requests, seconds = current_app.config["RATE_LIMITS"][budget]
+    return "%s:%s" % (budget, key), requests, requests / float(seconds)
+
+
+def request_buckets():
+    """ (budget, [(key, capacity, tokens per second), ...]) of the current request """
+    if request.endpoint in LOGIN_ENDPOINTS:
+        budget = 'login'
+        buckets = [_bucket('login_ip', 'ip:%s' % request.remote_addr)]
+        json = request.get_json(force=True, silent=True)
+        if isinstance(json, dict) and isinstance(json.get('email'), str):
+            buckets.append(_bucket('login', 'account:%s' % json['email'].strip().lower()))
+    else:
+        budget = 'write' if request.method in WRITE_METHODS else 'read'
+        user_id = _request_user_id()
+        buckets = [_bucket(budget, 'user:%s' % user_id if user_id is not None else 'ip:%s' % request.remote_addr)]
+    return budget, buckets
+
+
+def check_rate_limits():
+    """ before_request: answers 429 when a bucket of the request is empty """
+    app = current_app._get_current_object()
+    if not app.config.get("RATE_LIMIT_ENABLED") or request.method not in WRITE_METHODS + ('GET',) \
+            or request.endpoint is None:
+        return None
+    budget, buckets = request_buckets()
+    store = get_rate_limit_store(app)
+    try:
+        wait = store.take(buckets)
+    except sqlite3.Error as e:
+        if not store.unavailable:
+            store.unavailable = True
+            print("Rate limits unavailable, the requests are not limited:", str(e))
+        return None
+    store.unavailable = False
+    if wait:
+        print("Rate limit exceeded", budget, [key for key, capacity, rate in buckets])
+        return make_429("Too many requests, try again later", retry_after=int(math.ceil(wait)))
+    return None
@@ -0,0 +1,59 @@
+import time
+
+from flask import current_app
+from sqlalchemy import select
+
+from app import db
+from app.models import UserTokenVersion
+
+"""
+========================================================
+    Token versions
+========================================================
+
+The access tokens carry the id, the roles and the token version of their user, so that
+the read-only requests can be authorized without loading the user (see get_current_identity).
+The version of a user is bumped when its roles change or when it is deleted: the claims
+of the tokens issued before are no longer trusted and the user is loaded again.
+
+The versions are kept in memory by each process and read again from the database
+after JWT_TOKEN_VERSION_CACHE_TTL seconds, so that a bump made by another process is seen
+within that delay.
+"""
+
+# user id: (version, time it was read)
+_versions = {}
+
+
+def get_token_version(user_id):
+    user_id = int(user_id)
+    cached = _versions.get(user_id)
+    if cached is not None and time.monotonic() - cached[1] < current_app.config["JWT_TOKEN_VERSION_CACHE_TTL"]:
+        return cached[0]
+    version = db.session.execute(
+        select(UserTokenVersion.version).where(UserTokenVersion.user_id == user_id)
+    ).scalar() or 0
+    _versions[user_id] = (version, time.monotonic())
+    return version
+
+
+def bump_token_version(user_id):
+    """ forget the claims of the tokens issued to a user.
+    The caller is responsible for committing the session.
+
+    :return: the new version
+    """
+    user_id = int(user_id)
+    table = UserTokenVersion.__table__
+    updated = db.session.execute(
+        table.update().where(table.c.user_id == user_id).values(version=table.c.version + 1)
+    ).rowcount
+    if not updated:
+        db.session.execute(table.insert().values(user_id=user_id, version=1))
+    version = db.session.execute(select(table.c.version).where(table.c.user_id == user_id)).scalar()
+    _versions[user_id] = (version, time.monotonic())
+    return version
+
+
+def forget_token_versions():
+    _versions.clear()
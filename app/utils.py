@@ -1,25 +1,96 @@
+import hashlib
+import time
 from functools import wraps
 
-from flask import current_app
+from flask import current_app, g, has_app_context, has_request_context, request
 
 """
 ========================================================
     A bunch of useful functions
 ========================================================
 """
+
+# requests whose permission checks can trust the claims of the access token
+READ_ONLY_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
 def check_no_XMLParserError(content):
     if content is not None and "parsererror" in content:
         print("PARSER_ERROR", content)
         return make_400(details='Parser Error: %s' % content)
 
+def content_hash(content):
+    """ Hash identifying a version of a content (transcription, translation, commentary...)
+    """
+    return hashlib.sha1((content or "").encode("utf-8")).hexdigest()
+
+
 def get_user_from_username(username):
     from app import models
     return models.User.query.filter(models.User.username == username).first()
 
 
 def get_current_user():
+    """ the user of the request, loaded with its roles in a single query
+    and kept in flask.g until the end of the request """
+    if has_app_context() and "current_user" in g:
+        return g.current_user
+    user = _load_current_user()
+    if has_app_context():
+        g.current_user = user
+    return user
+
+
+def get_current_identity():
+    """ the user of a request, for the permission checks which only need its id and its roles.
+    The read-only requests trust the claims of a recent access token (JWT_ROLE_CLAIMS_TTL)
+    whose token version is still the one of the user: the user is not loaded.
+    Otherwise, or for the other requests, it is the current user """
+    if has_app_context() and "current_identity" in g:
+        return g.current_identity
+    identity = None
+    if has_request_context() and request.method in READ_ONLY_METHODS \
+            and current_app.config.get("JWT_ROLE_CLAIMS_TTL"):
+        identity = _identity_from_claims()
+    if identity is None:
+        identity = get_current_user()
+    if has_app_context():
+        g.current_identity = identity
+    return identity
+
+
+def forget_current_user(exception=None):
+    """ forget the user of the request and what was memoized about it """
+    g.pop("current_user", None)
+    g.pop("current_identity", None)
+    g.pop("whitelist_members", None)
+
+
+def _identity_from_claims():
+    from app.models import TokenUser
+    from app.token_versions import get_token_version
+    from flask_jwt_extended import get_jwt_claims, get_jwt_identity, get_raw_jwt, verify_jwt_in_request_optional
+
+    try:
+        verify_jwt_in_request_optional()
+    except Exception:
+        return None
+    claims = get_jwt_claims()
+    issued_at = get_raw_jwt().get("iat")
+    if not isinstance(claims, dict) or issued_at is None or \
+            not all(claims.get(key) is not None for key in ("user_id", "roles", "ver")):
+        return None
+    if time.time() - issued_at > current_app.config["JWT_ROLE_CLAIMS_TTL"]:
+        return None
+    if claims["ver"] != get_token_version(claims["user_id"]):
+        return None
+    return TokenUser(claims["user_id"], get_jwt_identity(), claims["roles"])
+
+
+def _load_current_user():
     from app.models import AnonymousUser, User
     from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request_optional
+    from sqlalchemy.orm import joinedload
 
     try:
         verify_jwt_in_request_optional()
@@ -31,7 +102,7 @@ def get_current_user():
     if identity is None:
         user = AnonymousUser()
     else:
-        user = User.query.filter(User.email == identity).first()
+        user = User.query.options(joinedload(User.roles)).filter(User.email == identity).first()
         if user is None:
             user = AnonymousUser()
 
@@ -71,6 +142,20 @@ def make_409(details=None):
     return make_error(409, "Conflict with the current state of the target resource", details)
 
 
+def make_429(details=None, retry_after=None):
+    response = make_error(429, "Too many requests", details)
+    if retry_after is not None:
+        response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+def make_503(details=None, retry_after=None):
+    response = make_error(503, "Service unavailable", details)
+    if retry_after is not None:
+        response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
 def make_200(data=None):
     if data is None:
         data = []
@@ -83,17 +168,33 @@ def make_204():
 def make_201(data):
     return make_success(data, status=201)
 
+def is_whitelist_member(whitelist_id, user_id):
+    """ tells whether a user belongs to a whitelist, with an EXISTS on the primary key of whitelist_has_user.
+    The answers are kept in flask.g until the end of the request """
+    from app import db
+    from app.models import association_whitelist_has_user as wl
+    from sqlalchemy import and_, exists, select
+
+    key = (int(whitelist_id), int(user_id))
+    memo = g.setdefault("whitelist_members", {}) if has_app_context() else {}
+    if key not in memo:
+        memo[key] = db.session.execute(select(exists().where(and_(
+            wl.c.whitelist_id == key[0], wl.c.user_id == key[1])))).scalar()
+    return memo[key]
+
+
 def forbid_if_not_in_whitelist(app, doc):
-    user = app.get_current_user()
-    if doc.whitelist is not None:
-        if doc.user_id == user.id or user in doc.whitelist.users or user.is_admin:
+    user = get_current_identity()
+    if doc.whitelist_id is not None:
+        if not user.is_anonymous and (doc.user_id == user.id or user.is_admin
+                                      or is_whitelist_member(doc.whitelist_id, user.id)):
             return None
         else:
             return make_403(details="Your are not allowed to modify this document")
 
 
 def forbid_if_nor_teacher_nor_admin_and_wants_user_data(app, wanted_user_id):
-    user = app.get_current_user()
+    user = get_current_identity()
     # if anonymous or mere student wants to read data of another student
     if user.is_anonymous or not (user.is_teacher or user.is_admin) and wanted_user_id is not None and int(wanted_user_id) != int(user.id):
         msg = "You must be a teacher or an admin"
@@ -103,7 +204,7 @@ def forbid_if_nor_teacher_nor_admin_and_wants_user_data(app, wanted_user_id):
 
 
 def forbid_if_other_user(app, wanted_user_id):
-    user = app.get_current_user()
+    user = get_current_identity()
     # if anonymous or mere student wants to read data of another student
     if user.is_anonymous or wanted_user_id is not None and int(wanted_user_id) != int(user.id):
         return make_403(details="Wrong user")
@@ -114,7 +215,7 @@ def forbid_if_other_user(app, wanted_user_id):
 def forbid_if_nor_teacher_nor_admin(view_function):
     @wraps(view_function)
     def wrapped_f(*args, **kwargs):
-        user = current_app.get_current_user()
+        user = get_current_identity()
         if user.is_anonymous or not (user.is_teacher or user.is_admin):
             msg = "This resource is only available to teachers and admins"
             print(msg)
@@ -126,7 +227,7 @@ def forbid_if_nor_teacher_nor_admin(view_function):
 def forbid_if_not_admin(view_function):
     @wraps(view_function)
     def wrapped_f(*args, **kwargs):
-        user = current_app.get_current_user()
+        user = get_current_identity()
         if user.is_anonymous or not user.is_admin:
             msg = "This resource is only available to teachers and admins"
             print(msg)
@@ -20,6 +20,21 @@ class Config(object):
     DOC_PER_PAGE = 20
     USERS_PER_PAGE = 10
 
+    # Content revisions: a full snapshot is stored every N revisions, deltas in between
+    REVISION_SNAPSHOT_INTERVAL = 20
+    # default retention used by the revisions-compact command
+    REVISION_KEEP_LAST = 100
+
+    # Autosave coalescing (see app/api/autosave.py): PUT ?autosave=1 is buffered in memory
+    # and written after AUTOSAVE_QUIET_PERIOD seconds without a newer autosave
+    AUTOSAVE_COALESCING = False
+    AUTOSAVE_QUIET_PERIOD = 5
+
+    # JSON responses: encoded by orjson when it is installed ('auto'), or by 'orjson' or 'json',
+    # compact unless JSON_INDENT is set
+    JSON_ENCODER = 'auto'
+    JSON_INDENT = None
+
     CSRF_ENABLED = True
 
     # Flask-Mail settings
@@ -29,11 +44,53 @@ class Config(object):
     MAIL_USE_SSL = False
     MAIL_USERNAME = 'adele.app@chartes.psl.eu'
 
+    # Mail outbox (see app/mail_outbox.py): the mails are sent by a thread of each process ('thread')
+    # or by a separate worker ('worker': flask mail-worker)
+    MAIL_OUTBOX_SENDER = 'thread'
+    MAIL_OUTBOX_BATCH_SIZE = 50
+    MAIL_OUTBOX_MAX_ATTEMPTS = 5
+    # seconds before the first retry, doubled at each attempt
+    MAIL_OUTBOX_RETRY_DELAY = 60
+    MAIL_OUTBOX_POLL_INTERVAL = 10
+    MAIL_OUTBOX_CLAIM_LEASE = 300
+
+    # password hashing (see app/passwords.py): the passwords hashed with another method are hashed
+    # again on login. PASSWORD_HASH_WORKERS threads per process hash them, PASSWORD_HASH_QUEUE_SIZE
+    # hashes at most wait for a thread, for PASSWORD_HASH_TIMEOUT seconds at most
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:260000'
+    PASSWORD_HASH_WORKERS = 2
+    PASSWORD_HASH_QUEUE_SIZE = 32
+    PASSWORD_HASH_TIMEOUT = 10
+    # processes hashing the passwords of the invited rosters (the number of CPUs by default)
+    INVITATION_HASH_PROCESSES = None
+
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
     JWT_TOKEN_LOCATION = ['cookies', 'headers']
     JWT_COOKIE_CSRF_PROTECT = True
     JWT_COOKIE_SECURE = True
     JWT_IDENTITY_CLAIM = 'sub'
+    # the read-only requests trust the roles carried by an access token for JWT_ROLE_CLAIMS_TTL seconds
+    # after it was issued (0 to always load the user); the token versions are read again from the
+    # database every JWT_TOKEN_VERSION_CACHE_TTL seconds
+    JWT_ROLE_CLAIMS_TTL = 15 * 60
+    JWT_TOKEN_VERSION_CACHE_TTL = 30
+
+    # number of reverse proxies in front of the application: the address of the client is then read
+    # from X-Forwarded-For (werkzeug's ProxyFix). 0 when the clients connect to the application directly
+    TRUSTED_PROXIES = 0
+
+    # Rate limits (see app/rate_limits.py): (requests, seconds) of each budget, by user or IP address.
+    # The login attempts are limited by account, and by IP address with the much larger login_ip
+    # budget, as a whole class may log in from a single address.
+    # The buckets are kept in their own SQLite file, shared by the processes of the server
+    RATE_LIMIT_ENABLED = True
+    RATE_LIMIT_STORAGE = os.path.join(basedir, 'db', 'rate_limits.sqlite')
+    RATE_LIMITS = {
+        'login': (10, 60),
+        'login_ip': (300, 60),
+        'write': (120, 60),
+        'read': (600, 60),
+    }
 
     # JWT_ACCESS_TOKEN_EXPIRES = datetime.timedelta(seconds=int(os.getenv(('JWT_ACCESS_TOKEN_EXPIRES'))))
 
@@ -49,6 +106,8 @@ class DevelopmentConfig(Config):
 
     APP_URL_PREFIX = ""  # used to build correct iiif urls
 
+    JSON_INDENT = 2
+
     JWT_COOKIE_CSRF_PROTECT = False
     JWT_COOKIE_SECURE = False
 
@@ -71,6 +130,10 @@ class TestConfig(Config):
     MAIL_SERVER = 'smtp.chartes.psl.eu'
     MAIL_PORT = 465
     MAIL_USE_SSL = 1
+    # the tests send the outbox themselves
+    MAIL_OUTBOX_SENDER = None
+    RATE_LIMIT_ENABLED = False
+    RATE_LIMIT_STORAGE = os.path.join(DB_PATH, 'rate_limits.test.sqlite')
 
     LIVESERVER_TIMEOUT = 10
     LIVESERVER_PORT = 8943
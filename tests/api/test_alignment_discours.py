@@ -0,0 +1,60 @@
+from os.path import join
+
+from sqlalchemy import event
+
+from tests.base_server import TestBaseServer, json_loads, PROF1_USER, STU1_USER
+from app import db
+from app.api.alignments.alignments_discours import get_speech_part_alignments
+from app.models import AlignmentDiscours, SpeechPartStat
+
+
+class TestAlignmentDiscoursAPI(TestBaseServer):
+    FIXTURES = [
+        join(TestBaseServer.FIXTURES_PATH, "documents", "doc_21.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "transcriptions", "transcription_doc_21_prof1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "alignments_discours", "alignments_discours_doc_21_prof1.sql"),
+    ]
+
+    URL = "/api/1.0/documents/21/transcriptions/speech-parts/from-user/4"
+
+    def test_patch_speech_parts(self):
+        self.load_fixtures(TestAlignmentDiscoursAPI.FIXTURES)
+        changes = {"data": [[3, 7, 2, "adresse"], [20, 31, None], [40, 50, 3],
+                            {"ptr_start": 60, "ptr_end": 70, "speech_part_type_id": 1}]}
+        # no reference transcription yet
+        self.assert404(self.URL, method="PATCH", data=changes, **PROF1_USER)
+        self.assert200("/api/1.0/documents/21/validate-transcription", **PROF1_USER)
+        self.assert403(self.URL, method="PATCH", data=changes, **STU1_USER)
+
+        r = self.assert200(self.URL, method="PATCH", data=changes, **PROF1_USER)
+        r = json_loads(r.data)["data"]
+        self.assertEqual((1, 1, 2), (r["updated"], r["deleted"], r["inserted"]))
+        self.assertEqual([(3, 7, 2, "adresse"), (7, 19, 2, "deuxième note"), (40, 50, 3, None), (60, 70, 1, None)],
+                         [(sp["ptr_start"], sp["ptr_end"], sp["speech_part_type"]["id"], sp["note"])
+                          for sp in r["speech_parts"]])
+        self.assertEqual(r["speech_parts"], json_loads(self.assert200(self.URL, **PROF1_USER).data)["data"])
+        self.assertEqual({1: 1, 2: 2, 3: 1}, {stat.speech_part_type_id: stat.nb for stat in
+                                              SpeechPartStat.query.filter(SpeechPartStat.doc_id == 21)})
+
+        # an invalid change rejects the whole batch
+        content_length = len(db.session.execute("SELECT content FROM transcription WHERE id = 21").scalar())
+        for invalid in ([[3, 7, 99]], [[7, 3, 1]], [[0, content_length + 1, 1]], [["a", 7, 1]], [[3, 7]], {}):
+            self.assert400(self.URL, method="PATCH", data={"data": [[19, 20, 1]] + invalid
+                                                           if isinstance(invalid, list) else invalid}, **PROF1_USER)
+        self.assertEqual(4, AlignmentDiscours.query.filter(AlignmentDiscours.transcription_id == 21).count())
+        self.assert200(self.URL, method="PATCH", data={"data": [[0, content_length, 1]]}, **PROF1_USER)
+
+    def test_speech_parts_loaded_with_their_type(self):
+        self.load_fixtures(TestAlignmentDiscoursAPI.FIXTURES)
+        with self.app.app_context():
+            speech_parts = get_speech_part_alignments(21, 4)
+            statements = []
+            listener = lambda *args: statements.append(args[2])
+            event.listen(db.engine, "before_cursor_execute", listener)
+            try:
+                serialized = [sp.serialize() for sp in speech_parts]
+            finally:
+                event.remove(db.engine, "before_cursor_execute", listener)
+            self.assertEqual([], statements)
+            self.assertEqual(["adresse_universelle", "suscription", "salut"],
+                             [sp["speech_part_type"]["label"] for sp in serialized])
@@ -0,0 +1,84 @@
+import os
+from os.path import join
+
+from tests.base_server import TestBaseServer, json_loads, PROF1_USER, STU1_USER, STU2_USER
+from app import db
+from app.alignment_suggestions import split_segments, suggest_alignments
+from app.models import Transcription
+from app.plain_text import html_to_plain_text
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+
+
+def to_html(text):
+    """ one paragraph per block of lines """
+    return "".join("<p>%s</p>" % block.replace("\n", " ") for block in text.split("\n\n"))
+
+
+def suggest(src_html, tgt_html):
+    src_text, src_runs = html_to_plain_text(src_html)
+    tgt_text, tgt_runs = html_to_plain_text(tgt_html)
+    return suggest_alignments(src_text, src_runs, tgt_text, tgt_runs)
+
+
+class TestAlignmentSuggestions(TestBaseServer):
+    FIXTURES = [
+        join(TestBaseServer.FIXTURES_PATH, "documents", "doc_21.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "transcriptions", "transcription_doc_21_prof1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "translations", "translation_doc_21_stu1.sql"),
+    ]
+
+    def test_split_segments(self):
+        text = "Anno 1248. ¶ Post quem ; alia\nNova linea?  "
+        self.assertEqual(["Anno 1248.", "¶ Post quem ;", "alia", "Nova linea?"],
+                         [text[s.start:s.end] for s in split_segments(text)])
+        self.assertEqual([0, 0, 0, 1], [s.paragraph for s in split_segments(text)])
+        self.assertEqual(frozenset(["1248"]), split_segments(text)[0].numbers)
+
+    def test_suggest_alignments(self):
+        self.assertEqual([], suggest("", "<p>a.</p>"))
+
+        src = "<p>Prima <ex>pars</ex> est. Secunda pars, longior quam prima, est.</p><p>Tertia anno 1248.</p>"
+        tgt = "<p>La première partie. La seconde partie, plus longue que la première.</p><p>La troisième en 1248.</p>"
+        ptrs = suggest(src, tgt)
+        self.assertEqual([
+            ("Prima <ex>pars</ex> est.", "La première partie."),
+            ("Secunda pars, longior quam prima, est.", "La seconde partie, plus longue que la première."),
+            ("Tertia anno 1248.", "La troisième en 1248."),
+        ], [(src[a:b], tgt[c:d]) for a, b, c, d in ptrs])
+
+    def test_suggest_alignments_on_parallel_texts(self):
+        # the lines of the test texts are translated line by line: the alignments should not
+        # pair a sentence with a sentence of another paragraph
+        for name in ("1", "2", "3"):
+            with open(join(DATA_PATH, "transcription", name + ".txt")) as f:
+                src = to_html(f.read())
+            with open(join(DATA_PATH, "translation", name + ".txt")) as f:
+                tgt = to_html(f.read())
+            ptrs = suggest(src, tgt)
+            self.assertTrue(ptrs)
+            previous = (0, 0)
+            for a, b, c, d in ptrs:
+                self.assertTrue(previous[0] <= a < b and previous[1] <= c < d, name)
+                self.assertEqual(src[:a].count("<p>"), src[:b].count("<p>"))
+                self.assertEqual(src[:a].count("<p>"), tgt[:c].count("<p>"), name)
+                previous = (b, d)
+
+    def test_get_suggestions(self):
+        url = "/api/1.0/documents/21/transcriptions/alignments/suggestions/from-user/5"
+        self.assert401(url)
+        self.assert403(url, **STU2_USER)
+        self.load_fixtures(TestAlignmentSuggestions.FIXTURES)
+        self.assert404(url, **STU1_USER)
+
+        self.assert200("/api/1.0/documents/21/validate-transcription", **PROF1_USER)
+        tr = Transcription.query.filter(Transcription.id == 21).first()
+        tr.content = "<p>Om<ex>n</ex>ib<ex>us</ex> p<ex>re</ex>sentes litt<ex>er</ex>as inspectur<ex>is</ex>, " \
+                     "officialis Belvacensis, salutem in Domino. Noverint universi quod.</p>"
+        db.session.commit()
+
+        r = self.assert200(url, **STU1_USER)
+        ptrs = json_loads(r.data)["data"]
+        self.assertTrue(ptrs)
+        self.assertEqual(3, ptrs[0][0])
+        self.assertEqual(len(tr.content) - 4, ptrs[-1][1])
@@ -1,5 +1,7 @@
 from os.path import join
 from tests.base_server import TestBaseServer, PROF1_USER, STU1_USER, STU2_USER, json_loads
+from app import db
+from app.models import Transcription, Translation, AlignmentViewCache
 
 
 class TestAlignmentTranslationAPI(TestBaseServer):
@@ -141,6 +143,20 @@ class TestAlignmentTranslationAPI(TestBaseServer):
         r = json_loads(r.data)['data']
         self.assertEqual(3, len(r))
 
+        # posting replaces the alignments
+        ptrs = [(0, 3, 0, 4), (3, 15, 4, 11)]
+        r = self.assert200("/api/1.0/documents/21/transcriptions/alignments/from-user/5",
+                           method="POST", data={"data": ptrs}, **STU1_USER)
+        self.assertEqual([list(p) for p in ptrs], json_loads(r.data)['data'])
+        r = self.assert200("/api/1.0/documents/21/transcriptions/alignments/from-user/5", **STU1_USER)
+        self.assertEqual([list(p) for p in ptrs], sorted(json_loads(r.data)['data']))
+
+        # a malformed pointer leaves the alignments untouched
+        self.assert400("/api/1.0/documents/21/transcriptions/alignments/from-user/5",
+                       method="POST", data={"data": [(0, 3, 0)]}, **STU1_USER)
+        r = self.assert200("/api/1.0/documents/21/transcriptions/alignments/from-user/5", **STU1_USER)
+        self.assertEqual(2, len(json_loads(r.data)['data']))
+
         # test integrity
         # TODO
 
@@ -202,3 +218,55 @@ class TestAlignmentTranslationAPI(TestBaseServer):
         r = self.assert200("/api/1.0/documents/21/transcriptions/alignments/from-user/5", **PROF1_USER)
         r = json_loads(r.data)['data']
         self.assertEqual(0, len(r))
+
+    def test_view_alignment_cache(self):
+        url = "/api/1.0/documents/21/view/transcription-alignment"
+        self.load_fixtures(TestAlignmentTranslationAPI.FIXTURES)
+        self.load_fixtures(TestAlignmentTranslationAPI.FIXTURES_TRANSLATION_PROF)
+        self.assert404(url)
+
+        self.assert200("/api/1.0/documents/21/validate-transcription", **PROF1_USER)
+        self.assert200("/api/1.0/documents/21/validate-translation", **PROF1_USER)
+        tr = Transcription.query.filter(Transcription.doc_id == 21, Transcription.user_id == 4).first()
+        tl = Translation.query.filter(Translation.doc_id == 21, Translation.user_id == 4).first()
+        tr.content = "<p>a<adele-segment></adele-segment>b</p>"
+        tl.content = "<p>A<adele-segment></adele-segment>B</p>"
+        db.session.commit()
+
+        r = self.assert200(url)
+        self.assertEqual([["<p>a</p>", "<p>A</p>"], ["<p>b</p>", "<p>B</p>"]], json_loads(r.data)["data"]["alignments"])
+        etag = r.headers["ETag"].strip('"')
+        self.assertEqual(1, AlignmentViewCache.query.count())
+
+        # served from the cache
+        cached = AlignmentViewCache.query.first()
+        cached.alignments = '[["cached", "CACHED"], ["", ""]]'
+        db.session.commit()
+        r = self.assert200(url)
+        self.assertEqual([["cached", "CACHED"], ["", ""]], json_loads(r.data)["data"]["alignments"])
+
+        # the 304 reads neither the contents nor the cached pairs
+        with self.recorded_statements() as statements:
+            r = self.client.get(url, headers={"If-None-Match": '"%s"' % etag})
+        self.assertEqual(304, r.status_code)
+        self.assertEqual(b"", r.data)
+        self.assertEqual(1, len(statements))
+        self.assertNotIn(".content AS", statements[0])
+
+        # a change of the translation computes the pairs again
+        tl.content = "<p>A<adele-segment></adele-segment>B2</p>"
+        db.session.commit()
+        r = self.client.get(url, headers={"If-None-Match": '"%s"' % etag})
+        self.assertEqual(200, r.status_code)
+        self.assertNotEqual(etag, r.headers["ETag"].strip('"'))
+        self.assertEqual([["<p>a</p>", "<p>A</p>"], ["<p>b</p>", "<p>B2</p>"]], json_loads(r.data)["data"]["alignments"])
+        self.assertEqual(1, AlignmentViewCache.query.count())
+
+        # the rows written without their hash get it on the first view
+        db.session.execute("UPDATE transcription SET content_hash = NULL")
+        db.session.commit()
+        r = self.client.get(url, headers={"If-None-Match": r.headers["ETag"]})
+        self.assertEqual(304, r.status_code)
+        db.session.expire_all()
+        self.assertIsNotNone(Transcription.query.filter(Transcription.doc_id == 21, Transcription.user_id == 4)
+                             .first().content_hash)
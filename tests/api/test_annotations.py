@@ -0,0 +1,69 @@
+from os.path import join
+
+from tests.base_server import TestBaseServer, json_loads, PROF1_USER, STU1_USER
+from app import db
+from app.models import Image, ImageZone, AlignmentImage
+
+MANIFEST = "https://iiif.chartes.psl.eu/manifests/adele/man21.json"
+
+
+class TestAnnotationsAPI(TestBaseServer):
+    FIXTURES = [
+        join(TestBaseServer.FIXTURES_PATH, "documents", "doc_21.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "transcriptions", "transcription_doc_21_prof1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "notes", "notes_transcription_doc_21_prof1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "translations", "translation_doc_21_prof1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "notes", "notes_translation_doc_21_prof1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "alignments_translation", "alignments_translation_doc_21_prof1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "alignments_discours", "alignments_discours_doc_21_prof1.sql"),
+    ]
+
+    URL = "/api/1.0/documents/21/annotations/from-user/4"
+
+    def test_get_annotations_in_range(self):
+        self.assert401(self.URL + "?start=0&end=10")
+        self.assert403(self.URL + "?start=0&end=10", **STU1_USER)
+        self.assert404(self.URL + "?start=0&end=10", **PROF1_USER)
+
+        self.load_fixtures(TestAnnotationsAPI.FIXTURES)
+        db.session.add(Image(manifest_url=MANIFEST, canvas_idx=0, img_idx=0, doc_id=21))
+        for zone_id, ptr_start, ptr_end in ((111, 3, 84), (112, 84, 189)):
+            db.session.add(ImageZone(zone_id=zone_id, manifest_url=MANIFEST, canvas_idx=0, img_idx=0, user_id=4,
+                                     zone_type_id=1))
+            db.session.flush()
+            db.session.add(AlignmentImage(transcription_id=21, user_id=4, zone_id=zone_id, manifest_url=MANIFEST,
+                                          canvas_idx=0, img_idx=0, ptr_transcription_start=ptr_start,
+                                          ptr_transcription_end=ptr_end))
+        db.session.commit()
+        self.assert400(self.URL, **PROF1_USER)
+        self.assert400(self.URL + "?start=10&end=0", **PROF1_USER)
+        self.assert400(self.URL + "?on=document&start=0&end=10", **PROF1_USER)
+
+        r = self.assert200(self.URL + "?start=8&end=9", **PROF1_USER)
+        data = json_loads(r.data)["data"]
+        self.assertEqual([(100002, 9, 10)], [(n["id"], n["ptr_start"], n["ptr_end"]) for n in data["notes"]])
+        self.assertEqual([[3, 11, 3, 15]], data["translation_alignments"])
+        self.assertEqual([111], [al["zone_id"] for al in data["image_alignments"]])
+        self.assertEqual([(7, 19)], [(sp["ptr_start"], sp["ptr_end"]) for sp in data["speech_parts"]])
+        self.assertEqual(2, data["speech_parts"][0]["speech_part_type"]["id"])
+
+        r = self.assert200(self.URL + "?on=translation&start=16&end=24", **PROF1_USER)
+        data = json_loads(r.data)["data"]
+        self.assertEqual([[11, 21, 15, 25]], data["translation_alignments"])
+        self.assertEqual([], data["image_alignments"])
+
+        self.assert400(self.URL + "?on=commentary&start=0&end=10", **PROF1_USER)
+        self.assert404(self.URL + "?on=commentary&type_id=1&start=0&end=10", **PROF1_USER)
+
+    def test_range_queries_use_the_indexes(self):
+        self.load_fixtures(TestAnnotationsAPI.FIXTURES)
+        # a range ending where the selection starts overlaps it
+        r = self.assert200(self.URL + "?start=10&end=10", **PROF1_USER)
+        notes = json_loads(r.data)["data"]["notes"]
+        self.assertIn((100002, 9, 10), [(n["id"], n["ptr_start"], n["ptr_end"]) for n in notes])
+
+        for table, index in (("transcription_has_note", "ix_transcription_has_note_ptr"),
+                             ("alignment_discours", "ix_alignment_discours_ptr")):
+            plan = db.session.execute("EXPLAIN QUERY PLAN SELECT * FROM %s WHERE transcription_id = 21 "
+                                      "AND ptr_start <= 10 AND ptr_end >= 8" % table).fetchall()
+            self.assertIn(index, " ".join(str(row[-1]) for row in plan))
@@ -0,0 +1,120 @@
+import time
+from os.path import join
+
+from app.api.autosave import AutosaveBuffer, make_key
+from app.api.revisions.revision_store import get_revisions_query
+from tests.base_server import TestBaseServer, json_loads, STU1_USER, PROF1_USER
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestAutosaveAPI(TestBaseServer):
+    FIXTURES = [
+        join(TestBaseServer.FIXTURES_PATH, "documents", "doc_21.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "transcriptions", "transcription_doc_21_stu1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "notes", "notes_transcription_doc_21_stu1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "commentaries", "commentary_doc_21.sql"),
+    ]
+
+    URL = "/api/1.0/documents/21/transcriptions/from-user/5"
+
+    def setUp(self):
+        super().setUp()
+        self.load_fixtures(TestAutosaveAPI.FIXTURES)
+        self.clock = FakeClock()
+        self.buffer = AutosaveBuffer(self.app, quiet_period=5, clock=self.clock, background=False)
+        self.app.autosave_buffer = self.buffer
+        self.app.config["AUTOSAVE_COALESCING"] = True
+
+    def tearDown(self):
+        self.app.config["AUTOSAVE_COALESCING"] = False
+        self.app.autosave_buffer = None
+        super().tearDown()
+
+    def autosave(self, content, status=202):
+        return self.assertStatusCode(status, self.URL + "?autosave=1", method="PUT",
+                                     data={"data": {"content": content}}, **STU1_USER)
+
+    def get_content(self):
+        return json_loads(self.assert200(self.URL, **STU1_USER).data)["data"]["content"]
+
+    def test_autosaves_are_coalesced(self):
+        initial = self.get_content()
+        for i in range(3):
+            self.autosave("<p>draft %s</p>" % i)
+
+        # nothing is written before the quiet period
+        self.assertEqual(initial, self.get_content())
+        self.clock.now = 4
+        self.assertEqual(0, self.buffer.flush_due())
+
+        # a new autosave restarts the quiet period
+        self.autosave("<p>draft 3</p>")
+        self.clock.now = 8
+        self.assertEqual(0, self.buffer.flush_due())
+        self.clock.now = 9
+        self.assertEqual(1, self.buffer.flush_due())
+        self.assertEqual("<p>draft 3</p>", self.get_content())
+
+        # only the last content has been written
+        self.assertEqual(1, get_revisions_query('transcription', 21, 5).count())
+
+    def test_explicit_save_supersedes_autosave(self):
+        self.autosave("<p>draft</p>")
+        self.assert200(self.URL, method="PUT", data={"data": {"content": "<p>saved</p>"}}, **STU1_USER)
+        self.assertFalse(self.buffer.is_pending(make_key('transcription', 21, 5)))
+
+        self.clock.now = 10
+        self.assertEqual(0, self.buffer.flush_due())
+        self.assertEqual("<p>saved</p>", self.get_content())
+
+    def test_shutdown_flushes_pending_saves(self):
+        self.autosave("<p>draft</p>")
+        self.buffer.shutdown()
+        self.assertEqual("<p>draft</p>", self.get_content())
+
+    def test_patch_flushes_pending_save(self):
+        r = self.autosave("<p>draft</p>")
+        base = json_loads(r.data)["data"]["content_hash"]
+        r = self.assert200(self.URL, method="PATCH",
+                           data={"data": {"base": base, "edits": [{"offset": 3, "length": 5,
+                                                                    "replacement": "final"}]}},
+                           **STU1_USER)
+        self.assertEqual("<p>final</p>", json_loads(r.data)["data"]["content"])
+
+    def test_delete_drops_pending_save(self):
+        self.autosave("<p>draft</p>")
+        self.assert200(self.URL, method="DELETE", **PROF1_USER)
+        self.assertFalse(self.buffer.is_pending(make_key('transcription', 21, 5)))
+
+    def test_commentary_autosave(self):
+        url = "/api/1.0/documents/21/commentaries/from-user/4"
+        self.assertStatusCode(202, url + "?autosave=1", method="PUT",
+                              data={"data": {"type_id": 1, "content": "<p>draft</p>"}}, **PROF1_USER)
+        self.buffer.flush()
+        r = self.assert200(url, **PROF1_USER)
+        self.assertEqual("<p>draft</p>", json_loads(r.data)["data"][0]["content"])
+
+    def test_coalescing_disabled(self):
+        self.app.config["AUTOSAVE_COALESCING"] = False
+        self.autosave("<p>draft</p>", status=200)
+        self.assertEqual("<p>draft</p>", self.get_content())
+
+    def test_background_flush(self):
+        self.buffer = AutosaveBuffer(self.app, quiet_period=0.1)
+        self.app.autosave_buffer = self.buffer
+        self.autosave("<p>draft</p>")
+
+        deadline = time.monotonic() + 5
+        while self.buffer.is_pending(make_key('transcription', 21, 5)) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        # let the flusher commit
+        self.buffer.shutdown()
+        self.assertEqual("<p>draft</p>", self.get_content())
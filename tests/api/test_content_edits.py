@@ -0,0 +1,90 @@
+from os.path import join
+
+from app.api.content_edits import apply_edits
+from app.utils import content_hash
+from tests.base_server import TestBaseServer, json_loads, STU1_USER, PROF1_USER
+
+
+class TestContentEditsAPI(TestBaseServer):
+    FIXTURES = [
+        join(TestBaseServer.FIXTURES_PATH, "documents", "doc_21.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "transcriptions", "transcription_doc_21_stu1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "notes", "notes_transcription_doc_21_stu1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "translations", "translation_doc_21_stu1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "notes", "notes_translation_doc_21_stu1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "commentaries", "commentary_doc_21.sql"),
+    ]
+
+    def test_apply_edits(self):
+        content = "<p>Omnibus presentes</p>"
+        self.assertEqual(content, apply_edits(content, []))
+        self.assertEqual("<p>Omnibus praesentes litteras</p>", apply_edits(content, [
+            {"offset": 20, "length": 0, "replacement": " litteras"},
+            {"offset": 11, "length": 3, "replacement": "prae"},
+        ]))
+        self.assertEqual("<p>Omnibus</p>", apply_edits(content, [{"offset": 10, "length": 10}]))
+
+        for edits in (
+            [{"offset": 12, "length": 4, "replacement": ""}, {"offset": 14, "length": 1, "replacement": ""}],
+            [{"offset": 20, "length": 10, "replacement": ""}],
+            [{"offset": -1, "length": 0, "replacement": "x"}],
+            [{"length": 1}],
+            {"offset": 0},
+        ):
+            with self.assertRaises(ValueError):
+                apply_edits(content, edits)
+
+    def test_patch_transcription(self):
+        self.load_fixtures(TestContentEditsAPI.FIXTURES)
+        url = "/api/1.0/documents/21/transcriptions/from-user/5"
+
+        r = self.assert200(url, **STU1_USER)
+        data = json_loads(r.data)["data"]
+        content, base = data["content"], data["content_hash"]
+        self.assertEqual(content_hash(content), base)
+
+        edit = {"offset": 3, "length": 0, "replacement": "Incipit "}
+        r = self.assert200(url, method="PATCH", data={"data": {"base": base, "edits": [edit]}}, **STU1_USER)
+        data = json_loads(r.data)["data"]
+        self.assertEqual(content[:3] + "Incipit " + content[3:], data["content"])
+        self.assertEqual(content_hash(data["content"]), data["content_hash"])
+        # the notes are kept and still point to the same fragments
+        self.assertEqual(len(json_loads(self.assert200(url, **STU1_USER).data)["data"]["notes"]), len(data["notes"]))
+
+        # the base is stale now
+        self.assert409(url, method="PATCH", data={"data": {"base": base, "edits": [edit]}}, **STU1_USER)
+        # malformed edits
+        self.assert400(url, method="PATCH",
+                       data={"data": {"base": data["content_hash"], "edits": [{"offset": 10 ** 6, "length": 1}]}},
+                       **STU1_USER)
+        self.assert404("/api/1.0/documents/21/transcriptions/from-user/6", method="PATCH",
+                       data={"data": {"base": base, "edits": []}}, **STU1_USER)
+
+    def test_patch_translation(self):
+        self.load_fixtures(TestContentEditsAPI.FIXTURES)
+        url = "/api/1.0/documents/21/translations/from-user/5"
+
+        r = self.assert200(url, **STU1_USER)
+        data = json_loads(r.data)["data"]
+        content, base = data["content"], data["content_hash"]
+
+        edit = {"offset": 3, "length": 4, "replacement": "Stu1"}
+        r = self.assert200(url, method="PATCH", data={"data": {"base": base, "edits": [edit]}}, **STU1_USER)
+        self.assertEqual(content[:3] + "Stu1" + content[7:], json_loads(r.data)["data"]["content"])
+        self.assert409(url, method="PATCH", data={"data": {"base": base, "edits": [edit]}}, **STU1_USER)
+
+    def test_patch_commentary(self):
+        self.load_fixtures(TestContentEditsAPI.FIXTURES)
+        url = "/api/1.0/documents/21/commentaries/from-user/4"
+
+        r = self.assert200(url, **PROF1_USER)
+        data = json_loads(r.data)["data"][0]
+        content, base = data["content"], data["content_hash"]
+
+        edit = {"offset": 0, "length": 6, "replacement": "Magna"}
+        self.assert400(url, method="PATCH", data={"data": {"base": base, "edits": [edit]}}, **PROF1_USER)
+        r = self.assert200(url, method="PATCH", data={"data": {"type_id": 1, "base": base, "edits": [edit]}},
+                           **PROF1_USER)
+        self.assertEqual("Magna" + content[6:], json_loads(r.data)["data"]["content"])
+        self.assert409(url, method="PATCH", data={"data": {"type_id": 1, "base": base, "edits": [edit]}},
+                       **PROF1_USER)
@@ -0,0 +1,88 @@
+from os.path import join
+
+from tests.base_server import TestBaseServer, json_loads, make_auth_headers, PROF1_USER, STU1_USER, STU2_USER
+from app import db
+from app.document_access import refresh_document_access
+from app.models import Document, User, Whitelist
+from app.utils import is_whitelist_member
+
+STU3_USER = {"username": "Eleve3"}
+
+
+class TestDocumentAccess(TestBaseServer):
+    FIXTURES = [
+        join(TestBaseServer.FIXTURES_PATH, "documents", "doc_20.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "documents", "doc_21.sql"),
+    ]
+
+    URL = "/api/1.0/dashboard/my-documents"
+
+    def my_documents(self, user, query=""):
+        r = json_loads(self.assert200(self.URL + query, **user).data)["data"]
+        return r["total"], [d["id"] for d in r["documents"]]
+
+    def test_my_documents(self):
+        self.load_fixtures(TestDocumentAccess.FIXTURES)
+        # the fixtures are loaded without the ORM
+        refresh_document_access()
+        db.session.commit()
+
+        self.assert401(self.URL)
+        # doc 20 is closed
+        self.assertEqual((1, [21]), self.my_documents(STU1_USER))
+        self.assertEqual((1, [21]), self.my_documents(STU2_USER))
+        self.assertEqual((0, []), self.my_documents(STU3_USER))
+        self.assertEqual((2, [21]), self.my_documents(PROF1_USER, "?num-page=2&page-size=1"))
+        self.assertEqual([21], [d.id for d in User.query.get(5).documents_i_can_edit])
+        self.assertEqual([20, 21], sorted(d.id for d in User.query.get(5).documents_from_my_whitelists))
+
+        # whitelist of a document
+        self.assert200("/api/1.0/documents/21/whitelist", method="POST", data={"data": {"whitelist_id": 2}},
+                       **PROF1_USER)
+        self.assertEqual((1, [21]), self.my_documents(STU1_USER))
+        self.assertEqual((0, []), self.my_documents(STU2_USER))
+        self.assertEqual((1, [21]), self.my_documents(STU3_USER))
+
+        # members of a whitelist, on both sides of the relationship
+        self.assert200("/api/1.0/whitelists/2/remove-user/5", method="DELETE", **PROF1_USER)
+        self.assertEqual((0, []), self.my_documents(STU1_USER))
+        student = User.query.get(7)
+        student.whitelists.append(Whitelist.query.get(2))
+        db.session.commit()
+        self.assertEqual((1, [21]), self.my_documents(STU2_USER))
+
+        # closing date and owner
+        self.assert200("/api/1.0/documents/20/open", **PROF1_USER)
+        self.assertEqual((1, [20]), self.my_documents(STU1_USER))
+        self.assert200("/api/1.0/documents/20/close", method="POST", data={"data": {"closing_date": "01/01/2019"}},
+                       **PROF1_USER)
+        self.assertEqual((0, []), self.my_documents(STU1_USER))
+        doc = Document.query.get(21)
+        doc.user_id = 5
+        db.session.commit()
+        self.assertEqual((1, [21]), self.my_documents(STU1_USER))
+
+        # deleted document
+        self.assertStatus(self.delete_with_auth("/api/1.0/documents/21", PROF1_USER["username"]), 204)
+        self.assertEqual((0, []), self.my_documents(STU1_USER))
+
+    def test_whitelist_membership(self):
+        self.load_fixtures(TestDocumentAccess.FIXTURES)
+        self.load_fixtures([join(TestBaseServer.FIXTURES_PATH, "transcriptions", "transcription_doc_21_prof1.sql")])
+        self.assert200("/api/1.0/documents/21/validate-transcription", **PROF1_USER)
+
+        with self.app.test_request_context():
+            with self.recorded_statements() as statements:
+                self.assertTrue(is_whitelist_member(1, 5))
+                self.assertTrue(is_whitelist_member(1, 5))
+                self.assertFalse(is_whitelist_member(1, 9))
+            self.assertEqual(2, len(statements))
+            self.assertTrue(all("EXISTS" in s and "whitelist_has_user" in s for s in statements))
+
+        for user, user_id, status in ((STU1_USER, 5, 200), (STU3_USER, 9, 403)):
+            url = "/api/1.0/documents/21/transcriptions/speech-parts/from-user/%s" % user_id
+            headers = make_auth_headers(user["username"])
+            with self.recorded_statements() as statements:
+                self.assertStatus(self.patch(url, {"data": [[3, 7, 1]]}, headers=headers), status)
+            # the members of the whitelist are not loaded
+            self.assertEqual(1, len([s for s in statements if "whitelist_has_user" in s]))
@@ -0,0 +1,96 @@
+from os.path import join
+
+from app import db
+from app.api.documents.dossier_clone import rewrite_note_ids
+from app.models import Transcription, Translation, Commentary, Note, TranscriptionHasNote, TranslationHasNote, \
+    AlignmentDiscours
+from tests.base_server import TestBaseServer, json_loads, STU1_USER, PROF1_USER
+
+
+class TestDossierCloneAPI(TestBaseServer):
+    FIXTURES = [
+        join(TestBaseServer.FIXTURES_PATH, "documents", "doc_21.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "transcriptions", "transcription_doc_21_prof1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "transcriptions", "transcription_doc_21_stu1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "notes", "notes_transcription_doc_21_prof1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "notes", "notes_transcription_doc_21_stu1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "translations", "translation_doc_21_stu1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "notes", "notes_translation_doc_21_stu1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "commentaries", "commentary_doc_21.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "alignments_discours", "alignments_discours_doc_21_prof1.sql"),
+    ]
+
+    def test_rewrite_note_ids(self):
+        content = "<p><adele-note id='12'>a</adele-note> <adele-note id=\"13\">b</adele-note>" \
+                  "<adele-note class='x' id=14>c</adele-note></p>"
+        self.assertEqual(
+            "<p><adele-note id='112'>a</adele-note> <adele-note id=\"13\">b</adele-note>"
+            "<adele-note class='x' id=114>c</adele-note></p>",
+            rewrite_note_ids(content, {12, 14}, 100)
+        )
+
+    def test_clone_dossier(self):
+        self.load_fixtures(TestDossierCloneAPI.FIXTURES)
+        stu_tr = Transcription.query.filter(Transcription.doc_id == 21, Transcription.user_id == 5).first()
+        stu_tr.content = '<p><adele-note id="500001">Om</adele-note>nibus</p>'
+        db.session.add(AlignmentDiscours(transcription_id=stu_tr.id, speech_part_type_id=1, user_id=5,
+                                         ptr_start=3, ptr_end=5, note="stu1"))
+        db.session.commit()
+
+        self.assert403("/api/1.0/documents/21/clone/from-user/5", **STU1_USER)
+        r = self.assert200("/api/1.0/documents/21/clone/from-user/5", **PROF1_USER)
+        cloned = json_loads(r.data)["data"][0]["cloned"]
+        self.assertEqual(3, cloned["notes"])
+        self.assertEqual(2, cloned["commentaries"])
+        self.assertEqual(1, cloned["speech_part_alignments"])
+
+        # the teacher's transcription is updated in place, with the cloned notes
+        prof_tr = Transcription.query.filter(Transcription.doc_id == 21, Transcription.user_id == 4).first()
+        self.assertEqual(21, prof_tr.id)
+        new_notes = sorted(prof_tr.notes, key=lambda n: n.id)
+        self.assertEqual(3, len(new_notes))
+        self.assertTrue(all(n.user_id == 4 for n in new_notes))
+        self.assertEqual(['<p>NOTE 1 STU1</p>', '<p>NOTE 2 STU1</p>', '<p>NOTE 3 STU1</p>'],
+                         [n.content for n in new_notes])
+        self.assertEqual('<p><adele-note id="%s">Om</adele-note>nibus</p>' % new_notes[0].id, prof_tr.content)
+        self.assertEqual(
+            [(3, 5), (9, 10), (15, 17)],
+            sorted((thn.ptr_start, thn.ptr_end)
+                   for thn in TranscriptionHasNote.query.filter(TranscriptionHasNote.transcription_id == 21))
+        )
+
+        # the old teacher's notes are deleted, the student's notes are untouched
+        self.assertEqual(0, Note.query.filter(Note.id.in_([100001, 100002, 100003])).count())
+        self.assertEqual(3, Note.query.filter(Note.user_id == 5).count())
+
+        # notes shared by the transcription and the translation are cloned once
+        prof_tl = Translation.query.filter(Translation.doc_id == 21, Translation.user_id == 4).first()
+        self.assertEqual(set(n.id for n in new_notes),
+                         set(thn.note_id for thn in TranslationHasNote.query.filter(
+                             TranslationHasNote.translation_id == prof_tl.id)))
+
+        coms = {c.type_id: c for c in Commentary.query.filter(Commentary.doc_id == 21, Commentary.user_id == 4)}
+        self.assertEqual(21, coms[1].id)
+        self.assertTrue(coms[1].content.startswith('Quis'))
+        self.assertIn(2, coms)
+
+        als = AlignmentDiscours.query.filter(AlignmentDiscours.transcription_id == 21).all()
+        self.assertEqual([(4, 3, 5, "stu1")], [(al.user_id, al.ptr_start, al.ptr_end, al.note) for al in als])
+
+        # cloning twice does not leave orphan notes behind
+        self.assert200("/api/1.0/documents/21/clone/from-user/5", **PROF1_USER)
+        self.assertEqual(3, Note.query.filter(Note.user_id == 4).count())
+
+    def test_clone_dossiers(self):
+        self.load_fixtures(TestDossierCloneAPI.FIXTURES)
+        url = "/api/1.0/documents/clone"
+
+        self.assert400(url, method="POST", data={"data": [{"doc_id": 21}]}, **PROF1_USER)
+        # all or nothing
+        self.assert404(url, method="POST", data={"data": [{"doc_id": 21, "user_id": 5},
+                                                          {"doc_id": 21, "user_id": 7}]}, **PROF1_USER)
+        self.assertIsNone(Translation.query.filter(Translation.doc_id == 21, Translation.user_id == 4).first())
+
+        r = self.assert200(url, method="POST", data={"data": [{"doc_id": 21, "user_id": 5}]}, **PROF1_USER)
+        self.assertEqual([21], [item["doc_id"] for item in json_loads(r.data)["data"]])
+        self.assertIsNotNone(Translation.query.filter(Translation.doc_id == 21, Translation.user_id == 4).first())
@@ -0,0 +1,73 @@
+import re
+from os.path import join
+
+from tests.base_server import TestBaseServer, json_loads, make_auth_headers, PROF1_USER
+from app import db
+from app.models import DocumentAccess, MailOutbox, User, Whitelist
+
+
+class TestInvitations(TestBaseServer):
+    URL = "/api/1.0/invite-users"
+
+    def invite(self, data, query="", status=200):
+        headers = make_auth_headers(PROF1_USER["username"])
+        if isinstance(data, str):
+            headers["content-type"] = "text/csv"
+            r = self.client.post(self.URL + query, data=data.encode("utf-8"), headers=headers)
+        else:
+            r = self.post(self.URL + query, data, headers=headers)
+        self.assertStatus(r, status)
+        return json_loads(r.data)
+
+    def test_invite_json_roster(self):
+        self.load_fixtures([join(TestBaseServer.FIXTURES_PATH, "documents", "doc_21.sql")])
+        self.app.config["INVITATION_HASH_PROCESSES"] = 2
+        try:
+            roster = [{"email": "student%s@class.test" % i, "firstname": "Student", "lastname": str(i)}
+                      for i in range(10)]
+            roster += [{"email": "teacher@class.test", "role": "teacher"}, "eleve1@gmail.com"]
+            r = self.invite({"users": roster, "whitelist_id": 1})["data"]
+        finally:
+            self.app.config["INVITATION_HASH_PROCESSES"] = None
+        self.assertEqual(11, len(r["invited"]))
+        self.assertEqual(["eleve1@gmail.com"], r["existing"])
+
+        student = User.query.filter(User.email == "student3@class.test").one()
+        self.assertEqual(("student3", "Student", "3"), (student.username, student.first_name, student.last_name))
+        self.assertEqual(["student"], [role.name for role in student.roles])
+        self.assertTrue(User.query.filter(User.username == "teacher").one().is_teacher)
+        whitelist = Whitelist.query.get(1)
+        self.assertIn(student, whitelist.users)
+        self.assertEqual(1, len([u for u in whitelist.users if u.email == "eleve1@gmail.com"]))
+        # the new members can edit the documents of the whitelist
+        self.assertIsNotNone(DocumentAccess.query.get((student.id, 21)))
+
+        # one mail per invited user, with a password which can be used to log in
+        self.assertEqual(11, MailOutbox.query.count())
+        mail = MailOutbox.query.filter(MailOutbox.recipients.contains("student3@")).one()
+        password = re.search(r"Mot de passe: (\S+)", mail.body).group(1)
+        r = self.client.post("/api/1.0/login", json={"email": "student3@class.test", "password": password})
+        self.assertStatus(r, 200)
+
+    def test_invite_csv_roster(self):
+        csv = "Email;Role;Username\nstudentA@class.test;;alice\nstudentB@class.test;teacher;\n"
+        r = self.invite(csv, "?whitelist-id=2")["data"]
+        self.assertEqual((["studentA@class.test", "studentB@class.test"], 2), (r["invited"], r["whitelist_id"]))
+        self.assertEqual({"alice", "studentB"}, set(u.username for u in Whitelist.query.get(2).users
+                                                   if u.email.endswith("@class.test")))
+
+    def test_invalid_rosters(self):
+        invalid = [
+            {"users": ["a@class.test", "not an email"]},
+            {"users": [{"email": "a@class.test", "role": "director"}]},
+            {"users": ["a@class.test", "a@class.test"]},
+            {"users": ["a@class.test", "a@other.test"]},
+            {"users": ["eleve1@class.test"], "whitelist_id": 99},
+            {"users": [{"email": "a@class.test", "username": "Eleve1"}]},
+            {"users": "a@class.test"},
+        ]
+        for data in invalid:
+            self.invite(data, status=400)
+        self.assertEqual(0, User.query.filter(User.email.like("%@class.test")).count())
+        self.assertEqual(0, MailOutbox.query.count())
+        db.session.rollback()
@@ -0,0 +1,57 @@
+import datetime
+import decimal
+import json
+import unittest
+
+from flask import jsonify
+from markupsafe import Markup
+
+from tests.base_server import TestBaseServer, json_loads, ADMIN_USER
+from app.api.json_encoder import make_json_dumps, orjson
+
+PAYLOAD = {
+    "content": Markup("<p>Deux points juxtaposés</p>"),
+    "date": datetime.datetime(2018, 3, 29, 10, 29, 20, 59262),
+    "day": datetime.date(2018, 3, 29),
+    "amount": decimal.Decimal("12.50"),
+    "count": decimal.Decimal("3"),
+    "by_id": {1: "one"},
+    "items": (1, None, True),
+}
+EXPECTED = {
+    "content": "<p>Deux points juxtaposés</p>",
+    "date": "2018-03-29 10:29:20",
+    "day": "2018-03-29",
+    "amount": 12.5,
+    "count": 3,
+    "by_id": {"1": "one"},
+    "items": [1, None, True],
+}
+
+
+class TestJSONEncoder(TestBaseServer):
+
+    def check_encoder(self, encoder):
+        compact = make_json_dumps(encoder)(PAYLOAD)
+        indented = make_json_dumps(encoder, indent=2)(PAYLOAD)
+        for output in (compact, indented):
+            self.assertEqual(EXPECTED, json.loads(output))
+        self.assertNotIn(b"\n", compact if isinstance(compact, bytes) else compact.encode("utf-8"))
+        self.assertIn("\n  ", indented.decode("utf-8") if isinstance(indented, bytes) else indented)
+        self.assertIn("juxtaposés", compact.decode("utf-8") if isinstance(compact, bytes) else compact)
+        self.assertRaises(TypeError, make_json_dumps(encoder), {"unknown": object()})
+
+    def test_stdlib_encoder(self):
+        self.check_encoder("json")
+
+    @unittest.skipIf(orjson is None, "orjson is not installed")
+    def test_orjson_encoder(self):
+        self.check_encoder("orjson")
+
+    def test_responses(self):
+        r = self.assert200("/api/1.0/users/5", **ADMIN_USER)
+        # compact outside of the development config
+        self.assertNotIn(b"\n", r.data)
+        self.assertEqual("2018-03-29 10:29:20", json_loads(r.data)["data"][0]["email_confirmed_at"])
+        with self.app.test_request_context():
+            self.assertEqual(EXPECTED, json_loads(jsonify(PAYLOAD).data))
@@ -0,0 +1,77 @@
+import random
+from os.path import join
+
+from tests.base_server import TestBaseServer, json_loads, PROF1_USER, STU1_USER
+from app.locator import TagAwareLocator
+from app.plain_text import html_to_plain_text, text_to_html, html_to_text
+
+CONTENT = "<p>Om<ex>n</ex>ib<ex>us</ex> p<ex>re</ex>sentes litt<ex>er</ex>as inspectur<ex>is</ex>, " \
+          "officialis Belvacensis, salutem in Domino.</p><p>Noverint universi quod in nostra " \
+          "constituti p<ex>re</ex>sentia Ricardus d<ex>i</ex>c<ex>t</ex>us de Gres &amp; Aya.</p>"
+
+
+class TestLocator(TestBaseServer):
+    FIXTURES = [
+        join(TestBaseServer.FIXTURES_PATH, "documents", "doc_21.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "transcriptions", "transcription_doc_21_prof1.sql"),
+    ]
+
+    def test_offsets(self):
+        text, runs = html_to_plain_text(CONTENT)
+        locator = TagAwareLocator.from_html(CONTENT)
+        for pos in range(len(text) + 2):
+            self.assertEqual(text_to_html(runs, pos), locator.to_html(pos))
+            self.assertEqual(text_to_html(runs, pos, end=True), locator.to_html(pos, end=True))
+        for pos in range(len(CONTENT) + 2):
+            self.assertEqual(html_to_text(runs, pos), locator.to_text(pos))
+
+    def test_find(self):
+        locator = TagAwareLocator.from_html(CONTENT)
+
+        start, end, score = locator.find("Omnibus presentes")
+        self.assertEqual("Om<ex>n</ex>ib<ex>us</ex> p<ex>re</ex>sentes", CONTENT[start:end])
+        self.assertEqual(1.0, score)
+        # case and whitespace are ignored, entities are decoded
+        start, end, score = locator.find("de  GRES & aya")
+        self.assertEqual("de Gres &amp; Aya", CONTENT[start:end])
+
+        # approximate matches
+        start, end, score = locator.find("constitutis presencia Ricardus")
+        self.assertEqual("constituti p<ex>re</ex>sentia Ricardus", CONTENT[start:end])
+        self.assertTrue(0.6 < score < 1)
+        self.assertIsNone(locator.find("nihil simile hic invenitur"))
+        self.assertIsNone(locator.find(""))
+
+        # the search starts at a position of the content
+        self.assertIsNone(locator.find("Omnibus", start=CONTENT.index("Noverint")))
+
+    def test_find_in_long_content(self):
+        rnd = random.Random(7)
+        words = ["verbum%s" % i for i in range(2000)]
+        rnd.shuffle(words)
+        locator = TagAwareLocator.from_html("<p>%s</p>" % " <hi>x</hi> ".join(words))
+        for i in range(0, 1990, 97):
+            phrase = words[i:i + 5]
+            start, end, score = locator.find(" ".join(phrase[:2] + ["verbm"] + phrase[3:]))
+            self.assertEqual(locator.find(" ".join(phrase))[:2], (start, end))
+            self.assertTrue(score < 1)
+
+    def test_post_locate(self):
+        url = "/api/1.0/documents/21/locate/from-user/4"
+        self.assert403(url, method="POST", data={"data": {}}, **STU1_USER)
+        self.assert404(url, method="POST", data={"data": {}}, **PROF1_USER)
+        self.load_fixtures(TestLocator.FIXTURES)
+        self.assert400(url, method="POST", data={"data": {"phrases": [{"start": 0}]}}, **PROF1_USER)
+
+        r = self.assert200(url, method="POST", data={"data": {
+            "phrases": ["presentes litteras", {"phrase": "Omnibus", "start": 10}, "nothing like this"],
+            "text_offsets": [0, 3],
+            "html_offsets": [4, 8]
+        }}, **PROF1_USER)
+        data = json_loads(r.data)["data"]
+        content = "<p>Om<ex>n</ex>ib<ex>us</ex> p<ex>re</ex>sentes litt<ex>er</ex>as inspectur<ex>is</ex></p>"
+        found = data["phrases"][0]
+        self.assertEqual("p<ex>re</ex>sentes litt<ex>er</ex>as", content[found["ptr_start"]:found["ptr_end"]])
+        self.assertEqual([None, None], data["phrases"][1:])
+        self.assertEqual([3, 15], data["text_offsets"])
+        self.assertEqual([1, 2], data["html_offsets"])
@@ -0,0 +1,133 @@
+import socket
+import time
+import unittest
+
+from tests.base_server import TestBaseServer, ADMIN_USER
+from app import db, mail
+from app.mail_outbox import MailSender, send_all_pending, send_pending
+from app.models import MailOutbox, User
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    Controller = None
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class RecordingHandler(object):
+    """ local SMTP stand-in: records the mails it receives, refuses the recipients @refused.test """
+
+    def __init__(self):
+        self.received = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.endswith("@refused.test"):
+            return "550 mailbox unavailable"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received.append((session.peer, envelope.rcpt_tos, envelope.content.decode("utf-8", "replace")))
+        return "250 Message accepted for delivery"
+
+
+@unittest.skipIf(Controller is None, "aiosmtpd is not installed")
+class TestMailOutbox(TestBaseServer):
+
+    def setUp(self):
+        super().setUp()
+        self.handler = RecordingHandler()
+        self.port = free_port()
+        self.smtp = Controller(self.handler, hostname="127.0.0.1", port=self.port)
+        self.smtp.start()
+        self.mail_state = self.make_mail_state(self.port)
+
+    def tearDown(self):
+        self.smtp.stop()
+        super().tearDown()
+
+    @staticmethod
+    def make_mail_state(port):
+        return mail.init_mail({"MAIL_SERVER": "127.0.0.1", "MAIL_PORT": port, "MAIL_SUPPRESS_SEND": False})
+
+    def invite(self, email):
+        return self.assert200("/api/1.0/invite-user", method="POST", data={"email": email, "role": "student"},
+                              **ADMIN_USER)
+
+    def test_invitations_are_queued_then_sent(self):
+        with mail.record_messages() as outbox:
+            for i in range(3):
+                self.invite("invited%s@adele.test" % i)
+        # nothing is sent by the requests
+        self.assertEqual([], outbox)
+        self.assertEqual([], self.handler.received)
+        self.assertEqual(3, MailOutbox.query.filter(MailOutbox.status == "pending").count())
+        self.assertIsNotNone(User.query.filter(User.email == "invited0@adele.test").first())
+
+        # a failed invitation does not queue its mail
+        self.assert400("/api/1.0/invite-user", method="POST", data={"email": "invited0@other.test"}, **ADMIN_USER)
+        self.assertEqual(3, MailOutbox.query.count())
+
+        self.assertEqual((2, 0), send_pending(batch_size=2, mail_state=self.mail_state))
+        self.assertEqual((1, 0), send_all_pending(mail_state=self.mail_state))
+        self.assertEqual((0, 0), send_all_pending(mail_state=self.mail_state))
+        self.assertEqual([["invited0@adele.test"], ["invited1@adele.test"], ["invited2@adele.test"]],
+                         [rcpt for peer, rcpt, content in self.handler.received])
+        self.assertIn("Identifiant: invited0@adele.test", self.handler.received[0][2])
+        # the mails of a batch share their connection
+        self.assertEqual(2, len(set(peer for peer, rcpt, content in self.handler.received)))
+        self.assertEqual(3, MailOutbox.query.filter(MailOutbox.status == "sent").count())
+
+    def test_password_reset_link_is_queued(self):
+        self.assert200("/api/1.0/send-password-reset-link", method="POST", data={"email": "unknown@adele.test"})
+        self.assertEqual(0, MailOutbox.query.count())
+        email = User.query.filter(User.username == "Eleve1").first().email
+        self.assert200("/api/1.0/send-password-reset-link", method="POST", data={"email": email})
+        self.assertEqual((1, 0), send_all_pending(mail_state=self.mail_state))
+        self.assertEqual([[email]], [rcpt for peer, rcpt, content in self.handler.received])
+        self.assertIn("/reset-password?token=", self.handler.received[0][2])
+
+    def test_retries(self):
+        self.app.config["MAIL_OUTBOX_RETRY_DELAY"] = 0
+        self.app.config["MAIL_OUTBOX_MAX_ATTEMPTS"] = 3
+        try:
+            self.invite("refused@refused.test")
+            self.invite("someone@adele.test")
+            # the refused recipient does not prevent the other mail of the batch from being sent
+            self.assertEqual((1, 1), send_pending(mail_state=self.mail_state))
+            refused = MailOutbox.query.filter(MailOutbox.recipients.contains("refused.test")).one()
+            self.assertEqual(("pending", 1), (refused.status, refused.attempts))
+            self.assertIn("SMTPRecipientsRefused", refused.last_error)
+            self.assertEqual((0, 2), send_all_pending(mail_state=self.mail_state))
+            db.session.refresh(refused)
+            self.assertEqual(("failed", 3), (refused.status, refused.attempts))
+
+            # the server is down: the mails are tried again later, with a growing delay
+            self.app.config["MAIL_OUTBOX_RETRY_DELAY"] = 60
+            self.invite("later@adele.test")
+            self.assertEqual((0, 1), send_pending(mail_state=self.make_mail_state(free_port())))
+            later = MailOutbox.query.filter(MailOutbox.recipients.contains("later")).one()
+            self.assertEqual(("pending", 1), (later.status, later.attempts))
+            self.assertGreater(later.next_attempt_at, later.created_at)
+            self.assertEqual((0, 0), send_pending(mail_state=self.mail_state))
+            self.assertEqual(1, len(self.handler.received))
+        finally:
+            self.app.config["MAIL_OUTBOX_RETRY_DELAY"] = 60
+            self.app.config["MAIL_OUTBOX_MAX_ATTEMPTS"] = 5
+
+    def test_sender_thread(self):
+        self.invite("threaded@adele.test")
+        sender = MailSender(self.app, mail_state=self.mail_state)
+        sender.wake()
+        deadline = time.monotonic() + 5
+        while not self.handler.received and time.monotonic() < deadline:
+            time.sleep(0.05)
+        sender.stop()
+        self.assertEqual([["threaded@adele.test"]], [rcpt for peer, rcpt, content in self.handler.received])
+        db.session.expire_all()
+        self.assertEqual("sent", MailOutbox.query.one().status)
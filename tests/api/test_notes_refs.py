@@ -0,0 +1,174 @@
+import copy
+import random
+from os.path import join
+
+from markupsafe import Markup
+
+from tests.base_server import TestBaseServer
+from app import db
+from app.api.alignments.alignments_translation import add_notes_refs, replace_translation_alignments
+from app.api.transcriptions.routes import add_notes_refs_to_text, BTAG, ETAG
+from app.models import AlignmentTranslation
+
+
+def legacy_add_notes_refs_to_text(text, notes, btag=BTAG, etag=ETAG):
+    """ the implementation add_notes_refs_to_text() replaced, used as a reference """
+    len_of_tag = len(btag) + len(etag)
+    text_with_notes = text
+
+    notes.sort(key=lambda k: k["ptr_start"])
+    for num_note, note in enumerate(notes):
+        offset = len_of_tag * num_note
+        offset += 3 * num_note  # decalage?
+        start_offset = int(note["ptr_start"]) + offset
+        end_offset = int(note["ptr_end"]) + offset
+        kwargs = {
+            "btag": btag.format(note["id"]),
+            "etag": etag,
+            "text_before": text_with_notes[0:start_offset],
+            "text_between": text_with_notes[start_offset:end_offset],
+            "text_after": text_with_notes[end_offset:]
+        }
+        text_with_notes = "{text_before}{btag}{text_between}{etag}{text_after}".format(**kwargs)
+    return text_with_notes
+
+
+def legacy_add_notes_refs(tr, tl):
+    """ the implementation add_notes_refs() replaced, used as a reference """
+    all_al = AlignmentTranslation.query.filter(AlignmentTranslation.transcription_id == tr["id"],
+                                               AlignmentTranslation.translation_id == tl["id"]).all()
+
+    def insert_notes_into_al(content, notes, get_al_start_ptr, get_al_end_ptr):
+        offset = 0
+        content_w_notes = []
+
+        for num_al, al in enumerate(all_al):
+
+            after_notes = []
+            before_notes = []
+            between_notes = []
+            overlapping_note = None
+            al_ptr_start = get_al_start_ptr(al)
+            al_ptr_end = get_al_end_ptr(al)
+
+            for note in notes:
+                if int(note["ptr_start"]) < al_ptr_start and \
+                        int(note["ptr_end"]) > al_ptr_end:
+                    overlapping_note = note
+                elif (al_ptr_start <= int(note["ptr_start"]) <= al_ptr_end) and \
+                        (al_ptr_start <= int(note["ptr_end"]) <= al_ptr_end):
+                    between_notes.append(note)
+                elif int(note["ptr_start"]) <= al_ptr_end <= int(note["ptr_end"]):
+                    after_notes.append(note)
+                elif int(note["ptr_start"]) <= al_ptr_start <= int(note["ptr_end"]):
+                    before_notes.append(note)
+
+            ptr_start = al_ptr_start + offset
+            offset += len(ETAG) * len(before_notes)
+            offset += (len(BTAG.format(1)) + len(ETAG)) * len(between_notes)
+            offset += len(BTAG.format(1)) * len(after_notes)
+            ptr_end = al_ptr_end + offset
+
+            text = content[ptr_start:ptr_end]
+
+            if overlapping_note:
+                text = "{BTAG}{al}{ETAG}".format(BTAG=BTAG.format(overlapping_note["id"]), ETAG=ETAG, al=text)
+            elif len(before_notes) > 0:
+                current_note_id = before_notes[0]["id"]
+                text = "{BTAG}{al}".format(BTAG=BTAG.format(current_note_id), al=text)
+            elif len(after_notes) > 0:
+                text = "{al}{ETAG}".format(ETAG=ETAG, al=text)
+
+            content_w_notes.append(Markup(text))
+        return content_w_notes
+
+    tr_notes = tr["notes"]
+    tl_notes = tl["notes"]
+    tr_c = legacy_add_notes_refs_to_text(tr["content"], tr_notes)
+    tl_c = legacy_add_notes_refs_to_text(tl["content"], tl_notes)
+
+    tr_w_notes = insert_notes_into_al(tr_c, tr_notes, lambda al: al.ptr_transcription_start,
+                                      lambda al: al.ptr_transcription_end)
+    tl_w_notes = insert_notes_into_al(tl_c, tl_notes, lambda al: al.ptr_translation_start,
+                                      lambda al: al.ptr_translation_end)
+
+    notes = {n["id"]: n for n in tr_notes + tl_notes}
+    notes = list(notes.values())
+
+    return tr_w_notes, tl_w_notes, notes, len(all_al)
+
+
+def make_text(rnd, length):
+    return "".join(rnd.choice("abcdefgh ") for _ in range(length))
+
+
+def make_notes(rnd, length, count, first_id, overlapping=False):
+    """ notes of a text of the given length, overlapping each other or not """
+    if overlapping:
+        ptrs = []
+        for _ in range(count):
+            start, end = rnd.randint(-2, length + 2), rnd.randint(-2, length + 2)
+            ptrs.append((start, end) if rnd.random() < 0.9 else (end, start))
+    else:
+        bounds = sorted(rnd.randint(0, length) for _ in range(2 * count))
+        ptrs = list(zip(bounds[::2], bounds[1::2]))
+        rnd.shuffle(ptrs)
+    return [{"id": first_id + i, "ptr_start": start, "ptr_end": end, "content": "note %s" % i}
+            for i, (start, end) in enumerate(ptrs)]
+
+
+def make_alignments(rnd, tr_length, tl_length, count, overlapping=False):
+    """ alignments splitting the texts, or at random places """
+    if overlapping:
+        return set(tuple(rnd.randint(0, length) for length in (tr_length, tr_length, tl_length, tl_length))
+                   for _ in range(count))
+    tr_bounds = sorted(set(rnd.randint(0, tr_length) for _ in range(count)) | {0, tr_length})
+    tl_bounds = sorted(set(rnd.randint(0, tl_length) for _ in range(count)) | {0, tl_length})
+    return list(zip(tr_bounds, tr_bounds[1:], tl_bounds, tl_bounds[1:]))
+
+
+class TestNotesRefs(TestBaseServer):
+    FIXTURES = [
+        join(TestBaseServer.FIXTURES_PATH, "documents", "doc_21.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "transcriptions", "transcription_doc_21_prof1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "translations", "translation_doc_21_prof1.sql"),
+    ]
+
+    def test_add_notes_refs_to_text(self):
+        notes = [{"id": 2, "ptr_start": "6", "ptr_end": "11"}, {"id": 1, "ptr_start": "0", "ptr_end": "5"}]
+        self.assertEqual(
+            BTAG.format(1) + "Hello" + ETAG + " " + BTAG.format(2) + "world" + ETAG + "!",
+            add_notes_refs_to_text("Hello world!", notes)
+        )
+        # the notes are sorted in place
+        self.assertEqual([1, 2], [n["id"] for n in notes])
+        self.assertEqual("text", add_notes_refs_to_text("text", []))
+
+    def test_same_output_as_legacy_implementation(self):
+        rnd = random.Random(1234)
+        for overlapping in (False, True):
+            for _ in range(200):
+                text = make_text(rnd, rnd.randint(0, 200))
+                notes = make_notes(rnd, len(text), rnd.randint(0, 20), 1, overlapping)
+                legacy_notes = copy.deepcopy(notes)
+                self.assertEqual(legacy_add_notes_refs_to_text(text, legacy_notes),
+                                 add_notes_refs_to_text(text, notes))
+                self.assertEqual(legacy_notes, notes)
+
+    def test_add_notes_refs_same_output_as_legacy_implementation(self):
+        self.load_fixtures(TestNotesRefs.FIXTURES)
+        rnd = random.Random(4321)
+        for overlapping in (False, True):
+            for _ in range(50):
+                tr_text = make_text(rnd, rnd.randint(1, 300))
+                tl_text = make_text(rnd, rnd.randint(1, 300))
+                ptrs = make_alignments(rnd, len(tr_text), len(tl_text), rnd.randint(1, 15), overlapping)
+                replace_translation_alignments(21, 21, ptrs)
+                db.session.commit()
+
+                tr = {"id": 21, "content": tr_text,
+                      "notes": make_notes(rnd, len(tr_text), rnd.randint(0, 15), 1, overlapping)}
+                tl = {"id": 21, "content": tl_text,
+                      "notes": make_notes(rnd, len(tl_text), rnd.randint(0, 15), 100, overlapping)}
+                self.assertEqual(legacy_add_notes_refs(copy.deepcopy(tr), copy.deepcopy(tl)),
+                                 add_notes_refs(tr, tl))
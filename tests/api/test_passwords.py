@@ -0,0 +1,104 @@
+import threading
+
+from werkzeug.security import generate_password_hash
+
+from tests.base_server import TestBaseServer, json_loads, make_auth_headers, ADMIN_USER, PROF1_USER
+from app import db
+from app.models import MailOutbox, User
+from app.passwords import PasswordHasher, PasswordHasherBusy
+
+
+class TestPasswords(TestBaseServer):
+
+    def login(self, password):
+        return self.client.post("/api/1.0/login", json={"email": "eleve1@gmail.com", "password": password})
+
+    def test_rehash_on_login(self):
+        user = User.query.get(5)
+        user.password = generate_password_hash("secret", "pbkdf2:sha256:1000")
+        db.session.commit()
+
+        self.assertStatus(self.login("wrong"), 401)
+        self.assertTrue(User.query.get(5).password.startswith("pbkdf2:sha256:1000$"))
+        self.assertStatus(self.login("secret"), 200)
+        db.session.expire_all()
+        self.assertTrue(User.query.get(5).password.startswith(self.app.config["PASSWORD_HASH_METHOD"] + "$"))
+        self.assertStatus(self.login("secret"), 200)
+
+    def test_rehash_rejected_on_login(self):
+        user = User.query.get(5)
+        user.password = generate_password_hash("secret", "pbkdf2:sha256:1000")
+        db.session.commit()
+
+        class RehashRejected(PasswordHasher):
+            def run(self, func, *args):
+                if func is generate_password_hash:
+                    raise PasswordHasherBusy()
+                return super().run(func, *args)
+
+        hasher = RehashRejected(workers=1, queue_size=1, timeout=5)
+        previous, self.app.password_hasher = getattr(self.app, "password_hasher", None), hasher
+        try:
+            # the password is checked: the login succeeds and keeps the old hash
+            r = self.login("secret")
+            self.assertStatus(r, 200)
+            self.assertIn("token", json_loads(r.data))
+            db.session.expire_all()
+            self.assertTrue(User.query.get(5).password.startswith("pbkdf2:sha256:1000$"))
+        finally:
+            self.app.password_hasher = previous
+            hasher.shutdown()
+        self.assertStatus(self.login("secret"), 200)
+        db.session.expire_all()
+        self.assertTrue(User.query.get(5).password.startswith(self.app.config["PASSWORD_HASH_METHOD"] + "$"))
+
+    def test_bounded_pool(self):
+        hasher = PasswordHasher(workers=1, queue_size=1, timeout=5)
+        release = threading.Event()
+        threads = [threading.Thread(target=hasher.run, args=(release.wait,)) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        while hasher.metrics()["running"] + hasher.metrics()["queue_depth"] < 2:
+            release.wait(0.01)
+        # one running, one queued: the next one is rejected
+        self.assertRaises(PasswordHasherBusy, hasher.run, len, "password")
+        metrics = hasher.metrics()
+        self.assertEqual((1, 1, 1), (metrics["running"], metrics["queue_depth"], metrics["rejected"]))
+
+        previous, self.app.password_hasher = getattr(self.app, "password_hasher", None), hasher
+        password = User.query.get(5).password
+        try:
+            r = self.login("secret")
+            self.assertStatus(r, 503)
+            self.assertEqual("1", r.headers["Retry-After"])
+
+            headers = make_auth_headers(PROF1_USER["username"])
+            r = self.client.post("/api/1.0/update-user", headers=headers,
+                                 json={"email": "eleve1@gmail.com", "password": "new", "password2": "new"})
+            self.assertStatus(r, 503)
+            self.assertEqual("1", r.headers["Retry-After"])
+            r = self.client.post("/api/1.0/invite-user", headers=headers, json={"email": "invite@gmail.com"})
+            self.assertStatus(r, 503)
+            self.assertEqual("1", r.headers["Retry-After"])
+        finally:
+            self.app.password_hasher = previous
+            release.set()
+            for thread in threads:
+                thread.join()
+        # neither the user nor the invitation was changed
+        db.session.expire_all()
+        self.assertEqual(password, User.query.get(5).password)
+        self.assertIsNone(User.query.filter(User.email == "invite@gmail.com").first())
+        self.assertEqual(0, MailOutbox.query.count())
+        self.assertEqual(8, hasher.run(len, "password"))
+        metrics = hasher.metrics()
+        self.assertEqual((0, 0, 3), (metrics["running"], metrics["queue_depth"], metrics["completed"]))
+        self.assertGreaterEqual(metrics["max_queue_depth"], 1)
+        self.assertIsNotNone(metrics["hash_ms_p95"])
+        hasher.shutdown()
+
+    def test_metrics(self):
+        self.assert403("/api/1.0/metrics/password-hashing", **PROF1_USER)
+        metrics = json_loads(self.assert200("/api/1.0/metrics/password-hashing", **ADMIN_USER).data)["data"]
+        self.assertEqual(self.app.config["PASSWORD_HASH_WORKERS"], metrics["workers"])
+        self.assertIn("queue_depth", metrics)
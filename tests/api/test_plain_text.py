@@ -0,0 +1,63 @@
+from os.path import join
+
+from app import db
+from app.models import Transcription, Translation, Commentary, SpeechParts
+from app.plain_text import html_to_plain_text, text_to_html, html_to_text, backfill_plain_text, decode_offsets
+from tests.base_server import TestBaseServer, STU1_USER
+
+
+class TestPlainText(TestBaseServer):
+    FIXTURES = [
+        join(TestBaseServer.FIXTURES_PATH, "documents", "doc_21.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "transcriptions", "transcription_doc_21_stu1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "translations", "translation_doc_21_stu1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "commentaries", "commentary_doc_21.sql"),
+    ]
+
+    def test_html_to_plain_text(self):
+        html = "<p>Om<ex>n</ex>ib<ex>us</ex> &amp; <adele-note id='3'>p<ex>re</ex>sentes</adele-note></p>" \
+               "<p>litt<ex>er</ex>as<br/>inspectur<ex>is</ex></p>"
+        plain_text, runs = html_to_plain_text(html)
+        self.assertEqual("Omnibus & presentes\nlitteras\ninspecturis\n", plain_text)
+        self.assertEqual(("", []), html_to_plain_text(None))
+
+        # every char of the plain text maps back to the same char in the html
+        for pos, char in enumerate(plain_text):
+            start = text_to_html(runs, pos)
+            end = text_to_html(runs, pos + 1, end=True)
+            if char == "&":
+                self.assertEqual("&amp;", html[start:end])
+            elif char == "\n":
+                self.assertTrue(html[start:end].startswith("</p>") or html[start:end] == "<br/>")
+            else:
+                self.assertEqual(char, html[start:end])
+            self.assertEqual(pos, html_to_text(runs, start))
+
+        # ranges are mapped tightly, without the surrounding tags
+        start, end = plain_text.index("presentes"), plain_text.index("presentes") + len("presentes")
+        self.assertEqual("p<ex>re</ex>sentes", html[text_to_html(runs, start):text_to_html(runs, end, end=True)])
+
+    def test_plain_text_on_write(self):
+        self.load_fixtures(TestPlainText.FIXTURES)
+        url = "/api/1.0/documents/21/transcriptions/from-user/5"
+        self.assert200(url, method="PUT", data={"data": {"content": "<p>Om<ex>n</ex>ib<ex>us</ex></p>"}},
+                       **STU1_USER)
+        tr = Transcription.query.filter(Transcription.doc_id == 21, Transcription.user_id == 5).first()
+        self.assertEqual("Omnibus\n", tr.plain_text)
+        self.assertEqual(html_to_plain_text(tr.content)[1], decode_offsets(tr.plain_text_offsets))
+
+    def test_backfill(self):
+        self.load_fixtures(TestPlainText.FIXTURES)
+        # rows inserted with raw SQL have no plain text yet
+        self.assertIsNone(Translation.query.first().plain_text)
+
+        models = (Transcription, Translation, Commentary, SpeechParts)
+        counts = backfill_plain_text(db, models, batch_size=2)
+        self.assertEqual({"transcription": 1, "translation": 1, "commentary": 3, "speech_parts": 0}, counts)
+        db.session.expire_all()
+        for model in models:
+            for container in model.query.all():
+                self.assertEqual(html_to_plain_text(container.content)[0], container.plain_text)
+
+        self.assertEqual({"transcription": 0, "translation": 0, "commentary": 0, "speech_parts": 0},
+                         backfill_plain_text(db, models))
@@ -0,0 +1,99 @@
+import contextlib
+import glob
+import io
+import os
+
+from config import TestConfig
+from tests.base_server import TestBaseServer, make_auth_headers, PROF1_USER, STU1_USER
+from app import create_app
+from app.rate_limits import TokenBucketStore
+
+
+class TestRateLimits(TestBaseServer):
+
+    def setUp(self):
+        super().setUp()
+        self.app.config["RATE_LIMIT_ENABLED"] = True
+        self.app.config["RATE_LIMITS"] = {"login": (2, 60), "login_ip": (5, 60), "write": (3, 60), "read": (5, 60)}
+        self.app.rate_limit_store = None
+
+    def tearDown(self):
+        self.app.config["RATE_LIMIT_ENABLED"] = False
+        self.app.config["RATE_LIMIT_STORAGE"] = TestConfig.RATE_LIMIT_STORAGE
+        self.app.rate_limit_store = None
+        for path in glob.glob(self.app.config["RATE_LIMIT_STORAGE"] + "*"):
+            os.remove(path)
+        super().tearDown()
+
+    def login(self, email="eleve1@gmail.com"):
+        return self.client.post("/api/1.0/login", json={"email": email, "password": "wrong"})
+
+    def test_login_budget(self):
+        for i in range(2):
+            self.assertStatus(self.login(), 401)
+        r = self.login()
+        self.assertStatus(r, 429)
+        self.assertEqual("30", r.headers["Retry-After"])
+        # the budgets are separate
+        self.assert404("/api/1.0/documents/20")
+
+    def test_login_budget_by_address(self):
+        # a class logging in from the same address is only limited by the larger budget of the address
+        for email in ("eleve1@gmail.com", "eleve2@gmail.com"):
+            for i in range(2):
+                self.assertStatus(self.login(email), 401)
+        self.assertStatus(self.login("prof1@gmail.com"), 401)
+        r = self.login("prof2@gmail.com")
+        self.assertStatus(r, 429)
+        self.assertEqual("12", r.headers["Retry-After"])
+
+    def test_trusted_proxies(self):
+        TestConfig.TRUSTED_PROXIES = 1
+        try:
+            app = create_app("test")
+        finally:
+            TestConfig.TRUSTED_PROXIES = 0
+        app.config["RATE_LIMIT_ENABLED"] = True
+        app.config["RATE_LIMITS"] = dict(self.app.config["RATE_LIMITS"], read=(1, 60))
+        client = app.test_client()
+        url = "/api/1.0/documents/20"
+        # the clients behind the proxy get buckets of their own
+        for address in ("1.2.3.4", "5.6.7.8"):
+            self.assertStatus(client.get(url, headers={"X-Forwarded-For": address}), 404)
+        self.assertStatus(client.get(url, headers={"X-Forwarded-For": "1.2.3.4"}), 429)
+
+    def test_storage_unavailable(self):
+        self.app.config["RATE_LIMIT_STORAGE"] = os.path.join(TestConfig.DB_PATH, "missing", "rate_limits.sqlite")
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            for i in range(7):
+                self.assert404("/api/1.0/documents/20")
+        self.assertEqual(1, output.getvalue().count("Rate limits unavailable"))
+
+    def test_budgets_by_user(self):
+        url = "/api/1.0/whitelists"
+        for i in range(3):
+            self.assertStatus(self.post(url, {"label": "wl %s" % i}, headers=make_auth_headers(PROF1_USER["username"])),
+                              200)
+        r = self.post(url, {"label": "too many"}, headers=make_auth_headers(PROF1_USER["username"]))
+        self.assertStatus(r, 429)
+        self.assertEqual("20", r.headers["Retry-After"])
+        # another user, on the same address
+        self.assertStatus(self.post(url, {"label": "other"}, headers=make_auth_headers(STU1_USER["username"])), 403)
+        self.assertStatus(self.client.get(url, headers=make_auth_headers(PROF1_USER["username"])), 200)
+
+    def test_shared_store(self):
+        path = self.app.config["RATE_LIMIT_STORAGE"]
+        # two processes see the same buckets
+        first, second = TokenBucketStore(path), TokenBucketStore(path)
+        bucket = [("read:ip:1.2.3.4", 2, 0.5)]
+        self.assertEqual(0, first.take(bucket, now=100))
+        self.assertEqual(0, second.take(bucket, now=100))
+        self.assertEqual(2, first.take(bucket, now=100))
+        self.assertEqual(1, second.take(bucket, now=101))
+        self.assertEqual(0, second.take(bucket, now=102))
+        # no token is taken unless every bucket has one
+        buckets = bucket + [("read:ip:5.6.7.8", 2, 0.5)]
+        self.assertEqual(2, first.take(buckets, now=102))
+        self.assertEqual(0, first.take(buckets[1:], now=102))
+        self.assertEqual(0, first.take(buckets[1:], now=102))
@@ -0,0 +1,131 @@
+import random
+from os.path import join
+
+from tests.base_server import TestBaseServer, json_loads, PROF1_USER
+from app import db
+from app.api.reanchoring import OffsetMap, reanchor_pointers
+from app.models import AlignmentDiscours, AlignmentTranslation, TranscriptionHasNote
+from app.utils import content_hash
+
+CONTENT = '<p>Om<ex>n</ex>ib<ex>us</ex> p<ex>re</ex>sentes litt<ex>er</ex>as inspectur<ex>is</ex></p>'
+TOKENS = ["<p n='%d'>", "</p%d>", "<ex n='%d'>", "&#%d;", "<lb n='%d'/>"]
+
+
+class TestReanchoring(TestBaseServer):
+    FIXTURES = [
+        join(TestBaseServer.FIXTURES_PATH, "documents", "doc_21.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "transcriptions", "transcription_doc_21_prof1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "notes", "notes_transcription_doc_21_prof1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "translations", "translation_doc_21_prof1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "alignments_translation", "alignments_translation_doc_21_prof1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "alignments_discours", "alignments_discours_doc_21_prof1.sql"),
+    ]
+
+    URL = "/api/1.0/documents/21/transcriptions/from-user/4"
+
+    def test_offset_map(self):
+        start, end = CONTENT.index("p<ex>"), CONTENT.index(" litt")
+        # insertion before the range, inside it and at its boundaries
+        new = CONTENT.replace("p<ex>re</ex>sentes", "[p<ex>re</ex>- sentes]").replace("<p>", "<p>Universis ")
+        offset_map = OffsetMap(CONTENT, new)
+        new_start, new_end, collapsed = offset_map.map_range(start, end)
+        self.assertEqual("p<ex>re</ex>- sentes", new[new_start:new_end])
+        self.assertFalse(collapsed)
+        self.assertEqual(len(new), offset_map.map_start(len(CONTENT)))
+        self.assertEqual(0, offset_map.map_end(0))
+
+        # replaced text is kept in the range, deleted text collapses it
+        new = CONTENT.replace("sentes", "sens")
+        offset_map = OffsetMap(CONTENT, new)
+        new_start, new_end, collapsed = offset_map.map_range(start, end)
+        self.assertEqual("p<ex>re</ex>sens", new[new_start:new_end])
+        new = CONTENT.replace("p<ex>re</ex>sentes ", "")
+        new_start, new_end, collapsed = OffsetMap(CONTENT, new).map_range(start, end)
+        self.assertTrue(collapsed)
+        self.assertEqual(new.index("litt"), new_start)
+        self.assertFalse(OffsetMap(CONTENT, new).map_range(start, start)[2])
+
+        # random edits: the pointers keep their order, and the ranges out of the edited part are moved as is
+        # (distinct tokens, so that the diff of each edit is unambiguous)
+        rnd = random.Random(7)
+        for _ in range(200):
+            tokens = [rnd.choice(TOKENS) % idx for idx in range(rnd.randint(0, 40))]
+            edited = list(tokens)
+            pos = rnd.randint(0, len(edited))
+            edited[pos:pos + rnd.randint(0, 3)] = [rnd.choice(TOKENS) % (100 + idx) for idx in range(rnd.randint(0, 3))]
+            old, new = "".join(tokens), "".join(edited)
+            edit_start = len("".join(tokens[:pos]))
+            edit_end = len(old) - len("".join(tokens[pos:])) + len("".join(tokens[pos:pos + 3]))
+            offset_map = OffsetMap(old, new)
+            starts = [offset_map.map_start(p) for p in range(len(old) + 1)]
+            ends = [offset_map.map_end(p) for p in range(len(old) + 1)]
+            self.assertEqual(sorted(starts), starts)
+            self.assertEqual(sorted(ends), ends)
+            for a in range(len(old) + 1):
+                for b in (a, min(len(old), a + 3)):
+                    new_start, new_end, collapsed = offset_map.map_range(a, b)
+                    self.assertTrue(0 <= new_start <= new_end <= len(new))
+                    if b <= edit_start or a >= edit_end:
+                        self.assertEqual(old[a:b], new[new_start:new_end])
+
+    def test_reanchor_notes(self):
+        self.load_fixtures(TestReanchoring.FIXTURES)
+        # two notes of the same note moved onto the same range are merged
+        db.session.add(TranscriptionHasNote(transcription_id=21, note_id=100001, ptr_start=3, ptr_end=15))
+        db.session.commit()
+        new = "<p>Sciant " + CONTENT[3:].replace("<ex>n</ex>", "", 1)
+        report = reanchor_pointers('transcription', 21, CONTENT, new)
+        db.session.commit()
+
+        notes = TranscriptionHasNote.query.filter(TranscriptionHasNote.transcription_id == 21).all()
+        self.assertEqual([(100001, 10, 12), (100002, 12, 12), (100003, 12, 14)],
+                         sorted((n.note_id, n.ptr_start, n.ptr_end) for n in notes))
+        self.assertEqual([{"table": "transcription_has_note", "transcription_id": 21, "note_id": 100002,
+                           "ptr_start": 12, "ptr_end": 12}],
+                         [c for c in report["collapsed"] if c["table"] == "transcription_has_note"])
+        self.assertEqual({"moved": 0, "collapsed": []}, reanchor_pointers('transcription', 21, new, new))
+
+    def test_reanchor_on_save(self):
+        self.load_fixtures(TestReanchoring.FIXTURES)
+        prefix = "Universis et singulis. "
+        new = "<p>" + prefix + CONTENT[3:]
+        r = self.assert200(self.URL, method="PUT", data={"data": {"content": new}}, **PROF1_USER)
+        self.assertEqual(9, json_loads(r.data)["data"]["reanchoring"]["moved"])
+
+        shift = len(prefix)
+        alignments = AlignmentTranslation.query.filter(AlignmentTranslation.transcription_id == 21).all()
+        self.assertEqual([(3 + shift, 11 + shift, 3, 15), (11 + shift, 21 + shift, 15, 25),
+                          (21 + shift, 31 + shift, 25, 35)],
+                         sorted((al.ptr_transcription_start, al.ptr_transcription_end,
+                                 al.ptr_translation_start, al.ptr_translation_end) for al in alignments))
+        speech_parts = AlignmentDiscours.query.filter(AlignmentDiscours.transcription_id == 21).all()
+        self.assertEqual([(3 + shift, 7 + shift), (7 + shift, 19 + shift), (20 + shift, 31 + shift)],
+                         sorted((sp.ptr_start, sp.ptr_end) for sp in speech_parts))
+
+        # deleting "ib" collapses nothing but shortens the ranges around it
+        offset = new.index("ib<ex>")
+        r = self.assert200(self.URL, method="PATCH", data={"data": {
+            "base": content_hash(new), "edits": [{"offset": offset, "length": 2, "replacement": ""}]
+        }}, **PROF1_USER)
+        self.assertEqual([], json_loads(r.data)["data"]["reanchoring"]["collapsed"])
+        speech_parts = AlignmentDiscours.query.filter(AlignmentDiscours.transcription_id == 21).all()
+        self.assertEqual([(3 + shift, 7 + shift), (7 + shift, 17 + shift), (18 + shift, 29 + shift)],
+                         sorted((sp.ptr_start, sp.ptr_end) for sp in speech_parts))
+
+    def test_reanchor_on_restore(self):
+        self.load_fixtures(TestReanchoring.FIXTURES)
+        prefix = "Universis et singulis. "
+        self.assert200(self.URL, method="PUT", data={"data": {"content": "<p>Sciant " + CONTENT[3:]}}, **PROF1_USER)
+        self.assert200(self.URL, method="PUT", data={"data": {"content": "<p>" + prefix + CONTENT[3:]}},
+                       **PROF1_USER)
+
+        # back to "Sciant ": the pointers follow the restored content
+        r = self.assert200(self.URL + "/revisions/1/restore", method="POST", **PROF1_USER)
+        self.assertTrue(json_loads(r.data)["data"]["reanchoring"]["moved"])
+        shift = len("Sciant ")
+        alignments = AlignmentTranslation.query.filter(AlignmentTranslation.transcription_id == 21).all()
+        self.assertEqual([(3 + shift, 11 + shift), (11 + shift, 21 + shift), (21 + shift, 31 + shift)],
+                         sorted((al.ptr_transcription_start, al.ptr_transcription_end) for al in alignments))
+        speech_parts = AlignmentDiscours.query.filter(AlignmentDiscours.transcription_id == 21).all()
+        self.assertEqual([(3 + shift, 7 + shift), (7 + shift, 19 + shift), (20 + shift, 31 + shift)],
+                         sorted((sp.ptr_start, sp.ptr_end) for sp in speech_parts))
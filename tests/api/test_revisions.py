@@ -0,0 +1,109 @@
+from os.path import join
+
+from app import db
+from app.api.revisions.revision_store import make_delta, apply_delta, record_revision, materialize_revision, \
+    compact_revisions, get_revisions_query
+from app.models import ContentRevision
+from tests.base_server import TestBaseServer, json_loads, STU1_USER, PROF1_USER, STU2_USER
+
+
+class TestRevisionsAPI(TestBaseServer):
+    FIXTURES = [
+        join(TestBaseServer.FIXTURES_PATH, "documents", "doc_21.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "transcriptions", "transcription_doc_21_stu1.sql"),
+        join(TestBaseServer.FIXTURES_PATH, "notes", "notes_transcription_doc_21_stu1.sql"),
+    ]
+
+    def test_delta(self):
+        old = "<p>Om<ex>n</ex>ib<ex>us</ex> p<ex>re</ex>sentes litt<ex>er</ex>as inspectur<ex>is</ex></p>"
+        for new in (
+            old,
+            "",
+            old.replace("sentes", "SENTES"),
+            "<p>Incipit</p>" + old,
+            old + "<p>Explicit</p>",
+            old.replace("<ex>us</ex>", ""),
+        ):
+            self.assertEqual(new, apply_delta(old, make_delta(old, new)))
+            self.assertEqual(old, apply_delta(new, make_delta(new, old)))
+
+        # the delta size depends on the edit, not on the content
+        long_text = "<p>%s</p>" % ("lorem ipsum dolor " * 5000)
+        edited = long_text[:40000] + "sit amet" + long_text[40000:]
+        delta = make_delta(long_text, edited)
+        self.assertEqual([40000, "sit amet", len(long_text) - 40000], delta)
+
+    def test_record_and_materialize(self):
+        self.load_fixtures(TestRevisionsAPI.FIXTURES)
+        self.app.config["REVISION_SNAPSHOT_INTERVAL"] = 3
+
+        contents = ["<p>version %s %s</p>" % (i, "x" * 200) for i in range(8)]
+        previous = None
+        for content in contents:
+            record_revision('transcription', 21, 5, content, previous_content=previous, author_id=5)
+            db.session.commit()
+            previous = content
+
+        revisions = get_revisions_query('transcription', 21, 5).order_by(ContentRevision.revision).all()
+        self.assertEqual(list(range(1, 9)), [r.revision for r in revisions])
+        self.assertEqual([True, False, False, True, False, False, True, False], [r.is_snapshot for r in revisions])
+
+        for num, content in enumerate(contents, start=1):
+            self.assertEqual(content, materialize_revision('transcription', 21, 5, num))
+        self.assertIsNone(materialize_revision('transcription', 21, 5, 9))
+
+        # saving the same content twice does not make a new revision
+        self.assertIsNone(record_revision('transcription', 21, 5, contents[-1], previous_content=contents[-1]))
+
+        # an unknown previous content forces a snapshot
+        rev = record_revision('transcription', 21, 5, "<p>new</p>" + "y" * 100, previous_content="<p>other</p>")
+        self.assertTrue(rev.is_snapshot)
+
+    def test_compact_revisions(self):
+        self.load_fixtures(TestRevisionsAPI.FIXTURES)
+        self.app.config["REVISION_SNAPSHOT_INTERVAL"] = 4
+
+        contents = ["<p>version %s %s</p>" % (i, "x" * 200) for i in range(10)]
+        previous = None
+        for content in contents:
+            record_revision('transcription', 21, 5, content, previous_content=previous)
+            db.session.commit()
+            previous = content
+
+        self.assertEqual(7, compact_revisions(keep_last=3))
+        revisions = get_revisions_query('transcription', 21, 5).order_by(ContentRevision.revision).all()
+        self.assertEqual([8, 9, 10], [r.revision for r in revisions])
+        self.assertTrue(revisions[0].is_snapshot)
+        for num in (8, 9, 10):
+            self.assertEqual(contents[num - 1], materialize_revision('transcription', 21, 5, num))
+
+        # revisions are still numbered after the compaction
+        record_revision('transcription', 21, 5, "<p>last</p>", previous_content=contents[-1])
+        db.session.commit()
+        self.assertEqual("<p>last</p>", materialize_revision('transcription', 21, 5, 11))
+
+    def test_revisions_api(self):
+        self.load_fixtures(TestRevisionsAPI.FIXTURES)
+
+        url = "/api/1.0/documents/21/transcriptions/from-user/5"
+        for content in ("<p>first</p>", "<p>first and second</p>"):
+            self.assert200(url, method="PUT", data={"data": {"content": content}}, **STU1_USER)
+
+        r = self.assert200(url + "/revisions", **STU1_USER)
+        r = json_loads(r.data)['data']
+        self.assertEqual([2, 1], [rev['revision'] for rev in r])
+
+        self.assert403(url + "/revisions", **STU2_USER)
+        self.assert200(url + "/revisions", **PROF1_USER)
+
+        r = self.assert200(url + "/revisions/1", **STU1_USER)
+        self.assertEqual("<p>first</p>", json_loads(r.data)['data']['content'])
+        self.assert404(url + "/revisions/3", **STU1_USER)
+
+        # only teachers can restore a revision
+        self.assert403(url + "/revisions/1/restore", method="POST", **STU1_USER)
+        r = self.assert200(url + "/revisions/1/restore", method="POST", **PROF1_USER)
+        self.assertEqual("<p>first</p>", json_loads(r.data)['data']['content'])
+
+        r = self.assert200(url + "/revisions", **STU1_USER)
+        self.assertEqual(3, json_loads(r.data)['data'][0]['revision'])
@@ -37,3 +37,79 @@ class TestSpeechPartsAPI(TestBaseServer):
         r = json_loads(r.data)['data']
 
         self.assertEqual(3, len(r['notes']))
+
+    def test_speech_parts_stats(self):
+        from app.api.speech_parts.speech_part_stats import rebuild_speech_part_stats
+
+        self.load_fixtures(TestSpeechPartsAPI.FIXTURES)
+        self.assert401("/api/1.0/documents/21/speech-parts-stats")
+        self.assert404("/api/1.0/documents/999/speech-parts-stats", **PROF1_USER)
+        r = json_loads(self.assert200("/api/1.0/documents/21/speech-parts-stats", **PROF1_USER).data)["data"]
+        self.assertEqual({"types": [], "users": []}, r)
+
+        # the speech parts aligned on the transcription by the teacher
+        self.assertEqual(1, rebuild_speech_part_stats())
+        db.session.commit()
+        r = json_loads(self.assert200("/api/1.0/documents/21/speech-parts-stats", **PROF1_USER).data)["data"]
+        self.assertEqual([(1, "adresse_universelle", 1, 2), (2, "suscription", 1, 3), (3, "salut", 1, 4)],
+                         [(t["speech_part_type_id"], t["label"], t["nb"], t["length"]) for t in r["types"]])
+        self.assertEqual([(4, "Professeur1")], [(u["user_id"], u["username"]) for u in r["users"]])
+
+        # the speech parts marked by a student in the speech parts content
+        self.assert200("/api/1.0/documents/21/validate-transcription", **PROF1_USER)
+        url = "/api/1.0/documents/21/speech-parts-content/from-user/5"
+        self.assert200(url, method="POST", **STU1_USER)
+        content = '<p><adele-speechpart type="2">Omnibus</adele-speechpart> ' \
+                  '<adele-speechpart type="2">p<ex>re</ex>sentes</adele-speechpart> ' \
+                  '<adele-speechpart type="5">litt<ex>er</ex>as <adele-speechpart type="1">inspecturis' \
+                  '</adele-speechpart></adele-speechpart></p>'
+        self.assert200(url, method="PUT", data={"data": {"content": content}}, **STU1_USER)
+
+        r = json_loads(self.assert200("/api/1.0/documents/21/speech-parts-stats", **PROF1_USER).data)["data"]
+        self.assertEqual([4, 5], [u["user_id"] for u in r["users"]])
+        self.assertEqual([(1, 1, 11), (2, 2, 16), (5, 1, 20)],
+                         [(t["speech_part_type_id"], t["nb"], t["length"]) for t in r["users"][1]["types"]])
+        self.assertEqual({"speech_part_type_id": 2, "label": "suscription", "nb": 3, "length": 19,
+                          "mean_length": 6.3, "max_length": 9, "nb_users": 2}, r["types"][1])
+
+        # students only get their own speech parts
+        r = json_loads(self.assert200("/api/1.0/documents/21/speech-parts-stats", **STU1_USER).data)["data"]
+        self.assertEqual([5], [u["user_id"] for u in r["users"]])
+        r = json_loads(self.assert200("/api/1.0/speech-parts-stats", **PROF1_USER).data)["data"]
+        self.assertEqual([(1, 2, 13, 1), (2, 3, 19, 1), (3, 1, 4, 1), (5, 1, 20, 1)],
+                         [(t["speech_part_type_id"], t["nb"], t["length"], t["nb_docs"]) for t in r])
+
+        # a transcription edit moves the aligned speech parts and changes their lengths
+        self.assert200("/api/1.0/documents/21/unvalidate-transcription", **PROF1_USER)
+        tr_url = "/api/1.0/documents/21/transcriptions/from-user/4"
+        tr = json_loads(self.assert200(tr_url, **PROF1_USER).data)["data"]
+        content = tr["content"].replace("ib<ex>", "ibus et ib<ex>")
+        self.assert200(tr_url, method="PUT", data={"data": {"content": content}}, **PROF1_USER)
+        r = json_loads(self.assert200("/api/1.0/documents/21/speech-parts-stats", **PROF1_USER).data)["data"]
+        self.assertEqual([(1, 2), (2, 11), (3, 4)],
+                         [(t["speech_part_type_id"], t["length"]) for t in r["users"][0]["types"]])
+
+        self.assert200(url, method="DELETE", **PROF1_USER)
+        r = json_loads(self.assert200("/api/1.0/documents/21/speech-parts-stats", **PROF1_USER).data)["data"]
+        self.assertEqual([4], [u["user_id"] for u in r["users"]])
+
+    def test_speech_parts_stats_single_source(self):
+        self.load_fixtures(TestSpeechPartsAPI.FIXTURES)
+        self.assert200("/api/1.0/documents/21/validate-transcription", **PROF1_USER)
+        stats_url = "/api/1.0/documents/21/speech-parts-stats"
+
+        # a speech parts content without any speech part: the alignments are counted
+        url = "/api/1.0/documents/21/speech-parts-content/from-user/4"
+        self.assert200(url, method="POST", **PROF1_USER)
+        r = json_loads(self.assert200(stats_url, **PROF1_USER).data)["data"]
+        self.assertEqual([(1, 1, 2), (2, 1, 3), (3, 1, 4)],
+                         [(t["speech_part_type_id"], t["nb"], t["length"]) for t in r["users"][0]["types"]])
+
+        # the same speech parts marked in the content are not counted twice
+        content = '<p><adele-speechpart type="1">Om</adele-speechpart>' \
+                  '<adele-speechpart type="2">nib</adele-speechpart>' \
+                  '<adele-speechpart type="3">us p</adele-speechpart>resentes</p>'
+        self.assert200(url, method="PUT", data={"data": {"content": content}}, **PROF1_USER)
+        r = json_loads(self.assert200(stats_url, **PROF1_USER).data)["data"]
+        self.assertEqual([(1, 1, 2), (2, 1, 3), (3, 1, 4)],
+                         [(t["speech_part_type_id"], t["nb"], t["length"]) for t in r["types"]])
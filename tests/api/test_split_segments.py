@@ -0,0 +1,98 @@
+import glob
+import os
+import re
+
+from bs4 import BeautifulSoup
+
+from tests.base_server import TestBaseServer
+from app.api.alignments.alignments_translation import split_segments, SEGMENT_REGEX
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+SEG = '<adele-segment></adele-segment>'
+
+
+def legacy_split_segments(html):
+    """ the DOM based implementation split_segments() replaced, used as a reference """
+    def build_segment(str_segment, tags_to_reopen, tags_to_close):
+        segment_parts = []
+        for tag in tags_to_reopen:
+            segment_parts.append(f"<{tag['name']}")
+            for name, value in tag["attr"].items():
+                segment_parts.append(f' {name}="{value}"')
+            segment_parts.append(">")
+        segment_parts.append(str_segment)
+        for tag in tags_to_close:
+            segment_parts.append(f"</{tag['name']}>")
+        return "".join(segment_parts)
+
+    dom = BeautifulSoup(html, "html.parser")
+    raw_segments = SEGMENT_REGEX.split(html)
+    segments = []
+    tags_to_reopen = []
+    for idx, segment in enumerate(dom.find_all("adele-segment")):
+        encountered_tags = []
+        for tag in segment.parents:
+            if not tag or type(tag) == BeautifulSoup:
+                continue
+            encountered_tags.append({"name": tag.name, "attr": tag.attrs})
+        segments.append(build_segment(raw_segments[idx], tags_to_reopen[::-1], encountered_tags))
+        tags_to_reopen = encountered_tags
+    segments.append(build_segment(raw_segments[-1], tags_to_reopen[::-1], []))
+    return segments
+
+
+def fix_multi_valued_attributes(html):
+    """ the legacy implementation rendered the multi-valued attributes (class...) as python lists """
+    return re.sub(r'="\[((?:\'[^\']*\'(?:, )?)*)\]"',
+                  lambda m: '="%s"' % " ".join(re.findall(r"'([^']*)'", m.group(1))), html)
+
+
+def make_contents(text):
+    """ build segmented contents from a fixture text """
+    # one segment per line, paragraphs with attributes
+    by_line = '<div id="d1" title="a &amp; b"><p class="first line">%s</p></div>' % \
+              text.replace("\n\n", "</p><P CLASS='next'>").replace("\n", SEG)
+    # segments at arbitrary places, inside the inline tags too
+    outside_tags = []
+    in_tag = False
+    for pos, char in enumerate(by_line):
+        if char == "<":
+            in_tag = True
+        elif char == ">":
+            in_tag = False
+        elif not in_tag and pos % 37 == 0:
+            outside_tags.append(pos)
+    parts = []
+    last = 0
+    for pos in outside_tags:
+        parts.append(by_line[last:pos])
+        parts.append(SEG)
+        last = pos
+    parts.append(by_line[last:])
+    return by_line, "".join(parts)
+
+
+class TestSplitSegments(TestBaseServer):
+
+    def test_split_segments(self):
+        html = '<p>a<ex>b' + SEG + 'c</ex>d' + SEG + 'e<br/>f<hi rend="sup">g</hi></p>'
+        self.assertEqual(
+            ['<p>a<ex>b</ex></p>', '<p><ex>c</ex>d</p>', '<p>e<br/>f<hi rend="sup">g</hi></p>'],
+            split_segments(html)
+        )
+        self.assertEqual(["<p>no segment</p>"], split_segments("<p>no segment</p>"))
+        self.assertEqual([""], split_segments(""))
+        # multi-valued attributes are reopened as they were written
+        self.assertEqual(['<p class="a b">x</p>', '<p class="a b">y</p>'],
+                         split_segments('<p class="a b">x' + SEG + 'y</p>'))
+
+    def test_same_output_as_legacy_implementation(self):
+        files = sorted(glob.glob(os.path.join(DATA_PATH, 'transcription', '*.txt')) +
+                       glob.glob(os.path.join(DATA_PATH, 'translation', '*.txt')))
+        self.assertTrue(files)
+        for filename in files:
+            with open(filename) as f:
+                text = f.read()
+            for html in make_contents(text):
+                expected = [fix_multi_valued_attributes(s) for s in legacy_split_segments(html)]
+                self.assertEqual(expected, split_segments(html), filename)
@@ -2,7 +2,10 @@ from os.path import join
 
 import unittest
 
-from tests.base_server import TestBaseServer, json_loads, ADMIN_USER, PROF1_USER, STU1_USER
+from tests.base_server import TestBaseServer, json_loads, make_auth_headers, ADMIN_USER, PROF1_USER, STU1_USER
+from app import db
+from app.token_versions import forget_token_versions
+from config import Config
 
 
 class TestUsersAPI(TestBaseServer):
@@ -19,6 +22,60 @@ class TestUsersAPI(TestBaseServer):
         r = self.get_with_auth("/api/1.0/user", **PROF1_USER)
         self.assertEqual("Professeur1", json_loads(r.data)["data"][0]["username"])
 
+    @staticmethod
+    def user_lookups(statements):
+        return [s for s in statements if "user.email = " in s]
+
+    def test_current_user_loaded_once_per_request(self):
+        self.load_fixtures([
+            join(TestBaseServer.FIXTURES_PATH, "documents", "doc_21.sql"),
+            join(TestBaseServer.FIXTURES_PATH, "transcriptions", "transcription_doc_21_prof1.sql"),
+        ])
+        self.assert200("/api/1.0/documents/21/validate-transcription", **PROF1_USER)
+
+        url = "/api/1.0/documents/21/transcriptions/speech-parts/from-user/4"
+        prof_headers = make_auth_headers(PROF1_USER["username"])
+        student_headers = make_auth_headers(STU1_USER["username"])
+        with self.recorded_statements() as statements:
+            # the permission helpers and the view all ask for the current user
+            self.assertStatus(self.patch(url, {"data": [[3, 7, 1]]}, headers=prof_headers), 200)
+            self.assertEqual(1, len(self.user_lookups(statements)))
+            # its roles are loaded by the same query
+            self.assertEqual(self.user_lookups(statements), [s for s in statements if "user_has_role" in s])
+
+            del statements[:]
+            self.assertStatus(self.patch(url, {"data": [[3, 7, 1]]}, headers=student_headers), 403)
+            self.assertEqual(1, len(self.user_lookups(statements)))
+
+    def test_read_only_requests_trust_the_token_claims(self):
+        forget_token_versions()
+        student_headers = make_auth_headers(STU1_USER["username"])
+        with self.recorded_statements() as statements:
+            self.assertStatus(self.get("/api/1.0/users/4/roles", headers=student_headers), 403)
+            self.assertStatus(self.get("/api/1.0/users/5/roles", headers=student_headers), 200)
+            self.assertEqual([], self.user_lookups(statements))
+
+        # the claims of the tokens issued before a role change are no longer trusted
+        self.assert200("/api/1.0/users/5/roles", method="POST", data={"data": [{"name": "teacher"}]}, **ADMIN_USER)
+        with self.recorded_statements() as statements:
+            self.assertStatus(self.get("/api/1.0/users/4/roles", headers=student_headers), 200)
+            self.assertEqual(1, len(self.user_lookups(statements)))
+        with self.recorded_statements() as statements:
+            self.assertStatus(self.get("/api/1.0/users/4/roles", headers=make_auth_headers("Eleve1")), 200)
+            self.assertEqual([], self.user_lookups(statements))
+
+        # nor the ones of a deleted user
+        self.assert200("/api/1.0/users/5", method="DELETE", **ADMIN_USER)
+        self.assertStatus(self.get("/api/1.0/users/5/roles", headers=student_headers), 403)
+
+        self.app.config["JWT_ROLE_CLAIMS_TTL"] = 0
+        try:
+            with self.recorded_statements() as statements:
+                self.assertStatus(self.get("/api/1.0/users/4/roles", headers=make_auth_headers("Professeur1")), 200)
+                self.assertEqual(1, len(self.user_lookups(statements)))
+        finally:
+            self.app.config["JWT_ROLE_CLAIMS_TTL"] = Config.JWT_ROLE_CLAIMS_TTL
+
     def test_get_user_from_id(self):
         self.assert401("/api/1.0/users/1")
         self.assert404("/api/1.0/users/100", **ADMIN_USER)
@@ -28,6 +85,42 @@ class TestUsersAPI(TestBaseServer):
         r = self.get_with_auth("/api/1.0/users/4", **PROF1_USER)
         self.assertEqual("Professeur1", json_loads(r.data)["data"][0]["username"])
 
+    def test_users_by_role(self):
+        def usernames(url, user=PROF1_USER):
+            r = json_loads(self.assert200(url, **user).data)["data"]
+            return r["total"], [u["username"] for u in r["users"]]
+
+        self.assert403("/api/1.0/teachers", **STU1_USER)
+        teachers = ["AdminJulien", "AdminMorgan", "AdminVincent", "Professeur1", "Professeur2", "Professeur3"]
+        self.assertEqual((6, teachers), usernames("/api/1.0/teachers"))
+        self.assertEqual((6, teachers[2:4]), usernames("/api/1.0/teachers?num-page=2&page-size=2"))
+        self.assertEqual((3, teachers[3:]), usernames("/api/1.0/teachers?search=PROF"))
+
+        # the admins are students too
+        self.assertEqual((6, ["AdminJulien", "AdminVincent", "AdminMorgan", "Eleve1", "Eleve2", "Eleve3"]),
+                         usernames("/api/1.0/users?role=student&sort-by=id.desc"))
+        self.assertEqual((3, ["Eleve1", "Eleve2", "Eleve3"]), usernames("/api/1.0/users?role=student&search=eleve"))
+        self.assertEqual((1, ["Eleve2"]), usernames("/api/1.0/users?search=elve"))
+        self.assertEqual((1, ["AdminMorgan"]), usernames("/api/1.0/users?search=MORGANLEGAL@"))
+        self.assertEqual((2, ["Eleve1", "Eleve2"]), usernames("/api/1.0/users?whitelist-id=1"))
+        self.assertEqual((2, ["Eleve1"]), usernames("/api/1.0/users?whitelist-id=2&search=Ele&role=student&page-size=1"))
+        self.assertEqual((0, []), usernames("/api/1.0/users?whitelist-id=1&role=teacher"))
+
+        # the role filter and the search use the indexes
+        from app.api.users.routes import filter_users
+        from app.models import User
+
+        def query_plan(**filters):
+            query = filter_users(User.query.with_entities(User.id), **filters)
+            return " ".join(str(row) for row in db.session.execute("EXPLAIN QUERY PLAN " + str(
+                query.statement.compile(db.engine, compile_kwargs={"literal_binds": True}))))
+
+        self.assertIn("ix_user_has_role_role_id", query_plan(role="teacher"))
+        plan = query_plan(search="prof")
+        for index in ("ix_user_username_nocase", "ix_user_email_nocase", "ix_user_firstname_nocase",
+                      "ix_user_lastname_nocase"):
+            self.assertIn(index, plan)
+
     def test_get_user_roles(self):
         self.assert401("/api/1.0/users/4/roles")
         self.assert403("/api/1.0/users/4/roles", **STU1_USER)
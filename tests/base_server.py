@@ -1,9 +1,11 @@
 import os
 import sys
 import json
+from contextlib import contextmanager
 
 from flask_testing import TestCase
 from os.path import join
+from sqlalchemy import event
 
 from app import create_app, db
 
@@ -74,6 +76,20 @@ class TestBaseServer(TestCase):
                         connection.execute(_s, multi=True)
                         trans.commit()
 
+    @contextmanager
+    def recorded_statements(self):
+        """ the SQL statements run in the block """
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+
     def get(self, url, **kwargs):
         return self.client.get(url, follow_redirects=True, **kwargs)
 
@@ -92,6 +108,12 @@ class TestBaseServer(TestCase):
     def put_with_auth(self, url, data, username):
         return self.put(url, data, headers=make_auth_headers(username))
 
+    def patch(self, url, data, **kwargs):
+        return self.client.patch(url, data=json.dumps(data), follow_redirects=True, **kwargs)
+
+    def patch_with_auth(self, url, data, username):
+        return self.patch(url, data, headers=make_auth_headers(username))
+
     def delete(self, url, **kwargs):
         return self.client.delete(url, follow_redirects=True, **kwargs)
 
@@ -120,6 +142,11 @@ class TestBaseServer(TestCase):
                 r = self.put_with_auth(url, data=kwargs.get('data', {}), username=kwargs["username"])
             else:
                 r = self.put(url, data=kwargs.get('data', {}))
+        elif method == "PATCH":
+            if with_auth:
+                r = self.patch_with_auth(url, data=kwargs.get('data', {}), username=kwargs["username"])
+            else:
+                r = self.patch(url, data=kwargs.get('data', {}))
         else:
             raise NotImplementedError
 
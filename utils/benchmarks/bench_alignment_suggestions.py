@@ -0,0 +1,58 @@
+"""
+Benchmark of the alignment suggestions on a long charter built from the parallel test texts
+(tests/data/transcription/*.txt and tests/data/translation/*.txt).
+
+usage: python utils/benchmarks/bench_alignment_suggestions.py [--words N] [--repeat N]
+"""
+import argparse
+import glob
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+from app.alignment_suggestions import suggest_alignments  # noqa: E402
+from app.plain_text import html_to_plain_text  # noqa: E402
+
+DATA_PATH = os.path.join(ROOT, 'tests', 'data')
+
+
+def to_html(text):
+    return "".join("<p>%s</p>" % block.replace("\n", " ") for block in text.split("\n\n"))
+
+
+def make_charter(words):
+    names = sorted((os.path.basename(f)[:-4] for f in glob.glob(os.path.join(DATA_PATH, 'transcription', '*.txt'))),
+                   key=int)
+    src, tgt = [], []
+    count = 0
+    for name in names:
+        if count >= words:
+            break
+        with open(os.path.join(DATA_PATH, 'transcription', name + '.txt')) as f:
+            src.append(f.read())
+        with open(os.path.join(DATA_PATH, 'translation', name + '.txt')) as f:
+            tgt.append(f.read())
+        count += len(src[-1].split())
+    return count, to_html("\n\n".join(src)), to_html("\n\n".join(tgt))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--words", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    words, src_html, tgt_html = make_charter(args.words)
+    src_text, src_runs = html_to_plain_text(src_html)
+    tgt_text, tgt_runs = html_to_plain_text(tgt_html)
+    print("transcription: %s words, %s characters" % (words, len(src_html)))
+
+    for label, src, tgt in (("paragraphs", src_text, tgt_text),
+                            ("single block", src_text.replace("\n", " "), tgt_text.replace("\n", " "))):
+        ptrs = suggest_alignments(src, src_runs, tgt, tgt_runs)
+        duration = min(timeit.repeat(lambda: suggest_alignments(src, src_runs, tgt, tgt_runs),
+                                     number=1, repeat=args.repeat))
+        print("%-12s %4s alignments %8.1f ms" % (label, len(ptrs), duration * 1000))
@@ -0,0 +1,82 @@
+"""
+Benchmark of the encoding of the largest responses: indented json.dumps (previous implementation)
+against the compact json module and compact orjson (when installed).
+The payloads are a page of documents of the search and a page of users, built from
+the fixtures of the tests.
+
+Runs against the test database (config "test"), which is recreated.
+
+usage: python utils/benchmarks/bench_json_responses.py [--page-size N] [--repeat N]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+from app import create_app, db  # noqa: E402
+from app.api.json_encoder import make_json_dumps, orjson  # noqa: E402
+
+FIXTURES_PATH = os.path.join(ROOT, 'tests', 'data', 'fixtures')
+FIXTURES = [
+    os.path.join(FIXTURES_PATH, "users", "default_users.sql"),
+    os.path.join(FIXTURES_PATH, "refs.sql"),
+    os.path.join(FIXTURES_PATH, "documents", "doc_20.sql"),
+    os.path.join(FIXTURES_PATH, "documents", "doc_21.sql"),
+    os.path.join(FIXTURES_PATH, "documents", "doc_22.sql"),
+    os.path.join(FIXTURES_PATH, "documents", "doc_23.sql"),
+]
+
+
+def load_fixtures():
+    with db.engine.connect() as connection:
+        for fixture in FIXTURES:
+            with open(fixture) as f:
+                for _s in f.readlines():
+                    trans = connection.begin()
+                    connection.execute(_s, multi=True)
+                    trans.commit()
+
+
+def legacy_dumps(r):
+    return json.dumps(r, indent=2, ensure_ascii=False, default=str)
+
+
+def make_payloads(page_size):
+    from app.models import Document, User
+    documents = [d.serialize() for d in Document.query.all()]
+    users = [u.serialize() for u in User.query.all()]
+    return {
+        "documents (page of %s)" % page_size: {"data": (documents * page_size)[:page_size]},
+        "users (page of %s)" % page_size: {"data": (users * page_size)[:page_size]},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    encoders = [("indented json", legacy_dumps), ("compact json", make_json_dumps("json"))]
+    if orjson is not None:
+        encoders.append(("compact orjson", make_json_dumps("orjson")))
+
+    app = create_app("test")
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        load_fixtures()
+        with app.test_request_context():
+            for name, payload in make_payloads(args.page_size).items():
+                print(name)
+                for encoder_name, dumps in encoders:
+                    output = dumps(payload)
+                    size = len(output if isinstance(output, bytes) else output.encode("utf-8"))
+                    timing = min(timeit.repeat(lambda: dumps(payload), number=10, repeat=args.repeat)) / 10
+                    print("    %-15s %8.2f ms %9s bytes" % (encoder_name, timing * 1000, size))
+        db.session.remove()
+        db.drop_all()
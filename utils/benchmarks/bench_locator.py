@@ -0,0 +1,59 @@
+"""
+Benchmark of the TagAwareLocator offset mapping and phrase search on a long content,
+against the one-off mapping functions of app.plain_text which rebuild their search keys at each call.
+
+usage: python utils/benchmarks/bench_locator.py [--words N] [--queries N]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "utils", "benchmarks"))
+
+from app.locator import TagAwareLocator  # noqa: E402
+from app.plain_text import html_to_plain_text, text_to_html  # noqa: E402
+from bench_alignment_suggestions import make_charter  # noqa: E402
+
+
+def timed(label, func, count):
+    start = time.perf_counter()
+    func()
+    duration = time.perf_counter() - start
+    print("%-28s %8.1f ms  (%.1f µs per query)" % (label, duration * 1000, duration * 1e6 / count))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--words", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    words, html, _ = make_charter(args.words)
+    text, runs = html_to_plain_text(html)
+    rnd = random.Random(0)
+    positions = [rnd.randint(0, len(text)) for _ in range(args.queries)]
+    print("content: %s words, %s characters, %s runs" % (words, len(html), len(runs)))
+
+    timed("plain_text.text_to_html", lambda: [text_to_html(runs, pos) for pos in positions], len(positions))
+    start = time.perf_counter()
+    locator = TagAwareLocator(text, runs)
+    print("%-28s %8.1f ms" % ("locator", (time.perf_counter() - start) * 1000))
+    timed("locator.to_html", lambda: [locator.to_html(pos) for pos in positions], len(positions))
+
+    text_words = text.split()
+    phrases = []
+    for _ in range(200):
+        i = rnd.randint(0, len(text_words) - 6)
+        phrase = text_words[i:i + 6]
+        # one word altered out of two phrases
+        if rnd.random() < 0.5:
+            phrase[2] = phrase[2][:-1] + "x"
+        phrases.append(" ".join(phrase))
+    timed("locator.find (first, indexes)", lambda: locator.find(phrases[0]), 1)
+    found = []
+    timed("locator.find", lambda: found.extend(locator.find(phrase) for phrase in phrases), len(phrases))
+    print("%s/%s phrases found" % (sum(1 for f in found if f is not None), len(phrases)))
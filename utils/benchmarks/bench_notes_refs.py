@@ -0,0 +1,63 @@
+"""
+Benchmark of add_notes_refs() and add_notes_refs_to_text() against the implementations they replaced,
+on a text with hundreds of notes and alignments.
+
+Runs against the test database (config "test"), which is recreated.
+
+usage: python utils/benchmarks/bench_notes_refs.py [--notes N] [--alignments N] [--repeat N]
+"""
+import argparse
+import copy
+import os
+import random
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tests", "api"))
+
+from test_notes_refs import legacy_add_notes_refs, legacy_add_notes_refs_to_text, make_text, make_notes, \
+    make_alignments  # noqa: E402
+from app import db  # noqa: E402
+from app.api.alignments.alignments_translation import add_notes_refs, replace_translation_alignments  # noqa: E402
+from app.api.transcriptions.routes import add_notes_refs_to_text  # noqa: E402
+
+sys.path.insert(0, os.path.join(ROOT, "utils", "benchmarks"))
+from bench_translation_alignments import load_fixtures  # noqa: E402
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--notes", type=int, default=500)
+    parser.add_argument("--alignments", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    tr_text = make_text(rnd, 100 * args.alignments)
+    tl_text = make_text(rnd, 120 * args.alignments)
+    tr = {"id": 21, "content": tr_text, "notes": make_notes(rnd, len(tr_text), args.notes, 1)}
+    tl = {"id": 21, "content": tl_text, "notes": make_notes(rnd, len(tl_text), args.notes, args.notes + 1)}
+
+    from tests.base_server import _app
+    with _app.app_context():
+        db.drop_all()
+        db.create_all()
+        load_fixtures()
+        replace_translation_alignments(21, 21, make_alignments(rnd, len(tr_text), len(tl_text), args.alignments))
+        db.session.commit()
+
+        print("%s characters, %s notes, %s alignments" % (len(tr_text), args.notes, args.alignments))
+        benchmarks = (
+            ("add_notes_refs_to_text", "legacy",
+             lambda: legacy_add_notes_refs_to_text(tr_text, copy.deepcopy(tr["notes"]))),
+            ("add_notes_refs_to_text", "sweep", lambda: add_notes_refs_to_text(tr_text, copy.deepcopy(tr["notes"]))),
+            ("add_notes_refs", "legacy", lambda: legacy_add_notes_refs(copy.deepcopy(tr), copy.deepcopy(tl))),
+            ("add_notes_refs", "sweep", lambda: add_notes_refs(copy.deepcopy(tr), copy.deepcopy(tl))),
+        )
+        for label, name, func in benchmarks:
+            duration = min(timeit.repeat(func, number=1, repeat=args.repeat))
+            print("%-24s %-8s %8.1f ms" % (label, name, duration * 1000))
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,63 @@
+"""
+Benchmark of the pointer re-anchoring diff on a long content, for a single edit,
+a few grouped edits and edits scattered over the whole content.
+The pointers of every word are mapped, and the words found back unchanged are counted (the edited ones are not).
+
+usage: python utils/benchmarks/bench_reanchoring.py [--words N]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "utils", "benchmarks"))
+
+from app.api.reanchoring import OffsetMap  # noqa: E402
+from bench_alignment_suggestions import make_charter  # noqa: E402
+
+WORD_REGEX = re.compile(r'\w+')
+
+
+def edit(html, positions, replacement):
+    parts = []
+    last = 0
+    for pos in sorted(positions):
+        m = WORD_REGEX.search(html, pos)
+        if m is None or m.start() < last:
+            continue
+        parts.append(html[last:m.start()])
+        parts.append(replacement(m.group(0)))
+        last = m.end()
+    parts.append(html[last:])
+    return "".join(parts)
+
+
+def run(label, old, new):
+    start = time.perf_counter()
+    offset_map = OffsetMap(old, new)
+    duration = time.perf_counter() - start
+    words = list(WORD_REGEX.finditer(old))
+    start = time.perf_counter()
+    mapped = [offset_map.map_range(m.start(), m.end()) for m in words]
+    mapping = time.perf_counter() - start
+    kept = sum(1 for m, (s, e, _) in zip(words, mapped) if new[s:e] == m.group(0))
+    print("%-20s diff %8.1f ms  map %6.1f ms  %s/%s words found back"
+          % (label, duration * 1000, mapping * 1000, kept, len(words)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--words", type=int, default=20000)
+    args = parser.parse_args()
+
+    words, html, _ = make_charter(args.words)
+    print("content: %s words, %s characters" % (words, len(html)))
+    rnd = random.Random(0)
+    middle = len(html) // 2
+    run("one edit", html, edit(html, [middle], lambda word: "<hi rend=\"i\">%s</hi> et" % word))
+    run("grouped edits", html, edit(html, [middle + rnd.randint(0, 2000) for _ in range(20)], str.upper))
+    run("scattered edits", html, edit(html, [rnd.randint(0, len(html)) for _ in range(500)], str.upper))
@@ -0,0 +1,44 @@
+"""
+Benchmark of split_segments() against the DOM based implementation it replaced.
+
+A long cartulary is built from the transcription and translation test data,
+with a segment marker at the end of each line.
+
+usage: python utils/benchmarks/bench_split_segments.py [--repeat N]
+"""
+import argparse
+import glob
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tests", "api"))
+
+from test_split_segments import legacy_split_segments, make_contents, DATA_PATH  # noqa: E402
+from app.api.alignments.alignments_translation import split_segments  # noqa: E402
+
+
+def make_cartulary():
+    files = sorted(glob.glob(os.path.join(DATA_PATH, 'transcription', '*.txt')) +
+                   glob.glob(os.path.join(DATA_PATH, 'translation', '*.txt')))
+    texts = []
+    for filename in files:
+        with open(filename) as f:
+            texts.append(f.read())
+    by_line, _ = make_contents("\n\n".join(texts))
+    return by_line
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    html = make_cartulary()
+    segments = split_segments(html)
+    print("content: %s characters, %s segments" % (len(html), len(segments)))
+    for name, func in (("dom (bs4)", legacy_split_segments), ("single pass", split_segments)):
+        duration = min(timeit.repeat(lambda: func(html), number=1, repeat=args.repeat))
+        print("%-12s %8.1f ms" % (name, duration * 1000))
@@ -0,0 +1,89 @@
+"""
+Benchmark of the replacement of the translation alignments of a document:
+one ORM object per row (previous implementation) against one DELETE and one executemany INSERT.
+
+Runs against the test database (config "test"), which is recreated.
+
+usage: python utils/benchmarks/bench_translation_alignments.py [--size N] [--repeat N]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+from app import create_app, db  # noqa: E402
+
+FIXTURES_PATH = os.path.join(ROOT, 'tests', 'data', 'fixtures')
+FIXTURES = [
+    os.path.join(FIXTURES_PATH, "users", "default_users.sql"),
+    os.path.join(FIXTURES_PATH, "refs.sql"),
+    os.path.join(FIXTURES_PATH, "documents", "doc_21.sql"),
+    os.path.join(FIXTURES_PATH, "transcriptions", "transcription_doc_21_prof1.sql"),
+    os.path.join(FIXTURES_PATH, "translations", "translation_doc_21_prof1.sql"),
+]
+
+
+def load_fixtures():
+    with db.engine.connect() as connection:
+        for fixture in FIXTURES:
+            with open(fixture) as f:
+                for _s in f.readlines():
+                    trans = connection.begin()
+                    connection.execute(_s, multi=True)
+                    trans.commit()
+
+
+def legacy_replace(transcription_id, translation_id, ptrs):
+    from app.models import AlignmentTranslation
+    for old_al in AlignmentTranslation.query.filter(
+            AlignmentTranslation.transcription_id == transcription_id,
+            AlignmentTranslation.translation_id == translation_id
+    ).all():
+        db.session.delete(old_al)
+    for (ptr_transcription_start, ptr_transcription_end,
+         ptr_translation_start, ptr_translation_end) in ptrs:
+        db.session.add(AlignmentTranslation(
+            transcription_id=transcription_id,
+            translation_id=translation_id,
+            ptr_transcription_start=ptr_transcription_start,
+            ptr_transcription_end=ptr_transcription_end,
+            ptr_translation_start=ptr_translation_start,
+            ptr_translation_end=ptr_translation_end
+        ))
+    db.session.commit()
+
+
+def bulk_replace(transcription_id, translation_id, ptrs):
+    from app.api.alignments.alignments_translation import replace_translation_alignments
+    replace_translation_alignments(transcription_id, translation_id, ptrs)
+    db.session.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    app = create_app("test")
+    with app.app_context():
+        from app.models import Transcription, Translation
+
+        db.drop_all()
+        db.create_all()
+        load_fixtures()
+        tr = Transcription.query.filter(Transcription.doc_id == 21).first()
+        tl = Translation.query.filter(Translation.doc_id == 21).first()
+
+        ptrs = [(i * 10, i * 10 + 9, i * 12, i * 12 + 11) for i in range(args.size)]
+        print("%s alignments" % args.size)
+        for name, func in (("orm objects", legacy_replace), ("bulk", bulk_replace)):
+            # the first run fills the table, the measured runs replace existing rows
+            func(tr.id, tl.id, ptrs)
+            duration = min(timeit.repeat(lambda: func(tr.id, tl.id, ptrs), number=1, repeat=args.repeat))
+            print("%-12s %8.1f ms" % (name, duration * 1000))
+        db.session.remove()
+        db.drop_all()
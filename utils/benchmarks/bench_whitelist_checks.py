@@ -0,0 +1,74 @@
+"""
+Benchmark of the whitelist membership check of a content write, for whitelists of a growing size:
+loading the members of the whitelist (previous implementation) against an EXISTS on whitelist_has_user.
+Each check runs in a new session, as the check of a request does.
+
+Runs against the test database (config "test"), which is recreated.
+
+usage: python utils/benchmarks/bench_whitelist_checks.py [--sizes N,N,...] [--repeat N]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+from app import create_app, db  # noqa: E402
+
+
+def make_whitelist(size):
+    from app.models import Whitelist, association_whitelist_has_user, User
+
+    whitelist = Whitelist(label="bench %s" % size)
+    db.session.add(whitelist)
+    db.session.flush()
+    first_id = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+    db.session.execute(User.__table__.insert(), [
+        {"id": first_id + i, "username": "student%s_%s" % (size, i), "email": "student%s_%s@bench" % (size, i),
+         "password": "", "is_active": True}
+        for i in range(size)
+    ])
+    db.session.execute(association_whitelist_has_user.insert(), [
+        {"whitelist_id": whitelist.id, "user_id": first_id + i} for i in range(size)
+    ])
+    db.session.commit()
+    # the last member added, as a student checking its own access
+    return whitelist.id, first_id + size - 1
+
+
+def legacy_check(whitelist_id, user_id):
+    from app.models import User, Whitelist
+    db.session.remove()
+    user = User.query.get(user_id)
+    return user in Whitelist.query.get(whitelist_id).users
+
+
+def exists_check(whitelist_id, user_id):
+    from flask import g
+    from app.utils import is_whitelist_member
+    db.session.remove()
+    g.pop("whitelist_members", None)
+    return is_whitelist_member(whitelist_id, user_id)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="30,300,800")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    app = create_app("test")
+    with app.app_context(), app.test_request_context():
+        db.drop_all()
+        db.create_all()
+        for size in [int(s) for s in args.sizes.split(",")]:
+            whitelist_id, user_id = make_whitelist(size)
+            timings = []
+            for func in (legacy_check, exists_check):
+                assert func(whitelist_id, user_id)
+                timings.append(min(timeit.repeat(lambda: func(whitelist_id, user_id), number=1, repeat=args.repeat)))
+            print("%5s members   load members %7.2f ms   exists %6.2f ms" % (size, timings[0] * 1000, timings[1] * 1000))
+        db.session.remove()
+        db.drop_all()